@@ -5,6 +5,15 @@ from . import meds
 from .meds import MEDS
 from .meds import split_mosaic, reject_outliers
 
+from . import asyncmeds
+from .asyncmeds import AsyncMEDS
+
+from . import parallel
+from .parallel import parallel_map
+
+from . import partition
+from .partition import plan_chunks
+
 from . import bounds
 from . import util
 from .util import validate_meds
@@ -18,5 +27,12 @@ from .coadd import MEDSCoadder, MEDSCoaddMaker
 
 from .extractor import MEDSExtractor, extract_range, extract_catalog
 from .number_extractor import MEDSNumberExtractor, extract_numbers
+from .number_extractor import extract_cone, extract_box
 
 from . import compare
+
+from . import derived
+from .derived import add_derived_maps
+
+from . import compress
+from .compress import compress_meds
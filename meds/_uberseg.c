@@ -4,6 +4,7 @@
 #include <stdlib.h>
 #include <math.h>
 #include <assert.h>
+#include <pthread.h>
 #include <Python.h>
 #include <numpy/arrayobject.h>
 
@@ -105,8 +106,13 @@ static PyObject * uberseg_tree(PyObject* self, PyObject* args) {
     return NULL;
   }
 
+  if(Ninds <= 0) {
+    Py_INCREF(Py_None);
+    return Py_None;
+  }
+
   obj = (struct mytype *)malloc(sizeof(struct mytype)*Ninds);
-  if(obj == NULL) exit(1);
+  if(obj == NULL) return PyErr_NoMemory();
   
   for(k=0;k<Ninds;++k) {
     ptrx = (int*)PyArray_GETPTR1(obj_inds_x,k);
@@ -119,10 +125,17 @@ static PyObject * uberseg_tree(PyObject* self, PyObject* args) {
   }
   
   tree = fast3tree_init(Ninds,obj);
-  if(tree == NULL) exit(1);
+  if(tree == NULL) {
+    free(obj);
+    return PyErr_NoMemory();
+  }
 
   res = fast3tree_results_init();    
-  if(res == NULL) exit(1);
+  if(res == NULL) {
+    free(obj);
+    fast3tree_free(&tree);
+    return PyErr_NoMemory();
+  }
 
   float maxr = 1.1*sqrt(Nx*Nx+Ny*Ny);
     
@@ -149,7 +162,14 @@ static PyObject * uberseg_tree(PyObject* self, PyObject* args) {
 	fac *= 1.1;
 	fast3tree_results_clear(res);
 	fast3tree_find_sphere(tree,res,pos,r*fac);
-      } while(res->num_points == 0 && r*fac <= maxr);
+      } while(!res->error && res->num_points == 0 && r*fac <= maxr);
+
+      if(res->error) {
+	free(obj);
+	fast3tree_free(&tree);
+	fast3tree_results_free(res);
+	return PyErr_NoMemory();
+      }
       
       segmin = -1;
       for(k=0;k<res->num_points;++k) {
@@ -183,9 +203,268 @@ static PyObject * uberseg_tree(PyObject* self, PyObject* args) {
   return Py_None;
 }
 
+/*
+  uberseg for a single contiguous cutout, the same algorithm as
+  uberseg_tree.  The seg pixels are put in the tree in row-major order.
+
+  obj must have room for Nx*Ny entries.  Does not touch any python objects,
+  so can be called without the GIL.  Returns 0 on success, -1 on allocation
+  failure.
+*/
+static int uberseg_tree_cutout(const int *seg, float *weight, int Nx, int Ny,
+                               int object_number, struct mytype *obj) {
+  int x=0,y=0,k=0,segmin=0,segval=0;
+  int64_t Ninds=0;
+  float dmin=0,r=0,dx=0,d=0;
+  float pos[2],fac=0;
+
+  struct fast3tree *tree = NULL;
+  struct fast3tree_results *res = NULL;
+
+  for(x=0;x<Nx;++x) {
+    for(y=0;y<Ny;++y) {
+      segval = seg[x*Ny+y];
+      if(segval != 0) {
+	obj[Ninds].idx = Ninds;
+	obj[Ninds].seg = segval;
+	obj[Ninds].pos[0] = (float)x;
+	obj[Ninds].pos[1] = (float)y;
+	++Ninds;
+      }
+    }
+  }
+
+  if(Ninds == 0)
+    return 0;
+
+  tree = fast3tree_init(Ninds,obj);
+  if(tree == NULL) return -1;
+
+  res = fast3tree_results_init();
+  if(res == NULL) {
+    fast3tree_free(&tree);
+    return -1;
+  }
+
+  float maxr = 1.1*sqrt(Nx*Nx+Ny*Ny);
+
+  for(x=0;x<Nx;++x) {
+    for(y=0;y<Ny;++y) {
+
+      //shortcuts
+      segval = seg[x*Ny+y];
+      if(segval == object_number)
+	continue;
+
+      if(segval > 0 && segval != object_number) {
+	weight[x*Ny+y] = 0.0;
+	continue;
+      }
+
+      //must do search
+      pos[0] = (float)x;
+      pos[1] = (float)y;
+      r = fast3tree_find_next_closest_distance(tree,res,pos);
+      fac = 1.0/1.1;
+      do {
+	fac *= 1.1;
+	fast3tree_results_clear(res);
+	fast3tree_find_sphere(tree,res,pos,r*fac);
+      } while(!res->error && res->num_points == 0 && r*fac <= maxr);
+
+      if(res->error) {
+	fast3tree_free(&tree);
+	fast3tree_results_free(res);
+	return -1;
+      }
+
+      segmin = -1;
+      for(k=0;k<res->num_points;++k) {
+	dx = res->points[k]->pos[0]-x;
+	d = dx*dx;
+	dx = res->points[k]->pos[1]-y;
+	d += dx*dx;
+	if(segmin == -1 || d < dmin) {
+	  segmin = res->points[k]->seg;
+	  dmin = d;
+	}
+      }
+
+      if(segmin == -1) {
+	continue;
+      }
+
+      if(segmin != object_number) {
+	weight[x*Ny+y] = 0.0;
+      }
+    }
+  }
+
+  fast3tree_free(&tree);
+  fast3tree_results_free(res);
+
+  return 0;
+}
+
+struct uberseg_batch {
+  const int *segs;
+  float *weights;
+  const int *object_numbers;
+  int ncutout;
+  int Nx;
+  int Ny;
+
+  // next cutout to process and error flag, protected by the lock
+  int next;
+  int failed;
+  pthread_mutex_t lock;
+};
+
+static void * uberseg_batch_worker(void *arg) {
+  struct uberseg_batch *batch = (struct uberseg_batch *)arg;
+  int k=0, status=0;
+  npy_intp npix = (npy_intp)batch->Nx * batch->Ny;
+  struct mytype *obj = NULL;
+
+  obj = (struct mytype *)malloc(sizeof(struct mytype)*npix);
+
+  pthread_mutex_lock(&batch->lock);
+  if(obj == NULL) batch->failed = 1;
+  pthread_mutex_unlock(&batch->lock);
+
+  while(obj != NULL) {
+    pthread_mutex_lock(&batch->lock);
+    if(batch->failed) {
+      k = batch->ncutout;
+    } else {
+      k = batch->next++;
+    }
+    pthread_mutex_unlock(&batch->lock);
+
+    if(k >= batch->ncutout)
+      break;
+
+    status = uberseg_tree_cutout(batch->segs + k*npix,
+				 batch->weights + k*npix,
+				 batch->Nx, batch->Ny,
+				 batch->object_numbers[k], obj);
+    if(status != 0) {
+      pthread_mutex_lock(&batch->lock);
+      batch->failed = 1;
+      pthread_mutex_unlock(&batch->lock);
+      break;
+    }
+  }
+
+  free(obj);
+  return NULL;
+}
+
+/*
+  uberseg for a stack of cutouts, processed by a pool of nthreads threads
+  with the GIL released
+
+  segs is an int32 array with shape (ncutout, Nx, Ny), weights a float32
+  array of the same shape which is modified in place, and object_numbers
+  an int32 array with shape (ncutout,).  All must be C contiguous.
+*/
+static PyObject * uberseg_tree_batch(PyObject* self, PyObject* args) {
+  PyObject* seg_obj = NULL;
+  PyObject* weight_obj = NULL;
+  PyObject* number_obj = NULL;
+  PyArrayObject *segs, *weights, *numbers;
+  int nthreads=1, nstarted=0, i=0;
+  pthread_t *threads = NULL;
+  struct uberseg_batch batch;
+
+  if (!PyArg_ParseTuple(args, (char*)"OOOi", &seg_obj, &weight_obj, &number_obj, &nthreads)) {
+    return NULL;
+  }
+
+  if(!PyArray_Check(seg_obj) || !PyArray_Check(weight_obj) || !PyArray_Check(number_obj)) {
+    PyErr_SetString(PyExc_TypeError, "segs, weights and object_numbers must be arrays");
+    return NULL;
+  }
+  segs = (PyArrayObject *)seg_obj;
+  weights = (PyArrayObject *)weight_obj;
+  numbers = (PyArrayObject *)number_obj;
+
+  if(PyArray_TYPE(segs) != NPY_INT32
+     || PyArray_TYPE(weights) != NPY_FLOAT32
+     || PyArray_TYPE(numbers) != NPY_INT32) {
+    PyErr_SetString(PyExc_TypeError, "segs and object_numbers must be int32, weights float32");
+    return NULL;
+  }
+  if(PyArray_NDIM(segs) != 3 || PyArray_NDIM(weights) != 3 || PyArray_NDIM(numbers) != 1) {
+    PyErr_SetString(PyExc_ValueError, "segs and weights must be 3-d, object_numbers 1-d");
+    return NULL;
+  }
+  if(!PyArray_IS_C_CONTIGUOUS(segs) || !PyArray_IS_C_CONTIGUOUS(weights)
+     || !PyArray_IS_C_CONTIGUOUS(numbers) || !PyArray_ISWRITEABLE(weights)) {
+    PyErr_SetString(PyExc_ValueError, "arrays must be C contiguous and weights writeable");
+    return NULL;
+  }
+  for(i=0;i<3;++i) {
+    if(PyArray_DIM(segs,i) != PyArray_DIM(weights,i)) {
+      PyErr_SetString(PyExc_ValueError, "segs and weights must have the same shape");
+      return NULL;
+    }
+  }
+  if(PyArray_DIM(numbers,0) != PyArray_DIM(segs,0)) {
+    PyErr_SetString(PyExc_ValueError, "need one object number per cutout");
+    return NULL;
+  }
+
+  batch.segs = (const int *)PyArray_DATA(segs);
+  batch.weights = (float *)PyArray_DATA(weights);
+  batch.object_numbers = (const int *)PyArray_DATA(numbers);
+  batch.ncutout = (int)PyArray_DIM(segs,0);
+  batch.Nx = (int)PyArray_DIM(segs,1);
+  batch.Ny = (int)PyArray_DIM(segs,2);
+  batch.next = 0;
+  batch.failed = 0;
+
+  if(nthreads > batch.ncutout) nthreads = batch.ncutout;
+  if(nthreads < 1) nthreads = 1;
+
+  if(nthreads > 1) {
+    threads = (pthread_t *)malloc(sizeof(pthread_t)*(nthreads-1));
+    if(threads == NULL) return PyErr_NoMemory();
+  }
+
+  pthread_mutex_init(&batch.lock, NULL);
+
+  Py_BEGIN_ALLOW_THREADS
+
+  // the calling thread works too, so start nthreads-1 more; if some
+  // fail to start the rest of the pool does the work
+  for(i=0;i<nthreads-1;++i) {
+    if(pthread_create(&threads[i], NULL, uberseg_batch_worker, &batch) != 0)
+      break;
+    ++nstarted;
+  }
+
+  uberseg_batch_worker(&batch);
+
+  for(i=0;i<nstarted;++i)
+    pthread_join(threads[i], NULL);
+
+  Py_END_ALLOW_THREADS
+
+  pthread_mutex_destroy(&batch.lock);
+  free(threads);
+
+  if(batch.failed)
+    return PyErr_NoMemory();
+
+  Py_INCREF(Py_None);
+  return Py_None;
+}
+
 static PyMethodDef methods[] = {
   {"uberseg_direct", (PyCFunction)uberseg_direct, METH_VARARGS, "fast uberseg\n"},
   {"uberseg_tree", (PyCFunction)uberseg_tree, METH_VARARGS, "fast uberseg w/ tree\n"},
+  {"uberseg_tree_batch", (PyCFunction)uberseg_tree_batch, METH_VARARGS, "fast uberseg w/ tree for a stack of cutouts, in threads\n"},
   {NULL}  /* Sentinel */
 };
 
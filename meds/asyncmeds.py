@@ -0,0 +1,207 @@
+"""
+AsyncMEDS
+    An asyncio front end to a MEDS file
+"""
+from __future__ import print_function
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from .meds import MEDS
+
+
+class AsyncMEDS(object):
+    """
+    An asyncio front end to a MEDS file, with awaitable reads
+
+    Blocking reads run on a bounded pool of threads, sharing one thread-safe
+    MEDS reader in which each thread has its own file handle.  Concurrent
+    requests for the same object and cutout type are merged into a single
+    read of the mosaic for that object, and each caller gets the same
+    read-only array.
+
+    Use from a single event loop.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the MEDS file.
+    max_workers : int, optional
+        Maximum number of threads doing reads.  Default 8.
+    **kw :
+        Extra keywords for the MEDS reader, e.g. mmap or cache_bytes.
+
+    Examples
+    --------
+    >>> async with AsyncMEDS(filename) as am:
+    ...     im = await am.get_cutout(35, 3)
+    ...     wt = await am.get_cutout(35, 3, type='weight')
+    """
+    def __init__(self, filename, max_workers=8, **kw):
+        if max_workers < 1:
+            raise ValueError("max_workers must be >= 1, got %s" % max_workers)
+
+        kw['threadsafe'] = True
+        self._meds = MEDS(filename, **kw)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        # reads in progress, keyed by what they read
+        self._inflight = {}
+
+    @property
+    def meds(self):
+        """
+        the underlying MEDS reader
+        """
+        return self._meds
+
+    @property
+    def size(self):
+        return self._meds.size
+
+    def __getitem__(self, item):
+        return self._meds[item]
+
+    async def get_cutout(self, iobj, icutout, type='image'):
+        """Get a single cutout for the indicated entry and image type.
+
+        The mosaic for the object is read, and shared with concurrent
+        requests for other cutouts of the same object.
+
+        Parameters
+        ----------
+        iobj : int
+            Index of the object.
+        icutout : int
+            Index of the cutout for this object.
+        type: string, optional
+            Cutout type. Default is 'image'.  See MEDS.get_cutout.
+
+        Returns
+        -------
+        cutout : np.array
+            The cutout image, read-only.
+        """
+        self._meds._check_indices(iobj, icutout=icutout)
+
+        if type == 'psf':
+            psfs = await self._run(
+                ('psf', iobj), self._meds.get_psf_list, iobj,
+            )
+            return psfs[icutout]
+
+        mosaic = await self.get_mosaic(iobj, type=type)
+
+        box_size = mosaic.shape[1]
+        return mosaic[icutout*box_size:(icutout+1)*box_size]
+
+    async def get_mosaic(self, iobj, type='image'):
+        """Get a mosaic of all cutouts associated with this coadd object.
+
+        Parameters
+        ----------
+        iobj : int
+            Index of the object.
+        type: string, optional
+            Cutout type. Default is 'image'.  See MEDS.get_mosaic.
+
+        Returns
+        -------
+        mosaic : np.array
+            An image holding all of the cutouts, read-only.
+        """
+        return await self._run(
+            (type, iobj), self._meds.get_mosaic, iobj, type=type,
+        )
+
+    async def get_object_bundle(self, iobj, types=None, psf=True):
+        """Get all the cutouts for an object as stacks, with the psfs,
+        jacobians and centers.
+
+        The reads for the different extensions run concurrently.
+
+        Parameters
+        ----------
+        iobj : int
+            Index of the object.
+        types : list of str, optional
+            The cutout types.  Default is all in the file.
+        psf : bool, optional
+            If True, include the psfs.  Default True.
+
+        Returns
+        -------
+        bundle : dict
+            The read-only arrays, see MEDS.get_object_bundle.
+        """
+        if types is not None:
+            types = tuple(types)
+
+        return await self._run(
+            ('bundle', iobj, types, psf),
+            self._meds.get_object_bundle,
+            iobj, types=types, psf=psf, parallel=True,
+        )
+
+    async def _run(self, key, func, *args, **kw):
+        """
+        run the read in the executor, or wait on the identical read if one
+        is already in progress
+        """
+        future = self._inflight.get(key)
+        if future is None:
+            loop = asyncio.get_event_loop()
+            future = loop.run_in_executor(
+                self._executor,
+                functools.partial(_call_read_only, func, *args, **kw),
+            )
+            self._inflight[key] = future
+            future.add_done_callback(
+                functools.partial(self._remove_inflight, key)
+            )
+
+        # a cancelled caller should not cancel the read for the others
+        return await asyncio.shield(future)
+
+    def _remove_inflight(self, key, future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+    def close(self):
+        """
+        wait for reads in progress, then close the file
+        """
+        self._executor.shutdown(wait=True)
+        self._meds.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        # closing waits for the reads in progress, so it is run in the
+        # default executor rather than blocking the event loop
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.close)
+
+    def __repr__(self):
+        return 'AsyncMEDS(%s)' % repr(self._meds)
+
+
+def _call_read_only(func, *args, **kw):
+    """
+    call the function and mark the resulting array, or the arrays in the
+    resulting list or dict, read only since it is shared between callers
+    """
+    data = func(*args, **kw)
+
+    if isinstance(data, dict):
+        arrays = data.values()
+    elif isinstance(data, list):
+        arrays = data
+    else:
+        arrays = [data]
+
+    for d in arrays:
+        d.flags.writeable = False
+
+    return data
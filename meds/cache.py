@@ -0,0 +1,114 @@
+"""
+LRUCache
+    A least-recently-used cache with a limit on the total number of bytes
+    held
+"""
+from __future__ import print_function
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    A least-recently-used cache of arrays, limited by total size in bytes
+
+    Stored numpy arrays are marked read-only, since the same array is handed
+    to every caller.  Tuples of arrays are also accepted.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The maximum number of bytes to hold.  When adding an entry would
+        exceed this limit, the least recently used entries are evicted.
+        Entries larger than the limit are not stored.
+    """
+    def __init__(self, max_bytes):
+        if max_bytes < 0:
+            raise ValueError("max_bytes must be >= 0, got %s" % max_bytes)
+
+        self.max_bytes = int(max_bytes)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.clear()
+
+    def get(self, key):
+        """
+        get the entry for the key, or None if it is not present
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """
+        add an entry, evicting old entries as needed to stay within the
+        byte limit
+        """
+        nbytes = _set_readonly(value)
+
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+
+            if nbytes > self.max_bytes:
+                return
+
+            while self._data and self.nbytes + nbytes > self.max_bytes:
+                _, (_, old_nbytes) = self._data.popitem(last=False)
+                self.nbytes -= old_nbytes
+                self.evictions += 1
+
+            self._data[key] = (value, nbytes)
+            self.nbytes += nbytes
+
+    def clear(self):
+        """
+        remove all entries and reset the counters
+        """
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def get_stats(self):
+        """
+        get a dict with the hits, misses, evictions, number of
+        entries and bytes held
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'nentries': len(self._data),
+                'nbytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+def _set_readonly(value):
+    """
+    mark the array, or tuple of arrays, read only and return the
+    total number of bytes
+    """
+    if isinstance(value, tuple):
+        return sum(_set_readonly(v) for v in value)
+
+    value.flags.writeable = False
+    return value.nbytes
@@ -396,7 +396,7 @@ class MEDSCoadder(dict):
 
     def _get_jacobian_matrix(self):
         j = self.target_jacobian
-        return np.matrix(
+        return np.array(
             [
                 [j.dudrow, j.dudcol],
                 [j.dvdrow, j.dvdcol],
@@ -455,19 +455,24 @@ class MEDSCoadder(dict):
 
         obslist = ngmix.ObsList()
 
-        imlist = m.get_cutout_list(iobj)
-        if len(imlist) == 1:
+        if m["ncutout"][iobj] == 1:
             # there is just the coadd; return the
             # empty obslist
             imflags = None
             return obslist, imflags
 
-        wtlist = m.get_cutout_list(iobj, type="weight")
-        bmlist = m.get_cutout_list(iobj, type="bmask")
+        # the psfs come from our own psf data; the arrays are
+        # copies so can be modified below
+        bundle = m.get_object_bundle(
+            iobj,
+            types=["image", "weight", "bmask"],
+            psf=False,
+            interp_seg=True,
+        )
 
-        imlist = imlist[1:]
-        wtlist = wtlist[1:]
-        bmlist = bmlist[1:]
+        imlist = list(bundle["image"][1:])
+        wtlist = list(bundle["weight"][1:])
+        bmlist = list(bundle["bmask"][1:])
 
         if self["reject_outliers"]:
             nreject = reject_outliers(
@@ -483,9 +488,8 @@ class MEDSCoadder(dict):
         ncutout = len(imlist)
         imflags = np.zeros(ncutout, dtype="i4")
 
-        seglist = [
-            m.interpolate_coadd_seg(iobj, i) for i in range(1, ncutout + 1)
-        ]
+        seglist = bundle["interp_seg"][1:]
+        jacobians = bundle["jacobian"]
 
         # note starting at 1 assuming coadd is at 0
         for i in range(ncutout):
@@ -539,14 +543,13 @@ class MEDSCoadder(dict):
                 imflags[i] |= CUTOUT_ALL_WEIGHT_ZERO
                 continue
 
-            jdict = m.get_jacobian(iobj, icut)
             jacobian = ngmix.Jacobian(
-                row=jdict["row0"],
-                col=jdict["col0"],
-                dudrow=jdict["dudrow"],
-                dudcol=jdict["dudcol"],
-                dvdrow=jdict["dvdrow"],
-                dvdcol=jdict["dvdcol"],
+                row=bundle["cutout_row"][icut],
+                col=bundle["cutout_col"][icut],
+                dudrow=jacobians[icut, 0, 0],
+                dudcol=jacobians[icut, 0, 1],
+                dvdrow=jacobians[icut, 1, 0],
+                dvdcol=jacobians[icut, 1, 1],
             )
 
             ccen = (np.array(im.shape) - 1.0) / 2.0
@@ -0,0 +1,501 @@
+"""
+compress_meds
+    Write a tile-compressed copy of a MEDS file, as fpack would, compressing
+    ranges of tiles of the cutout extensions in parallel
+
+The compression settings are the fpack keywords, for example
+
+    fpack_pars = {
+        'FZALGOR': 'RICE_1',
+        'FZQMETHD': 'SUBTRACTIVE_DITHER_2',
+        'FZQVALUE': 4,
+        'FZTILE': '(10240,1)',
+    }
+
+Integer extensions such as seg and bmask are compressed losslessly.
+Floating point extensions such as image and weight are quantized with
+FZQVALUE and FZQMETHD; send FZQVALUE 0 for lossless compression, which
+uses GZIP_2 for floating point data unless GZIP_1 is requested.
+"""
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+
+import numpy
+import fitsio
+
+# used for keywords missing from fpack_pars, following fpack
+DEFAULT_FPACK_PARS = {
+    'FZALGOR': 'RICE_1',
+    'FZQMETHD': 'SUBTRACTIVE_DITHER_1',
+    'FZQVALUE': 4,
+    'FZTILE': 'ROW',
+}
+
+# size of the FITS blocks that HDUs are padded to
+_FITS_BLOCK = 2880
+
+
+def compress_meds(
+    meds_file,
+    out_file,
+    fpack_pars=None,
+    n_jobs=1,
+    backend='loky',
+    block_tiles=100,
+    clobber=True,
+):
+    """
+    Write a tile-compressed copy of a MEDS file
+
+    The cutout and psf extensions are split into contiguous ranges of
+    whole tiles, which are compressed in parallel, each job reading its
+    range of the mosaic in large blocks of tiles.  The compressed tiles of
+    each extension are then joined in order, and put together with the
+    other extensions, in the original order.  The output is the same for
+    any number of jobs.
+
+    Parameters
+    ----------
+    meds_file : str
+        The uncompressed MEDS file.
+    out_file : str
+        The output file, e.g. 'file.fits.fz'.
+    fpack_pars : dict, optional
+        The fpack keywords FZALGOR, FZQMETHD, FZQVALUE and FZTILE.  Missing
+        keywords are taken from the header of each extension, as written
+        by MEDSMaker, or from DEFAULT_FPACK_PARS.  Lossy compression is
+        seeded from the data checksum, so the output is reproducible.
+    n_jobs : int, optional
+        Number of parallel joblib jobs.  Default 1, which runs serially
+        without joblib.  Extensions are split into about two ranges per
+        job, of at least block_tiles tiles; with FZTILE 'ROW' or 'WHOLE'
+        an extension is one tile and is compressed by a single job.
+    backend : str, optional
+        The joblib backend.  Default 'loky'.
+    block_tiles : int, optional
+        Number of tiles read and written at once by each job.  Default 100.
+    clobber : bool, optional
+        If True, overwrite an existing output file.  Default True.
+    """
+    if meds_file == out_file:
+        raise ValueError("output file name equals input")
+    if block_tiles < 1:
+        raise ValueError("block_tiles must be >= 1, got %s" % block_tiles)
+    if os.path.exists(out_file) and not clobber:
+        raise ValueError("output file %s exists" % out_file)
+
+    if n_jobs == 1:
+        nparts = 1
+    else:
+        import joblib
+
+        nparts = 2*joblib.effective_n_jobs(n_jobs)
+
+    with fitsio.FITS(meds_file) as fits:
+        hdu_ranges = []
+        extnames = []
+        for hdu in fits:
+            info = hdu.get_info()
+            hdu_ranges.append((info['header_start'], info['data_end']))
+
+            extname = hdu.get_extname()
+            if _is_cutout_extension(hdu, info):
+                extnames.append(extname)
+            else:
+                extnames.append(None)
+
+        ranges = {}
+        kws = {}
+        for extname in extnames:
+            if extname is not None:
+                ranges[extname], kws[extname] = _get_compression_ranges(
+                    fits[extname], fpack_pars, nparts, block_tiles,
+                )
+
+    tmpdir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(out_file)))
+    try:
+        tmp_files = {}
+        args = []
+        for extname in extnames:
+            if extname is None:
+                continue
+
+            tmp_files[extname] = []
+            for i, (start, end, kw) in enumerate(ranges[extname]):
+                tmp_file = os.path.join(tmpdir, '%s-%d.fits' % (extname, i))
+                tmp_files[extname].append(tmp_file)
+                args.append(
+                    (meds_file, extname, tmp_file, kw, start, end,
+                     block_tiles)
+                )
+
+        print('compressing: %s' % ', '.join(tmp_files))
+        if n_jobs == 1:
+            for arg in args:
+                _compress_range(*arg)
+        else:
+            jobs = [joblib.delayed(_compress_range)(*arg) for arg in args]
+            joblib.Parallel(n_jobs=n_jobs, backend=backend)(jobs)
+
+        print('writing:', out_file)
+        tmp_out = os.path.join(tmpdir, 'output.fits')
+        with open(tmp_out, 'wb') as fout, open(meds_file, 'rb') as fin:
+            for extname, (start, end) in zip(extnames, hdu_ranges):
+                if extname is None:
+                    _copy_bytes(fin, fout, start, end)
+                elif len(tmp_files[extname]) == 1:
+                    _copy_compressed_hdu(tmp_files[extname][0], fout)
+                else:
+                    try:
+                        _join_compressed_hdus(tmp_files[extname], fout)
+                    except _DescriptorOverflow:
+                        # the joined heap is too large for the 32 bit
+                        # offsets of the parts; compress as one range
+                        print('    compressing %s in one job' % extname)
+                        npix = ranges[extname][-1][1]
+                        _compress_range(
+                            meds_file, extname, tmp_files[extname][0],
+                            kws[extname], 0, npix, block_tiles,
+                        )
+                        _copy_compressed_hdu(tmp_files[extname][0], fout)
+
+        shutil.move(tmp_out, out_file)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    print('compressed file is in:', out_file)
+
+
+def _is_cutout_extension(hdu, info):
+    """
+    true for the uncompressed, non-empty cutout and psf extensions
+    """
+    extname = hdu.get_extname()
+    return (
+        (extname.endswith('_cutouts') or extname == 'psf')
+        and info['hdutype'] == fitsio.IMAGE_HDU
+        and not info['is_compressed_image']
+        and info['ndims'] == 1
+        and info['dims'][0] > 0
+    )
+
+
+def get_compression_kw(fpack_pars, dtype, header=None):
+    """
+    get the fitsio compression keywords for the fpack keywords
+
+    Parameters
+    ----------
+    fpack_pars : dict or None
+        The fpack keywords.  Missing keywords are taken from the header
+        or DEFAULT_FPACK_PARS.
+    dtype : numpy dtype
+        The pixel type; integer data are compressed losslessly.
+    header : dict or FITSHDR, optional
+        The header of the extension.
+
+    Returns
+    -------
+    kw : dict
+        The compress, tile_dims, qlevel, qmethod and dither_seed keywords
+        for fitsio.
+    """
+    pars = {}
+    for key in DEFAULT_FPACK_PARS:
+        if fpack_pars is not None and key in fpack_pars:
+            pars[key] = fpack_pars[key]
+        elif header is not None and key in header:
+            pars[key] = header[key]
+        else:
+            pars[key] = DEFAULT_FPACK_PARS[key]
+
+    kw = {'compress': str(pars['FZALGOR']).strip().upper()}
+
+    tile = str(pars['FZTILE']).strip().upper()
+    if tile not in ['ROW', 'WHOLE']:
+        try:
+            kw['tile_dims'] = [int(tile.strip('()').split(',')[0])]
+        except ValueError:
+            raise ValueError("could not parse FZTILE '%s'" % pars['FZTILE'])
+
+    is_float = numpy.dtype(dtype).kind == 'f'
+    if is_float and float(pars['FZQVALUE']) > 0:
+        kw['qlevel'] = float(pars['FZQVALUE'])
+        kw['qmethod'] = str(pars['FZQMETHD']).strip().upper()
+        kw['dither_seed'] = 'checksum'
+    else:
+        # integer data, or lossless float compression, which cfitsio
+        # only supports with gzip
+        kw['qlevel'] = None
+        if is_float and not kw['compress'].startswith('GZIP'):
+            kw['compress'] = 'GZIP_2'
+
+    return kw
+
+
+def _get_compression_ranges(hdu, fpack_pars, nparts, block_tiles):
+    """
+    split the extension into at most nparts ranges of whole tiles, each
+    at least block_tiles tiles, returning a list of (start, end, kw) and
+    the compression keywords for the whole extension
+
+    The dither seed of each range is offset by its first tile, so the
+    tiles are quantized as they would be in one range
+    """
+    npix = hdu.get_dims()[0]
+    dtype = hdu[0:1].dtype.newbyteorder('=')
+
+    header = hdu.read_header()
+    header.clean()
+
+    kw = get_compression_kw(fpack_pars, dtype, header=header)
+    tile_size = kw.get('tile_dims', [npix])[0]
+
+    ntiles = (npix + tile_size - 1) // tile_size
+    part_tiles = max(block_tiles, (ntiles + nparts - 1) // nparts)
+    if part_tiles >= ntiles:
+        return [(0, npix, kw)], kw
+
+    seed = kw.get('dither_seed')
+    if seed == 'checksum':
+        seed = _get_checksum_dither_seed(hdu[0:min(tile_size, npix)])
+
+    ranges = []
+    for first_tile in range(0, ntiles, part_tiles):
+        part_kw = dict(kw)
+        if seed is not None:
+            part_kw['dither_seed'] = (seed - 1 + first_tile) % 10000 + 1
+
+        start = first_tile*tile_size
+        end = min(start + part_tiles*tile_size, npix)
+        ranges.append((start, end, part_kw))
+
+    return ranges, kw
+
+
+def _get_checksum_dither_seed(tile):
+    """
+    the dither seed cfitsio makes from the first tile for
+    dither_seed='checksum': one plus the sum of the first 4 bytes per
+    pixel of the native data, modulo 10000
+    """
+    tile = numpy.ascontiguousarray(tile, dtype=tile.dtype.newbyteorder('='))
+    data = tile.view('u1')[:4*tile.size]
+    return int(data.sum(dtype='u8') % 10000) + 1
+
+
+def _compress_range(meds_file, extname, out_file, kw, start, end,
+                    block_tiles):
+    """
+    write a compressed copy of pixels [start, end) of one extension to its
+    own file, reading and writing blocks of whole tiles
+    """
+    with fitsio.FITS(meds_file) as fits:
+        hdu = fits[extname]
+        dtype = hdu[0:1].dtype.newbyteorder('=')
+
+        header = hdu.read_header()
+        header.clean()
+
+        npix = end - start
+        tile_size = kw.get('tile_dims', [npix])[0]
+        block_size = tile_size*block_tiles
+
+        with fitsio.FITS(out_file, 'rw', clobber=True) as out:
+            out.create_image_hdu(
+                dims=[npix], dtype=dtype, extname=extname, **kw
+            )
+            out_hdu = out[extname]
+            out_hdu.write_keys(header, clean=False)
+
+            for bstart in range(start, end, block_size):
+                bend = min(bstart + block_size, end)
+                out_hdu.write(hdu[bstart:bend], start=bstart - start)
+
+
+def _copy_compressed_hdu(tmp_file, fout):
+    """
+    copy the compressed extension, the second hdu, from the file
+    """
+    with fitsio.FITS(tmp_file) as fits:
+        info = fits[1].get_info()
+        start, end = info['header_start'], info['data_end']
+
+    with open(tmp_file, 'rb') as fin:
+        _copy_bytes(fin, fout, start, end)
+
+
+class _DescriptorOverflow(Exception):
+    pass
+
+
+# bytes per element for binary table formats; P and Q are descriptors
+_TFORM_SIZES = {
+    'L': 1, 'B': 1, 'I': 2, 'J': 4, 'K': 8, 'A': 1, 'E': 4, 'D': 8,
+    'C': 8, 'M': 16, 'P': 8, 'Q': 16,
+}
+
+
+def _join_compressed_hdus(tmp_files, fout):
+    """
+    write one compressed extension holding the tiles of the compressed
+    extensions, the second hdu, in the files, in order
+
+    The tile tables are written one after the other with the heap offsets
+    shifted, followed by the heaps.  The header is that of the first
+    file, with the image size, number of tiles, heap size and maximum
+    compressed tile size updated.
+    """
+    parts = []
+    for tmp_file in tmp_files:
+        with fitsio.FITS(tmp_file) as fits:
+            info = fits[1].get_info()
+            header = fits[1].read_header()
+        parts.append((info, header))
+
+    info, header = parts[0]
+    row_size = header['NAXIS1']
+    nfields = header['TFIELDS']
+
+    # the descriptor columns, with their offsets in the row
+    descriptors = []
+    offset = 0
+    for i in range(1, nfields + 1):
+        tform = header['TFORM%d' % i].strip()
+        repeat = ''
+        while tform[0].isdigit():
+            repeat += tform[0]
+            tform = tform[1:]
+        repeat = int(repeat) if repeat else 1
+
+        code = tform[0]
+        if code in 'PQ':
+            dt = '>i4' if code == 'P' else '>i8'
+            descriptors.append((i, code, tform[1], offset, dt))
+            size = repeat*_TFORM_SIZES[code]
+        elif code == 'X':
+            size = (repeat + 7) // 8
+        else:
+            size = repeat*_TFORM_SIZES[code]
+        offset += size
+
+    if offset != row_size:
+        raise ValueError(
+            "table rows are %d bytes, expected %d" % (row_size, offset)
+        )
+
+    # read the tables, shifting the heap offsets
+    tables = []
+    heap_ranges = []
+    heap_size = 0
+    max_lengths = {}
+    for tmp_file, (info, hdr) in zip(tmp_files, parts):
+        nrows = hdr['NAXIS2']
+        with open(tmp_file, 'rb') as fin:
+            fin.seek(info['data_start'])
+            table = numpy.frombuffer(
+                fin.read(nrows*row_size), dtype='u1',
+            ).reshape(nrows, row_size).copy()
+
+        for i, code, _, offset, dt in descriptors:
+            nbytes = 2*numpy.dtype(dt).itemsize
+            desc = table[:, offset:offset + nbytes].copy().view(dt)
+            if nrows > 0:
+                max_lengths[i] = max(
+                    max_lengths.get(i, 0), int(desc[:, 0].max()),
+                )
+            # empty arrays keep offset zero, as cfitsio writes them
+            used = desc[:, 0] > 0
+            heap_end = desc[used, 0].astype('i8') + desc[used, 1] + heap_size
+            if heap_end.size > 0 and heap_end.max() > numpy.iinfo(dt).max:
+                raise _DescriptorOverflow()
+            desc[used, 1] += heap_size
+            table[:, offset:offset + nbytes] = desc.view('u1')
+
+        tables.append(table)
+
+        heap_start = info['data_start'] + hdr.get('THEAP', nrows*row_size)
+        heap_ranges.append((heap_start, heap_start + hdr['PCOUNT']))
+        heap_size += hdr['PCOUNT']
+
+    nrows = sum(table.shape[0] for table in tables)
+    npix = sum(hdr['ZNAXIS1'] for _, hdr in parts)
+
+    # the header of the first part, with the sizes for the whole
+    info = parts[0][0]
+    with open(tmp_files[0], 'rb') as fin:
+        fin.seek(info['header_start'])
+        hdr_bytes = fin.read(info['data_start'] - info['header_start'])
+
+    cards = [
+        hdr_bytes[i:i + 80].decode('ascii')
+        for i in range(0, len(hdr_bytes), 80)
+    ]
+    values = {'NAXIS2': nrows, 'PCOUNT': heap_size, 'ZNAXIS1': npix}
+    if 'THEAP' in header:
+        values['THEAP'] = nrows*row_size
+    for i, code, type, _, _ in descriptors:
+        values['TFORM%d' % i] = '1%s%s(%d)' % (
+            code, type, max_lengths.get(i, 0),
+        )
+    cards = [_set_card_value(card, values) for card in cards]
+    fout.write(''.join(cards).encode('ascii'))
+
+    for table in tables:
+        fout.write(table.tobytes())
+    for tmp_file, (start, end) in zip(tmp_files, heap_ranges):
+        with open(tmp_file, 'rb') as fin:
+            _copy_bytes(fin, fout, start, end, pad=False)
+
+    npad = (-(nrows*row_size + heap_size)) % _FITS_BLOCK
+    if npad > 0:
+        fout.write(b'\0'*npad)
+
+
+def _set_card_value(card, values):
+    """
+    replace the value of the 80 character header card if its keyword is
+    in values, keeping the comment, formatted as cfitsio does
+    """
+    key = card[:8].strip()
+    if key not in values or card[8:10] != '= ':
+        return card
+
+    value = values[key]
+    old = card[10:]
+    if old.lstrip().startswith("'"):
+        end = old.index("'", old.index("'") + 1) + 1
+    else:
+        end = 20
+    comment = old[end:].lstrip()
+
+    if isinstance(value, str):
+        value = ("'%-8s'" % value).ljust(20)
+    else:
+        value = '%20d' % value
+
+    card = card[:10] + value
+    if comment:
+        card += ' ' + comment
+    return card[:80].ljust(80)
+
+
+def _copy_bytes(fin, fout, start, end, chunksize=64*1024*1024, pad=True):
+    """
+    copy bytes [start, end) of the input file, padding to a whole number
+    of FITS blocks unless pad is False
+    """
+    fin.seek(start)
+    nleft = end - start
+    while nleft > 0:
+        data = fin.read(min(chunksize, nleft))
+        if len(data) == 0:
+            raise IOError("unexpected end of file")
+        fout.write(data)
+        nleft -= len(data)
+
+    npad = (-(end - start)) % _FITS_BLOCK
+    if pad and npad > 0:
+        fout.write(b'\0'*npad)
@@ -40,6 +40,39 @@ default_config = {
     # ['weight','seg','bmask']
     'cutout_types': [],
 
+    # derived maps to compute after writing and store in the file,
+    # see meds.derived.add_derived_maps.  Allowed values are
+    # ['uberseg','cweight'].  These need weight and seg cutouts
+    'derived_types': [],
+
+    # If True, write the file tile-compressed, as fpack would, using the
+    # keywords in fpack_pars.  Ranges of tiles of the cutout extensions
+    # are compressed in parallel using the joblib settings.  Integer types
+    # such as seg and bmask are compressed losslessly, floating point types
+    # are quantized with FZQVALUE; see meds.compress.compress_meds
+    'fpack_write': False,
+
+    # If True, lay out the mosaics so that objects whose cutouts fit in
+    # one compression tile, of the size given by FZTILE in fpack_pars,
+    # do not cross a tile boundary, and larger objects start on a tile
+    # boundary.  This pads the mosaics but lets the reader decompress
+    # fewer tiles for each object after the file is fpacked
+    'fpack_align_tiles': False,
+
+    # If True, write the cutouts of all types for each file before moving
+    # on to the next, reading each image, including the bkg and bmask
+    # used to make the image and weight cutouts, only once.  This holds
+    # all the images for one file in memory at once.  With joblib
+    # configured, the files are always processed this way, in parallel
+    'single_pass_cutouts': False,
+
+    # memory in bytes for buffering the cutouts before they are written.
+    # The buffered cutouts are sorted by their position in the mosaic and
+    # adjacent cutouts are written together, so a larger buffer gives
+    # fewer, larger writes.  The memory is shared between the types in
+    # single_pass_cutouts mode
+    'cutout_buffer_bytes': 256*1024*1024,
+
     # default output data types for images
     'image_dtype': 'f4',
     'weight_dtype': 'f4',
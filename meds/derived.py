@@ -0,0 +1,203 @@
+"""
+add_derived_maps
+    Compute uberseg and composite weight maps for every cutout in a MEDS
+    file and store them in new extensions
+
+The maps are deterministic functions of the stored seg, weight and
+jacobians.  They are written to extensions named for example
+'uberseg_cutouts', with the same layout as the other cutout extensions, so
+they can be read with start_row and box_size.  The MEDS reader serves
+get_uberseg and get_cweight_cutout from these extensions when present.
+"""
+from __future__ import print_function
+import os
+import numpy
+import fitsio
+
+from .meds import MEDS
+from .maker import SUPPORTED_DERIVED_TYPES
+from .compress import _copy_bytes
+from .parallel import _joblib_imap
+
+
+def add_derived_maps(
+    filename,
+    types=None,
+    n_jobs=1,
+    backend='loky',
+    chunksize=1000,
+):
+    """
+    Compute derived maps for every cutout and add them to the MEDS file
+    as new extensions such as 'uberseg_cutouts'.
+
+    The uberseg maps are the default get_uberseg(iobj, icutout) and the
+    composite weight maps the default get_cweight_cutout(iobj, icutout).
+    For objects with a singular coadd jacobian, get_uberseg raises an
+    error for all but the coadd cutout; these cutouts are stored as zero,
+    and the reader raises the same error for them.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the MEDS file, which is modified in place.  It must have
+        weight and seg cutouts and not already have the derived extensions.
+    types : list of str, optional
+        The derived maps to compute, from 'uberseg' and 'cweight'.  Default
+        is both.
+    n_jobs : int, optional
+        Number of parallel joblib jobs over chunks of objects.  Default 1,
+        which runs serially without joblib.  The chunks are written in
+        order as they are done, with about two chunks per job in memory.
+    backend : str, optional
+        The joblib backend.  Default 'loky'.
+    chunksize : int, optional
+        Number of objects per job.  Default 1000.
+    """
+
+    if types is None:
+        types = SUPPORTED_DERIVED_TYPES
+    types = list(types)
+
+    for type in types:
+        if type not in SUPPORTED_DERIVED_TYPES:
+            raise ValueError(
+                "derived types should be in %s, got '%s'" % (
+                    SUPPORTED_DERIVED_TYPES, type,
+                )
+            )
+
+    if chunksize < 1:
+        raise ValueError("chunksize must be >= 1, got %s" % chunksize)
+
+    with fitsio.FITS(filename) as fits:
+        for ext in ['weight_cutouts', 'seg_cutouts']:
+            if ext not in fits:
+                raise ValueError(
+                    "'%s' is needed for derived maps but is not "
+                    "in %s" % (ext, filename)
+                )
+        for type in types:
+            ext = '%s_cutouts' % type
+            if ext in fits:
+                raise ValueError("%s already has '%s'" % (filename, ext))
+
+        npix = fits['weight_cutouts'].get_dims()[0]
+
+        # the uberseg code works in float32, the composite weight keeps
+        # the type of the weight map
+        dtypes = {
+            'uberseg': 'f4',
+            'cweight': fits['weight_cutouts'][0:1].dtype.newbyteorder('='),
+        }
+        cat = fits['object_data'].read(columns=['ncutout', 'start_row'])
+
+    nobj = cat.size
+    ranges = [
+        (start, min(start + chunksize, nobj))
+        for start in range(0, nobj, chunksize)
+    ]
+
+    # the chunks are written to a temporary file as they complete, and
+    # the finished extensions appended to the MEDS file at the end, so
+    # the workers reading the MEDS file never see partial derived maps
+    tmp_file = filename + '.derived-tmp'
+    try:
+        with fitsio.FITS(tmp_file, 'rw', clobber=True) as tmp_fits:
+            tmp_fits.write(None)
+            for type in types:
+                print('    reserving %s mosaic' % type)
+                tmp_fits.create_image_hdu(
+                    img=None,
+                    dtype=dtypes[type],
+                    dims=[npix],
+                    extname='%s_cutouts' % type,
+                )
+
+            print('computing derived maps: %s' % ', '.join(types))
+            arglist = [(filename, start, end, types) for start, end in ranges]
+            if n_jobs == 1:
+                outputs = (_derived_maps_func(*args) for args in arglist)
+            else:
+                outputs = _joblib_imap(
+                    _derived_maps_func, arglist,
+                    n_jobs=n_jobs, backend=backend,
+                )
+
+            for (start, end), output in zip(ranges, outputs):
+                for type in types:
+                    hdu = tmp_fits['%s_cutouts' % type]
+                    mosaics = zip(range(start, end), output[type])
+                    for iobj, mosaic in mosaics:
+                        if mosaic is not None:
+                            hdu.write(
+                                mosaic.ravel().astype(
+                                    dtypes[type], copy=False,
+                                ),
+                                start=cat['start_row'][iobj, 0],
+                            )
+
+        _append_extensions(tmp_file, filename)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+    print('added derived maps to:', filename)
+
+
+def _append_extensions(tmp_file, filename):
+    """
+    append the bytes of all but the empty primary HDU of tmp_file to the
+    end of filename
+    """
+    with fitsio.FITS(tmp_file) as fits:
+        infos = [hdu.get_info() for hdu in fits[1:]]
+
+    start = infos[0]['header_start']
+    end = infos[-1]['data_end']
+
+    with open(tmp_file, 'rb') as fin, open(filename, 'ab') as fout:
+        _copy_bytes(fin, fout, start, end)
+
+
+def _derived_maps_func(filename, start, end, types):
+    """
+    compute the derived mosaics for objects [start, end), returned as a
+    dict keyed by type of lists with None for objects with no cutouts
+    """
+    output = {type: [] for type in types}
+
+    with MEDS(filename) as m:
+        for iobj in range(start, end):
+            ncutout = m['ncutout'][iobj]
+
+            for type in types:
+                if ncutout == 0:
+                    mosaic = None
+                elif type == 'uberseg':
+                    mosaic = _get_uberseg_mosaic(m, iobj)
+                else:
+                    mosaic = m.get_cweight_mosaic(iobj)
+
+                output[type].append(mosaic)
+
+    return output
+
+
+def _get_uberseg_mosaic(m, iobj):
+    """
+    get the uberseg mosaic.  If the coadd jacobian is singular only the
+    coadd cutout can be made, and the rest are zero
+    """
+    try:
+        useg_list = m.get_uberseg_list(iobj)
+    except numpy.linalg.LinAlgError:
+        print('coadd jacobian is singular for object %d, '
+              'setting uberseg to zero for the epochs' % iobj)
+        mosaic = m.get_mosaic(iobj, type='weight', copy=True)
+        mosaic[:, :] = 0
+        box_size = m['box_size'][iobj]
+        mosaic[:box_size, :] = m.get_uberseg(iobj, 0)
+        return mosaic
+
+    return numpy.vstack(useg_list)
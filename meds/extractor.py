@@ -65,6 +65,8 @@ class MEDSExtractor(object):
             "bmask_cutouts",
             "psf",
             "noise",
+            "uberseg_cutouts",
+            "cweight_cutouts",
         ]
         self._check_inputs()
         self._extract()
@@ -146,6 +148,13 @@ class MEDSExtractor(object):
                         outfits.write(cutouts, extname="noise_cutouts")
                         del cutouts
 
+                    # derived maps share the cutout layout
+                    for ext in ["uberseg_cutouts", "cweight_cutouts"]:
+                        if ext in infits:
+                            cutouts = infits[ext][cstart:cend]
+                            outfits.write(cutouts, extname=ext)
+                            del cutouts
+
                     if "psf" in infits:
                         psfs = infits["psf"][psf_cstart:psf_cend]
                         outfits.write(psfs, extname="psf")
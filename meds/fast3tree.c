@@ -21,11 +21,13 @@
 
 
    PUBLIC METHODS:
-   Initialize a fast3tree from a list of points:
+   Initialize a fast3tree from a list of points, NULL if memory could not
+   be allocated:
       struct fast3tree *fast3tree_init(int64_t n, FAST3TREE_TYPE *p);
 
-   Rebuild a fast3tree from a new (or the same) list of points:
-      void fast3tree_rebuild(struct fast3tree *t, int64_t n, FAST3TREE_TYPE *p);
+   Rebuild a fast3tree from a new (or the same) list of points, returns
+   0 on success and -1 if memory could not be allocated:
+      int fast3tree_rebuild(struct fast3tree *t, int64_t n, FAST3TREE_TYPE *p);
 
    Rebuilds the tree boundaries, but keeps structure the same:
       void fast3tree_maxmin_rebuild(struct fast3tree *t);
@@ -33,7 +35,9 @@
    Frees the tree memory and sets tree pointer to NULL.
       void fast3tree_free(struct fast3tree **t);
 
-   Initialize a fast3tree results structure:
+   Initialize a fast3tree results structure, NULL if memory could not be
+   allocated.  The searches set res->error if memory for the results could
+   not be allocated; it is reset by fast3tree_results_clear:
       struct fast3tree_results *fast3tree_results_init(void);
 
    Find all points within a sphere centered at c[FD] with radius r:
@@ -118,7 +122,7 @@ struct fast3tree *fast3tree_init(int64_t n, FAST3TREE_TYPE *p);
 
 #undef fast3tree_rebuild
 #define fast3tree_rebuild _F3TN(FAST3TREE_PREFIX,fast3tree_rebuild)
-void fast3tree_rebuild(struct fast3tree *t, int64_t n, FAST3TREE_TYPE *p);
+int fast3tree_rebuild(struct fast3tree *t, int64_t n, FAST3TREE_TYPE *p);
 
 #undef fast3tree_maxmin_rebuild
 #define fast3tree_maxmin_rebuild _F3TN(FAST3TREE_PREFIX,fast3tree_maxmin_rebuild)
@@ -191,6 +195,7 @@ struct fast3tree_results {
   int64_t num_points;
   int64_t num_allocated_points;
   FAST3TREE_TYPE **points;
+  int error;
 };
 
 
@@ -202,7 +207,7 @@ void *_fast3tree_check_realloc(void *ptr, size_t size, char *reason);
 
 #undef _fast3tree_build
 #define _fast3tree_build _F3TN(FAST3TREE_PREFIX,_fast3tree_build)
-void _fast3tree_build(struct fast3tree *t);
+int _fast3tree_build(struct fast3tree *t);
 
 #undef _fast3tree_maxmin_rebuild
 #define _fast3tree_maxmin_rebuild _F3TN(FAST3TREE_PREFIX,_fast3tree_maxmin_rebuild)
@@ -215,14 +220,18 @@ struct fast3tree *fast3tree_init(int64_t n, FAST3TREE_TYPE *p) {
   new = _fast3tree_check_realloc(new,sizeof(struct fast3tree), "Allocating fast3tree.");
   if (!new) return NULL;
   memset(new, 0, sizeof(struct fast3tree));
-  fast3tree_rebuild(new, n, p);
+  if (fast3tree_rebuild(new, n, p) != 0) {
+    free(new->root);
+    free(new);
+    return NULL;
+  }
   return new;
 }
 
-void fast3tree_rebuild(struct fast3tree *t, int64_t n, FAST3TREE_TYPE *p) {
+int fast3tree_rebuild(struct fast3tree *t, int64_t n, FAST3TREE_TYPE *p) {
   t->points = p;
   t->num_points = n;
-  _fast3tree_build(t);
+  return _fast3tree_build(t);
 }
 
 void fast3tree_maxmin_rebuild(struct fast3tree *t) {
@@ -319,12 +328,22 @@ static inline int _fast3tree_sphere_inside_box(const struct tree3_node *node, co
 
 #undef _fast3tree_check_results_space
 #define _fast3tree_check_results_space _F3TN(FAST3TREE_PREFIX,_fast3tree_check_results_space)
-static inline void _fast3tree_check_results_space(const struct tree3_node *n, struct fast3tree_results *res) {
+static inline int _fast3tree_check_results_space(const struct tree3_node *n, struct fast3tree_results *res) {
+  FAST3TREE_TYPE **points;
+  int64_t num_allocated_points;
+  if (res->error) return -1;
   if (res->num_points + n->num_points > res->num_allocated_points) {
-    res->num_allocated_points = res->num_points + n->num_points + 1000;
-    res->points = _fast3tree_check_realloc(res->points, 
-      res->num_allocated_points * sizeof(FAST3TREE_TYPE *), "Allocating fast3tree results");
+    num_allocated_points = res->num_points + n->num_points + 1000;
+    points = _fast3tree_check_realloc(res->points, 
+      num_allocated_points * sizeof(FAST3TREE_TYPE *), "Allocating fast3tree results");
+    if (!points) {
+      res->error = 1;
+      return -1;
+    }
+    res->points = points;
+    res->num_allocated_points = num_allocated_points;
   }
+  return 0;
 }
 
 #undef _fast3tree_find_sphere
@@ -336,7 +355,7 @@ void _fast3tree_find_sphere(const struct tree3_node *n, struct fast3tree_results
   if (_fast3tree_box_not_intersect_sphere(n,c,r)) return;
 #if FAST3TREE_DIM < 6
   if (_fast3tree_box_inside_sphere(n,c,r)) { /* Entirely inside sphere */
-    _fast3tree_check_results_space(n,res);
+    if (_fast3tree_check_results_space(n,res)) return;
     for (i=0; i<n->num_points; i++)
       res->points[res->num_points+i] = n->points+i;
     res->num_points += n->num_points;
@@ -346,7 +365,7 @@ void _fast3tree_find_sphere(const struct tree3_node *n, struct fast3tree_results
 
   if (n->div_dim < 0) { /* Leaf node */
     r2 = r*r;
-    _fast3tree_check_results_space(n,res);
+    if (_fast3tree_check_results_space(n,res)) return;
     for (i=0; i<n->num_points; i++) {
       j = dist = 0;
       float *pos = n->points[i].pos;
@@ -376,7 +395,7 @@ void _fast3tree_find_sphere_skip(const struct tree3_node *n, struct fast3tree_re
   if (_fast3tree_box_not_intersect_sphere(n,c,r)) return;
 #if FAST3TREE_DIM < 6
   if (_fast3tree_box_inside_sphere(n,c,r)) { /* Entirely inside sphere */
-    _fast3tree_check_results_space(n,res);
+    if (_fast3tree_check_results_space(n,res)) return;
     for (i=0; i<n->num_points; i++)
       res->points[res->num_points+i] = n->points+i;
     res->num_points += n->num_points;
@@ -386,7 +405,7 @@ void _fast3tree_find_sphere_skip(const struct tree3_node *n, struct fast3tree_re
 
   if (n->div_dim < 0) { /* Leaf node */
     r2 = r*r;
-    _fast3tree_check_results_space(n,res);
+    if (_fast3tree_check_results_space(n,res)) return;
     i=0;
     if (n->points < tp) {
       res->points[res->num_points] = tp;
@@ -419,6 +438,7 @@ struct fast3tree_results *fast3tree_results_init(void) {
   res->points = NULL;
   res->num_points = 0;
   res->num_allocated_points = 0;
+  res->error = 0;
   return res;
 }
 
@@ -443,7 +463,7 @@ void _fast3tree_find_sphere_offset(const struct tree3_node *n, struct fast3tree_
   if (_fast3tree_box_not_intersect_sphere(n,c2,r*1.01)) return;
 #if FAST3TREE_DIM < 6
   if (_fast3tree_box_inside_sphere(n,c2,r*0.99)) { /* Entirely inside sphere */
-    _fast3tree_check_results_space(n,res);
+    if (_fast3tree_check_results_space(n,res)) return;
     for (i=0; i<n->num_points; i++)
       res->points[res->num_points+i] = n->points+i;
     res->num_points += n->num_points;
@@ -453,7 +473,7 @@ void _fast3tree_find_sphere_offset(const struct tree3_node *n, struct fast3tree_
 
   if (n->div_dim < 0) { /* Leaf node */
     r2 = r*r;
-    _fast3tree_check_results_space(n,res);
+    if (_fast3tree_check_results_space(n,res)) return;
     for (i=0; i<n->num_points; i++) {
       j = dist = 0;
       float *pos = n->points[i].pos;
@@ -521,7 +541,7 @@ static inline void _fast3tree_find_outside_of_box(struct tree3_node *n, struct f
   int64_t i,j;
   if (_fast3tree_box_inside_box(n, b)) return;
   if (!_fast3tree_box_intersect_box(n, b)) {
-    _fast3tree_check_results_space(n,res);
+    if (_fast3tree_check_results_space(n,res)) return;
     for (i=0; i<n->num_points; i++) {
       res->points[res->num_points] = n->points+i;
       res->num_points++;
@@ -529,7 +549,7 @@ static inline void _fast3tree_find_outside_of_box(struct tree3_node *n, struct f
   }
   else {
     if (n->div_dim < 0) {
-      _fast3tree_check_results_space(n,res);
+      if (_fast3tree_check_results_space(n,res)) return;
       for (i=0; i<n->num_points; i++) {
 	for (j=0; j<FAST3TREE_DIM; j++) {
 	  if (n->points[i].pos[j] < b[j]) break;
@@ -558,7 +578,7 @@ static inline void _fast3tree_find_inside_of_box(struct tree3_node *n, struct fa
   int64_t i,j;
   if (!_fast3tree_box_intersect_box(n, b)) return;
   if (_fast3tree_box_inside_box(n, b)) {
-    _fast3tree_check_results_space(n,res);
+    if (_fast3tree_check_results_space(n,res)) return;
     for (i=0; i<n->num_points; i++) {
       res->points[res->num_points] = n->points+i;
       res->num_points++;
@@ -566,7 +586,7 @@ static inline void _fast3tree_find_inside_of_box(struct tree3_node *n, struct fa
   }
   else {
     if (n->div_dim < 0) {
-      _fast3tree_check_results_space(n,res);
+      if (_fast3tree_check_results_space(n,res)) return;
       for (i=0; i<n->num_points; i++) {
 	for (j=0; j<FAST3TREE_DIM; j++) {
 	  if (n->points[i].pos[j] < b[j]) break;
@@ -650,7 +670,7 @@ static inline void _fast3tree_find_minmax(struct tree3_node *node) {
   FAST3TREE_TYPE * p = node->points;
   //assert(node->num_points > 0);
   if(node->num_points == 0)
-    exit(1);
+    return;
   for (j=0; j<FAST3TREE_DIM; j++) node->min[j] = node->max[j] = p[0].pos[j];
   for (i=1; i<node->num_points; i++)  {
     for (j=0; j<FAST3TREE_DIM; j++) {
@@ -663,23 +683,26 @@ static inline void _fast3tree_find_minmax(struct tree3_node *node) {
 
 #undef _fast3tree_split_node
 #define _fast3tree_split_node _F3TN(FAST3TREE_PREFIX,_fast3tree_split_node)
-void _fast3tree_split_node(struct fast3tree *t, struct tree3_node *node) {
+int _fast3tree_split_node(struct fast3tree *t, struct tree3_node *node) {
   int64_t num_left;
   struct tree3_node *null_ptr = NULL;
-  struct tree3_node *left, *right;
-  int64_t left_index, node_index;
+  struct tree3_node *left, *right, *root;
+  int64_t left_index, node_index, allocated_nodes;
 
   num_left = _fast3tree_sort_dim_pos(node, 1.0);
   if (num_left == node->num_points || num_left == 0) 
   { //In case all node points are at same spot
     node->div_dim = -1;
-    return;
+    return 0;
   }
 
   node_index = node - t->root;
   if ((t->num_nodes+2) > t->allocated_nodes) {
-    t->allocated_nodes = t->allocated_nodes*1.05 + 1000;
-    t->root = _fast3tree_check_realloc(t->root, sizeof(struct tree3_node)*(t->allocated_nodes), "Tree nodes");
+    allocated_nodes = t->allocated_nodes*1.05 + 1000;
+    root = _fast3tree_check_realloc(t->root, sizeof(struct tree3_node)*allocated_nodes, "Tree nodes");
+    if (!root) return -1;
+    t->root = root;
+    t->allocated_nodes = allocated_nodes;
     node = t->root + node_index;
   }
 
@@ -704,11 +727,12 @@ void _fast3tree_split_node(struct fast3tree *t, struct tree3_node *node) {
   _fast3tree_find_minmax(right);
 
   if (left->num_points > POINTS_PER_LEAF)
-    _fast3tree_split_node(t, left);
+    if (_fast3tree_split_node(t, left)) return -1;
 
   right = t->root + (left_index + 1);
   if (right->num_points > POINTS_PER_LEAF)
-    _fast3tree_split_node(t, right);
+    if (_fast3tree_split_node(t, right)) return -1;
+  return 0;
 }
 
 #undef _fast3tree_rebuild_pointers
@@ -727,12 +751,15 @@ void _fast3tree_rebuild_pointers(struct fast3tree *t) {
 
 #undef _fast3tree_build
 #define _fast3tree_build _F3TN(FAST3TREE_PREFIX,_fast3tree_build)
-void _fast3tree_build(struct fast3tree *t) {
+int _fast3tree_build(struct fast3tree *t) {
   int64_t i, j;
   struct tree3_node *root;
   FAST3TREE_TYPE tmp;
-  t->allocated_nodes = (3+t->num_points/(POINTS_PER_LEAF/2));
-  t->root = _fast3tree_check_realloc(t->root, sizeof(struct tree3_node)*(t->allocated_nodes), "Tree nodes"); //Estimate memory load
+  int64_t allocated_nodes = (3+t->num_points/(POINTS_PER_LEAF/2));
+  root = _fast3tree_check_realloc(t->root, sizeof(struct tree3_node)*allocated_nodes, "Tree nodes"); //Estimate memory load
+  if (!root) return -1;
+  t->root = root;
+  t->allocated_nodes = allocated_nodes;
   t->num_nodes = 1;
 
   //Get rid of NaNs / infs
@@ -757,17 +784,22 @@ void _fast3tree_build(struct fast3tree *t) {
   //for (j=0; j<FAST3TREE_DIM; j++) assert(isfinite(root->max[j]));
   for (j=0; j<FAST3TREE_DIM; j++) {
     if(!isfinite(root->min[j]))
-      exit(1);
+      return -1;
     if(!isfinite(root->max[j]))
-      exit(1);
+      return -1;
   }
 
   if (root->num_points > POINTS_PER_LEAF)
-    _fast3tree_split_node(t, root);
+    if (_fast3tree_split_node(t, root)) return -1;
 
-  t->root = _fast3tree_check_realloc(t->root, sizeof(struct tree3_node)*(t->num_nodes), "Tree nodes");
-  t->allocated_nodes = t->num_nodes;
+  // shrink to fit; keep the larger block if that fails
+  root = _fast3tree_check_realloc(t->root, sizeof(struct tree3_node)*(t->num_nodes), "Tree nodes");
+  if (root) {
+    t->root = root;
+    t->allocated_nodes = t->num_nodes;
+  }
   _fast3tree_rebuild_pointers(t);
+  return 0;
 }
 
 #undef _fast3tree_maxmin_rebuild
@@ -792,11 +824,9 @@ void _fast3tree_maxmin_rebuild(struct tree3_node *n) {
 #undef _fast3tree_check_realloc
 #define _fast3tree_check_realloc _F3TN(FAST3TREE_PREFIX,_fast3tree_check_realloc)
 void *_fast3tree_check_realloc(void *ptr, size_t size, char *reason) {
+  /* returns NULL on failure, leaving ptr allocated, so the callers can
+     report the error rather than exiting the process */
   void *res = realloc(ptr, size);
-  if ((res == NULL) && (size > 0)) {
-    fprintf(stderr, "[Error] Failed to allocate memory (%s)!\n", reason);
-    exit(1);
-  }
   return res;
 }
 
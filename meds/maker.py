@@ -2,6 +2,7 @@
 code to build MEDS files
 """
 from __future__ import print_function
+import os
 import json
 import copy
 import numpy
@@ -23,6 +24,7 @@ from .util import (
 )
 
 from .bounds import Bounds
+from .parallel import _joblib_imap
 from .defaults import default_config, default_values
 
 
@@ -35,9 +37,36 @@ SUPPORTED_CUTOUT_TYPES = [
     "noise",
 ]
 
+# maps that can be precomputed and stored, see meds.derived
+SUPPORTED_DERIVED_TYPES = [
+    "uberseg",
+    "cweight",
+]
+
 # meds file format version
 MEDS_FMT_VERSION = "0.9.1"
 
+# number of pixels in each chunk of stamps gathered at once
+_STAMP_CHUNK_PIXELS = 256 * 1024
+
+# entries for the stamps buffered by the _CutoutWriter
+_write_entry_dtype = [
+    ("start_row", "i8"),
+    ("ibuf", "i8"),
+    ("offset", "i8"),
+    ("npix", "i8"),
+]
+
+# entries in the per-file index of cutouts, see _build_file_index
+_file_index_dtype = [
+    ("iobj", "i8"),
+    ("icut", "i4"),
+    ("start_row", "i8"),
+    ("orig_start_row", "i8"),
+    ("orig_start_col", "i8"),
+    ("box_size", "i4"),
+]
+
 
 class MEDSMaker(dict):
     """
@@ -85,10 +114,36 @@ class MEDSMaker(dict):
     def write(self, filename):
         """
         build the meds layout and write images
+
+        If the fpack_write config option is set, the file is first written
+        uncompressed to filename + '.uncompressed', then tile-compressed
+        to filename using fpack_pars.  The uncompressed file is removed
+        afterwards, also if writing or compressing fails
         """
         self._build_meds_layout()
+
+        if not self["fpack_write"]:
+            self._write_uncompressed(filename)
+            return
+
+        write_filename = filename + ".uncompressed"
+        try:
+            self._write_uncompressed(write_filename)
+            self._write_compressed(write_filename, filename)
+        finally:
+            if os.path.exists(write_filename):
+                print("removing:", write_filename)
+                os.remove(write_filename)
+
+    def _write_uncompressed(self, filename):
+        """
+        write the uncompressed file, with any derived maps
+        """
         self._write_data(filename)
 
+        if len(self["derived_types"]) > 0:
+            self._write_derived_maps(filename)
+
     def _write_data(self, filename):
         """
         run through and write cutouts from each SE file
@@ -114,8 +169,13 @@ class MEDSMaker(dict):
 
             self._reserve_mosaic_images()
 
-            for type in self["cutout_types"]:
-                self._write_cutouts(type)
+            if self._use_joblib:
+                self._write_cutouts_joblib()
+            elif self["single_pass_cutouts"]:
+                self._write_cutouts_single_pass()
+            else:
+                for type in self["cutout_types"]:
+                    self._write_cutouts(type)
 
             if self.psf_data is not None:
                 self._write_psf_cutouts()
@@ -125,6 +185,45 @@ class MEDSMaker(dict):
 
         print("output is in:", filename)
 
+    def _write_derived_maps(self, filename):
+        """
+        compute the derived maps from the written file and add them
+        as new extensions
+        """
+        from .derived import add_derived_maps
+
+        if self._use_joblib:
+            n_jobs = self._joblib_max_workers
+        else:
+            n_jobs = 1
+
+        add_derived_maps(
+            filename,
+            types=self["derived_types"],
+            n_jobs=n_jobs,
+            backend=self._joblib_backend,
+        )
+
+    def _write_compressed(self, uncompressed_filename, filename):
+        """
+        write the tile-compressed file, compressing the cutout extensions
+        in parallel if joblib is configured
+        """
+        from .compress import compress_meds
+
+        if self._use_joblib:
+            n_jobs = self._joblib_max_workers
+        else:
+            n_jobs = 1
+
+        compress_meds(
+            uncompressed_filename,
+            filename,
+            fpack_pars=self.get("fpack_pars"),
+            n_jobs=n_jobs,
+            backend=self._joblib_backend,
+        )
+
     def _write_object_data(self):
         """
         write the object data
@@ -208,12 +307,9 @@ class MEDSMaker(dict):
 
         print("writing %s cutouts" % cutout_type)
 
-        obj_data = self.obj_data
-
         nfile = self.image_info.size
-        nobj = obj_data.size
 
-        cutout_hdu = self._get_cutout_hdu(cutout_type)
+        writers = self._get_cutout_writers([cutout_type])
 
         for file_id in range(nfile):
 
@@ -223,61 +319,165 @@ class MEDSMaker(dict):
             ttup = (file_id + 1, nfile, cutout_type, impath)
             print("    %d/%d %s %s" % ttup)
 
-            im_data = self._read_image(file_id, cutout_type)
+            file_index = self._file_index[file_id]
+            if file_index.size == 0:
+                print("    no cutouts in file")
+                continue
 
-            if im_data is None:
-                print("    no %s specified for file" % cutout_type)
+            stamps = self._extract_file_stamps(
+                file_id, file_index, [cutout_type],
+            )
+            self._add_file_stamps(writers, file_index, stamps)
+
+        for writer in writers.values():
+            writer.flush()
+
+    def _write_cutouts_single_pass(self):
+        """
+        write the cutouts of all types for each file in turn, so each
+        image is read only once
+        """
+
+        print("writing cutouts for %s" % ", ".join(self["cutout_types"]))
+
+        nfile = self.image_info.size
+
+        writers = self._get_cutout_writers(self["cutout_types"])
+
+        for file_id in range(nfile):
+
+            impath = self.image_info["image_path"][file_id].strip()
+            print("    %d/%d %s" % (file_id + 1, nfile, impath))
+
+            file_index = self._file_index[file_id]
+            if file_index.size == 0:
+                print("    no cutouts in file")
                 continue
 
-            for iobj in range(nobj):
-                ncut = obj_data["ncutout"][iobj]
+            stamps = self._extract_file_stamps(
+                file_id, file_index, self["cutout_types"],
+            )
+            self._add_file_stamps(writers, file_index, stamps)
 
-                for icut in range(ncut):
-                    if obj_data["file_id"][iobj, icut] == file_id:
-
-                        self._write_cutout(
-                            iobj,
-                            icut,
-                            cutout_hdu,
-                            im_data,
-                            cutout_type,
-                        )
+        for writer in writers.values():
+            writer.flush()
 
-    def _write_cutout(self, iobj, icut, cutout_hdu, im_data, cutout_type):
+    def _write_cutouts_joblib(self):
         """
-        extract a cutout and write it to the mosaic image
+        read the images and extract the cutouts of all types for each file
+        in parallel, writing them from this process in file order
         """
-        dims = im_data.shape
+        print("writing cutouts for %s" % ", ".join(self["cutout_types"]))
+        print("    using joblib")
 
-        d = self.obj_data
-        orow = d["orig_start_row"][iobj, icut]
-        ocol = d["orig_start_col"][iobj, icut]
-        bsize = d["box_size"][iobj]
-        start_row = d["start_row"][iobj, icut]
+        nfile = self.image_info.size
+        file_ids = [
+            file_id for file_id in range(nfile)
+            if self._file_index[file_id].size > 0
+        ]
 
-        orow_box, row_box = self._get_clipped_boxes(dims[0], orow, bsize)
-        ocol_box, col_box = self._get_clipped_boxes(dims[1], ocol, bsize)
+        writers = self._get_cutout_writers(self["cutout_types"])
 
-        subim = zeros((bsize, bsize), dtype=self["%s_dtype" % cutout_type])
-        subim += default_values[cutout_type]
+        reader = self._get_image_reader()
 
-        ok = (
-            all([x >= 0 for x in orow_box])
-            and orow_box[1] > orow_box[0]
-            and all([x >= 0 for x in ocol_box])
-            and ocol_box[1] > ocol_box[0]
+        # the files are sent to the workers a few per worker at a time and
+        # consumed in file order, so only those stamps are in memory
+        arglist = [
+            (reader, file_id, self._file_index[file_id],
+             self["cutout_types"])
+            for file_id in file_ids
+        ]
+        outputs = _joblib_imap(
+            _extract_file_stamps_func,
+            arglist,
+            n_jobs=self._joblib_max_workers,
+            backend=self._joblib_backend,
+            inner_max_num_threads=self._joblib_threads,
         )
-        if ok:
-            read_im = im_data[
-                orow_box[0]: orow_box[1],
-                ocol_box[0]: ocol_box[1]
-            ]
 
-            subim[row_box[0]: row_box[1], col_box[0]: col_box[1]] = read_im
-        else:
-            print("    not reading off-image data:", orow_box, ocol_box)
+        for file_id, stamps in zip(file_ids, outputs):
+            impath = self.image_info["image_path"][file_id]
+            ttup = (file_id + 1, nfile, impath.strip())
+            print("    %d/%d %s" % ttup)
+
+            self._add_file_stamps(writers, self._file_index[file_id], stamps)
+
+        for writer in writers.values():
+            writer.flush()
 
-        cutout_hdu.write(subim, start=start_row)
+    def _get_cutout_writers(self, cutout_types):
+        """
+        get a writer for the mosaic image of each type, sharing the
+        buffer memory between the types
+        """
+        max_bytes = self["cutout_buffer_bytes"] // len(cutout_types)
+        return {
+            cutout_type: _CutoutWriter(
+                self._get_cutout_hdu(cutout_type), max_bytes,
+            )
+            for cutout_type in cutout_types
+        }
+
+    def _get_image_reader(self):
+        """
+        get a copy of the maker for reading images and extracting stamps
+        in other processes, without the output file and the tables that
+        are not needed for reading
+        """
+        reader = copy.copy(self)
+        reader.fits = None
+        reader.obj_data = None
+        reader.psf_data = None
+        reader._file_index = None
+        return reader
+
+    def _extract_file_stamps(self, file_id, file_index, cutout_types):
+        """
+        read the images for a file and extract the cutouts in the file
+        index, reading each image once
+
+        returns
+        -------
+        stamps: dict
+            The stamps and their offsets from _extract_stamps for each
+            type, or None if the type is not specified for the file
+        """
+        # the images read so far for this file, shared between types
+        planes = {}
+
+        stamps = {}
+        for cutout_type in cutout_types:
+            im_data = self._read_image(file_id, cutout_type, planes=planes)
+
+            if im_data is None:
+                print("    no %s specified for file" % cutout_type)
+                stamps[cutout_type] = None
+                continue
+
+            stamps[cutout_type] = _extract_stamps(
+                im_data,
+                file_index["orig_start_row"],
+                file_index["orig_start_col"],
+                file_index["box_size"],
+                default_values[cutout_type],
+                self["%s_dtype" % cutout_type],
+            )
+
+        return stamps
+
+    def _add_file_stamps(self, writers, file_index, stamps):
+        """
+        add the stamps extracted for a file to the writers
+        """
+        npix = file_index["box_size"].astype("i8") ** 2
+        for cutout_type, type_stamps in stamps.items():
+            if type_stamps is not None:
+                writers[cutout_type].add(
+                    type_stamps[0],
+                    type_stamps[1],
+                    npix,
+                    file_index["start_row"],
+                )
 
     def _write_psf_cutouts_joblib(self):
         print("    using joblib")
@@ -427,50 +627,6 @@ class MEDSMaker(dict):
 
         self.fits.write(self.psf_info, extname="psf_info")
 
-    def _get_clipped_boxes(self, dim, start, bsize):
-        """
-        get clipped boxes for slicing
-
-        If the box size goes outside the dimensions,
-        trim them back
-
-        parameters
-        ----------
-        dim: int
-            Dimension of this axis
-        start: int
-            Starting position in the image for this axis
-        bsize: int
-            Size of box
-
-        returns
-        -------
-        obox, box
-
-        obox: [start,end]
-            Start and end slice ranges in the original image
-        box: [start,end]
-            Start and end slice ranges in the output image
-        """
-        # slice range in the original image
-        obox = [start, start + bsize]
-
-        # slice range in the sub image into which we will copy
-        box = [0, bsize]
-
-        # rows
-        if obox[0] < 0:
-            obox[0] = 0
-            box[0] = 0 - start
-
-        im_max = dim
-        diff = im_max - obox[1]
-        if diff < 0:
-            obox[1] = im_max
-            box[1] = box[1] + diff
-
-        return obox, box
-
     def _get_cutout_hdu(self, cutout_type):
         """
         get the cutout hdu object for the specified cutout type
@@ -482,7 +638,7 @@ class MEDSMaker(dict):
         cutout_hdu = self.fits[tkey]
         return cutout_hdu
 
-    def _read_image(self, file_id, cutout_type):
+    def _read_image(self, file_id, cutout_type, planes=None):
         """
         read an image, performing manipulations for
         some types
@@ -499,12 +655,17 @@ class MEDSMaker(dict):
             The id into the image_info structure
         cutout_type: string
             'image','bkg','seg','bmask'
+        planes: dict, optional
+            The images already read for this file, keyed by type.  Images
+            read here are added, so an image needed for several types is
+            read once.  The image and weight are modified in place, so
+            each type should be read only once with the same dict.
         """
 
-        im = self._read_one_image(file_id, cutout_type)
+        im = self._read_plane(file_id, cutout_type, planes)
 
         if cutout_type == "image":
-            bkg = self._read_one_image(file_id, "bkg")
+            bkg = self._read_plane(file_id, "bkg", planes)
 
             if bkg is not None:
                 im -= bkg
@@ -529,7 +690,7 @@ class MEDSMaker(dict):
                 raise RuntimeError("no longer support the min_weight option")
 
             if "unusable_bmask" in self:
-                bmask = self._read_one_image(file_id, "bmask")
+                bmask = self._read_plane(file_id, "bmask", planes)
 
                 if bmask is not None:
                     w = self._check_bad_bmask(bmask, self["unusable_bmask"])
@@ -552,6 +713,19 @@ class MEDSMaker(dict):
             print("        found %d unusable pixels" % wbad[0].size)
         return wbad
 
+    def _read_plane(self, file_id, cutout_type, planes):
+        """
+        read a single image, or get it from the planes dict if it was
+        already read
+        """
+        if planes is None:
+            return self._read_one_image(file_id, cutout_type)
+
+        if cutout_type not in planes:
+            planes[cutout_type] = self._read_one_image(file_id, cutout_type)
+
+        return planes[cutout_type]
+
     def _read_one_image(self, file_id, cutout_type):
         """
         read a single image, no manipulations done here
@@ -701,6 +875,7 @@ class MEDSMaker(dict):
 
         self.obj_data = self._make_resized_data(self.obj_data)
         self._set_start_rows_and_pixel_count()
+        self._build_file_index()
 
         if self.psf_data is not None:
             self._set_psf_layout()
@@ -810,6 +985,8 @@ class MEDSMaker(dict):
         npix = (data["ncutout"] * data["box_size"] ** 2).sum()
         self.total_pixels = npix
 
+        tile_size = self._get_align_tile_size()
+
         npix = 0
         current_row = 0
         for iobj in range(nobj):
@@ -818,6 +995,14 @@ class MEDSMaker(dict):
                 bsize = data["box_size"][iobj]
                 npix_per_cutout = bsize * bsize
 
+                if tile_size is not None:
+                    # don't let the object cross a tile boundary if it
+                    # fits in a tile; larger objects start a new tile
+                    offset = current_row % tile_size
+                    npix_obj = ncut * npix_per_cutout
+                    if offset > 0 and offset + npix_obj > tile_size:
+                        current_row += tile_size - offset
+
                 for icut in range(ncut):
                     data["start_row"][iobj, icut] = current_row
                     current_row += npix_per_cutout
@@ -828,8 +1013,73 @@ class MEDSMaker(dict):
                 "total_pixels %d != " "npix %d" % (self.total_pixels, npix)
             )
 
+        if tile_size is not None:
+            print("pixels including tile alignment:", current_row)
+            self.total_pixels = current_row
+
         print("total pixels:", self.total_pixels)
 
+    def _build_file_index(self):
+        """
+        build an index of the cutouts in each file, so the cutouts for a
+        file can be written without searching through all objects
+
+        self._file_index has an entry for each file_id, an array with
+        fields iobj, icut, start_row, orig_start_row, orig_start_col and
+        box_size for the cutouts in that file, in object order
+        """
+        data = self.obj_data
+        nfile = self.image_info.size
+
+        # the cutouts in use, in object order
+        ncutout_max = data["file_id"].shape[1]
+        icut_grid = numpy.arange(ncutout_max)
+        used = icut_grid[numpy.newaxis, :] < data["ncutout"][:, numpy.newaxis]
+        iobj, icut = numpy.nonzero(used)
+
+        index = numpy.zeros(iobj.size, dtype=_file_index_dtype)
+        index["iobj"] = iobj
+        index["icut"] = icut
+        index["box_size"] = data["box_size"][iobj]
+        for name in ["start_row", "orig_start_row", "orig_start_col"]:
+            index[name] = data[name][iobj, icut]
+
+        # a stable sort keeps the object order within each file
+        file_id = data["file_id"][iobj, icut]
+        s = numpy.argsort(file_id, kind="stable")
+        index = index[s]
+        bounds = numpy.searchsorted(file_id[s], numpy.arange(nfile + 1))
+
+        self._file_index = [
+            index[bounds[i]: bounds[i + 1]] for i in range(nfile)
+        ]
+
+    def _get_align_tile_size(self):
+        """
+        get the compression tile size in pixels to align objects to, or
+        None if tiles are not being aligned
+        """
+        if not self["fpack_align_tiles"]:
+            return None
+
+        fztile = self.get("fpack_pars", {}).get("FZTILE")
+        if fztile is None:
+            raise ValueError("fpack_align_tiles requires FZTILE in fpack_pars")
+
+        # e.g. '(10240,1)'; the first dimension is the tile length
+        try:
+            tile_size = int(str(fztile).strip("()").split(",")[0])
+        except ValueError:
+            raise ValueError(
+                "fpack_align_tiles requires a numerical FZTILE, "
+                "got '%s'" % fztile
+            )
+
+        if tile_size < 1:
+            raise ValueError("FZTILE size must be >= 1, got %s" % tile_size)
+
+        return tile_size
+
     def _get_wcs(self, file_id):
         """
         either load the wcs from the image_info, or from
@@ -1095,6 +1345,22 @@ class MEDSMaker(dict):
         self["cutout_types"] = cutout_types
         print("writing cutouts for:", cutout_types)
 
+        bad_types = []
+        for dtype in self["derived_types"]:
+            if dtype not in SUPPORTED_DERIVED_TYPES:
+                bad_types.append(dtype)
+
+        if len(bad_types) != 0:
+            st = ", ".join(bad_types)
+            raise ValueError("unsupported derived types: '%s'" % st)
+
+        if len(self["derived_types"]) > 0:
+            for ctype in ["weight", "seg"]:
+                if ctype not in cutout_types:
+                    raise ValueError(
+                        "derived maps need '%s' in the cutout types" % ctype
+                    )
+
     def _set_meta_data(self, meta_data_in):
         """
         add some fields to the input metadata for software versions
@@ -1373,6 +1639,202 @@ class MEDSMaker(dict):
             self._joblib_threads = None
 
 
+class _CutoutWriter(object):
+    """
+    buffer cutouts for a mosaic image, and write them in order of
+    start_row, with cutouts that are adjacent in the mosaic merged into
+    a single write
+
+    parameters
+    ----------
+    hdu: fitsio HDU
+        The mosaic image
+    max_bytes: int
+        The buffer is written when the stamps added hold at least this
+        many bytes.  With zero, the stamps are written as they are added.
+    """
+
+    def __init__(self, hdu, max_bytes):
+        self.hdu = hdu
+        self.max_bytes = max_bytes
+        self._reset()
+
+    def add(self, stamps, offsets, npix, start_rows):
+        """
+        add stamps to the buffer
+
+        parameters
+        ----------
+        stamps: array
+            1-d array holding the stamps
+        offsets: array
+            The start of each stamp in the stamps array
+        npix: array
+            The number of pixels in each stamp
+        start_rows: array
+            The start of each stamp in the mosaic
+        """
+        entries = numpy.zeros(len(offsets), dtype=_write_entry_dtype)
+        entries["start_row"] = start_rows
+        entries["ibuf"] = len(self._buffers)
+        entries["offset"] = offsets
+        entries["npix"] = npix
+
+        self._buffers.append(stamps)
+        self._entries.append(entries)
+        self._nbytes += stamps.nbytes
+
+        if self._nbytes >= self.max_bytes:
+            self.flush()
+
+    def flush(self):
+        """
+        write the buffered stamps
+        """
+        if len(self._entries) == 0:
+            return
+
+        entries = numpy.concatenate(self._entries)
+        s = numpy.argsort(entries["start_row"], kind="stable")
+        entries = entries[s]
+
+        # split into runs of stamps that are adjacent in the mosaic
+        start_rows = entries["start_row"]
+        end_rows = start_rows + entries["npix"]
+        (breaks,) = numpy.where(start_rows[1:] != end_rows[:-1])
+        bounds = numpy.concatenate([[0], breaks + 1, [entries.size]])
+
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            pieces = [
+                self._buffers[ibuf][offset: offset + npix]
+                for ibuf, offset, npix in zip(
+                    entries["ibuf"][start:end],
+                    entries["offset"][start:end],
+                    entries["npix"][start:end],
+                )
+            ]
+            if len(pieces) == 1:
+                data = pieces[0]
+            else:
+                data = numpy.concatenate(pieces)
+
+            self.hdu.write(data, start=start_rows[start])
+
+        nwrite = bounds.size - 1
+        print("    wrote %d cutouts in %d writes" % (entries.size, nwrite))
+        self._reset()
+
+    def _reset(self):
+        self._buffers = []
+        self._entries = []
+        self._nbytes = 0
+
+
+def _extract_stamps(image, orig_start_row, orig_start_col, box_size,
+                    default, dtype):
+    """
+    extract square stamps from an image into a single buffer
+
+    The stamps with the same box size are gathered together from a strided
+    view of the image.  The few stamps that cross the edges are copied one
+    at a time, with the default value for pixels off the image
+
+    parameters
+    ----------
+    image: 2-d array
+        The image
+    orig_start_row, orig_start_col: arrays
+        The start of each stamp in the image, which can be off the image
+    box_size: array
+        The size of each stamp
+    default: number
+        The value for pixels off the image
+    dtype: numpy dtype
+        The data type of the stamps
+
+    returns
+    -------
+    stamps, offsets
+
+    stamps: array
+        1-d array holding each stamp, flattened
+    offsets: array
+        The start of each stamp in the stamps array
+    """
+    from numpy.lib.stride_tricks import as_strided
+
+    orow = numpy.asarray(orig_start_row, dtype="i8")
+    ocol = numpy.asarray(orig_start_col, dtype="i8")
+    bsize = numpy.asarray(box_size, dtype="i8")
+    nrow, ncol = image.shape
+
+    # stamps are stored grouped by box size, in order within each group
+    order = numpy.argsort(bsize, kind="stable")
+    npix = bsize[order] ** 2
+    offsets = numpy.zeros(bsize.size, dtype="i8")
+    offsets[order] = npix.cumsum() - npix
+
+    stamps = numpy.zeros(npix.sum(), dtype=dtype)
+
+    inside = (
+        (orow >= 0)
+        & (orow + bsize <= nrow)
+        & (ocol >= 0)
+        & (ocol + bsize <= ncol)
+    )
+
+    for size in numpy.unique(bsize[inside]):
+        (w,) = numpy.where(bsize == size)
+
+        start = offsets[w[0]]
+        gstamps = stamps[start: start + w.size * size * size]
+        gstamps = gstamps.reshape(w.size, size, size)
+
+        # a read-only (row, col, size, size) view of every window
+        windows = as_strided(
+            image,
+            shape=(nrow - size + 1, ncol - size + 1, size, size),
+            strides=image.strides * 2,
+            writeable=False,
+        )
+
+        # gather in chunks, so the temporary arrays stay small
+        (win,) = numpy.where(inside[w])
+        nchunk = max(1, _STAMP_CHUNK_PIXELS // (size * size))
+        for ichunk in range(0, win.size, nchunk):
+            cwin = win[ichunk: ichunk + nchunk]
+            cw = w[cwin]
+            gstamps[cwin] = windows[orow[cw], ocol[cw]]
+
+    noff = 0
+    for i in numpy.where(~inside)[0]:
+        size = bsize[i]
+        stamp = stamps[offsets[i]: offsets[i] + size * size]
+        stamp = stamp.reshape(size, size)
+        stamp += default
+
+        row_start, col_start = max(orow[i], 0), max(ocol[i], 0)
+        row_end = min(orow[i] + size, nrow)
+        col_end = min(ocol[i] + size, ncol)
+
+        if row_end > row_start and col_end > col_start:
+            stamp[
+                row_start - orow[i]: row_end - orow[i],
+                col_start - ocol[i]: col_end - ocol[i],
+            ] = image[row_start:row_end, col_start:col_end]
+        else:
+            noff += 1
+
+    if noff > 0:
+        print("    not reading %d off-image stamps" % noff)
+
+    return stamps, offsets
+
+
+def _extract_file_stamps_func(reader, file_id, file_index, cutout_types):
+    return reader._extract_file_stamps(file_id, file_index, cutout_types)
+
+
 def _psf_rec_func(output_path, psf_data, file_ids, rows, cols):
     import joblib
 
@@ -1,7 +1,17 @@
 from __future__ import print_function
+import functools
+import os
+import queue
+import threading
+import weakref
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 import numpy
 import fitsio
 
+from .cache import LRUCache
+from .util import radec_to_unitvecs_ruv
+
 try:
     from . import _uberseg
     _have_c_ubserseg = True
@@ -9,6 +19,30 @@ except ImportError:
     print("could not load fast ubserseg")
     _have_c_ubserseg = False
 
+_have_pread = hasattr(os, 'pread')
+
+# numpy types for the on-disk (big endian) representation of each BITPIX
+_BITPIX_DTYPES = {
+    8: 'u1',
+    16: '>i2',
+    32: '>i4',
+    64: '>i8',
+    -32: '>f4',
+    -64: '>f8',
+}
+
+# cutout types read by default for object bundles
+_BUNDLE_TYPES = ['image', 'weight', 'seg', 'bmask', 'ormask', 'noise']
+
+# methods to find the nearest object for uberseg
+_UBERSEG_ENGINES = ('tree', 'edt')
+
+
+# errors from reading a truncated or corrupt index sidecar, which is then
+# rebuilt
+_SIDECAR_ERRORS = (OSError, ValueError, KeyError, EOFError,
+                   zipfile.BadZipFile)
+
 
 class MEDS(object):
     """
@@ -31,6 +65,58 @@ class MEDS(object):
     ----------
     filename : str
         The path to the MEDS file.
+    mmap : bool, optional
+        If True, memory map the uncompressed cutout and psf extensions.
+        Cutouts are then returned as read-only views into the file, in the
+        big endian byte order used on disk, unless `copy=True` is sent.
+        Compressed or scaled extensions are still read with fitsio.
+        Default False.
+    cache_bytes : int, optional
+        If sent, keep recently read mosaics and psfs in a least-recently-used
+        cache holding at most this many bytes.  Entries are keyed by
+        (type, iobj), so repeated access to the cutouts of an object is
+        served from memory.  Cached arrays are returned read-only unless
+        `copy=True` is sent.  Default None, no caching.
+    columns : list of str, optional
+        Only load these columns from the object_data table.  The 'ncutout'
+        column is always loaded, since it is used to check indices.  Any
+        column needed by the methods you call must be included.  Default
+        is to load all columns.
+    lazy : bool, optional
+        If True, defer reading object_data columns until they are first
+        accessed, and defer reading the image_info and metadata tables until
+        they are requested.  Default False.
+    derived : bool, optional
+        If True, serve get_uberseg and get_cweight_cutout, and their
+        mosaic, stack and list versions, from the 'uberseg_cutouts' and
+        'cweight_cutouts' extensions when present.  These are written by
+        meds.derived.add_derived_maps.  Maps with non-default options are
+        always computed.  Default True.
+    threadsafe : bool, optional
+        If True, the reader can be shared between threads.  Each thread
+        reads through its own fitsio handle, opened on first use, while the
+        catalog, image_info, metadata, jacobians, memory maps and cache are
+        shared.  Handles are closed when their thread exits, or by
+        close().  Default False.
+    tile_cache_bytes : int, optional
+        For tile-compressed cutout and psf extensions, such as those made
+        by running fpack on a MEDS file, keep decompressed tiles in a
+        least-recently-used cache holding at most this many bytes, so
+        neighboring cutouts in the same tile are decompressed once.  Tiles
+        larger than this are not cached.  Send 0 or None to disable.
+        Default 64 MB.
+    pread : bool, optional
+        If True, read uncompressed, unscaled cutout and psf extensions with
+        positional reads of the file at offsets found when it is opened,
+        rather than through fitsio.  The results are the same.  Default
+        True.
+    index_sidecar : bool, optional
+        If True, the sorted indices used by index_of_id and index_of_number
+        are stored in sidecar files next to the MEDS file, for example
+        'file.fits.id-index.npz', and loaded from there when they match
+        the size and modification time of the MEDS file.  The same holds
+        for the sky positions used by query_cone and query_box, stored in
+        'file.fits.radec-index.npz'.  Default False.
 
     Attributes
     ----------
@@ -41,16 +127,30 @@ class MEDS(object):
     -------
     close()
         Close the underlying FITS file.
-    get_cutout(iobj, icutout, type='image')
+    get_cutout(iobj, icutout, type='image', copy=False)
         Get a single cutout for the indicated entry and image type.
-    get_mosaic(iobj, type='image')
+    get_mosaic(iobj, type='image', copy=False)
         Get a mosaic of all cutouts associated with this coadd object.
-    get_cutout_list(iobj, type='image')
+    get_cutout_list(iobj, type='image', copy=False)
         Get an image list with all cutouts associated with this coadd object.
-    get_psf(iobj, icutout)
+    get_cutouts(iobj, icutout, type='image', return_shapes=False)
+        Get a stack of cutouts for many objects in one ordered pass.
+    get_cache_stats()
+        Get hit and miss counts and the size of the cutout cache.
+    get_tile_cache_stats()
+        Get hit and miss counts and the size of the decompressed tile cache.
+    clear_cache()
+        Remove all entries from the cutout cache.
+    get_psf(iobj, icutout, copy=False)
         Get a single psf image for the indicated entry.
-    get_psf_list(iobj)
+    get_psf_list(iobj, copy=False)
         Get a list of psf images.
+    get_object_bundle(iobj, types=None, psf=True, interp_seg=False,
+                      parallel=False)
+        Get all the cutouts for an object as stacks, with the psfs,
+        jacobians and centers.
+    iter_objects(start=0, end=None, types=['image'], prefetch=2)
+        Iterate over objects in file order, reading ahead in large slabs.
     get_cweight_cutout(iobj, icutout, restrict_to_seg=False)
         Composite the weight and seg maps, interpolating seg map from the
         coadd.
@@ -60,11 +160,14 @@ class MEDS(object):
     get_cweight_cutout_list(iobj)
         Composite the weight and seg maps, interpolating seg map from the
         coadd.
-    get_uberseg(iobj, icutout, fast=True)
+    get_cweight_stack(iobj, restrict_to_seg=False)
+        Composite the weight and seg maps for all epochs, as a
+        (ncutout, box_size, box_size) stack.
+    get_uberseg(iobj, icutout, fast=True, engine='tree')
         Get the cweight map and zero out pixels not nearest to central object.
     get_cweight_cutout_nearest
         Alias for get_uberseg.
-    get_uberseg_list(iobj, fast=True)
+    get_uberseg_list(iobj, fast=True, engine='tree', nthreads=1)
         Composite the weight and seg maps, interpolating seg map from the
         coadd.
     get_cweight_cutout_nearest_list
@@ -77,11 +180,16 @@ class MEDS(object):
     get_cseg_cutout_list(iobj)
         Interpolate the coadd seg onto the planes of the cutouts.
         Get a list of all seg cutouts.
+    get_cseg_stack(iobj)
+        Interpolate the coadd seg onto the planes of all cutouts, as a
+        (ncutout, box_size, box_size) stack.
     get_cseg_weight(iobj, icutout, use_canonical_cen=False)
         Get the largest circularly masked weight map that does not
         interesect any other objects seg map.
     interpolate_coadd_seg_mosaic(iobj)
         Get a mosaic of interpolated seg maps.
+    interpolate_coadd_seg_stack(iobj)
+        Get a (ncutout, box_size, box_size) stack of interpolated seg maps.
     interpolate_coadd_seg(iobj, icutout)
         Interpolate the coadd segmentation map onto the SE image frame.
     get_source_info(iobj, icutout)
@@ -101,8 +209,23 @@ class MEDS(object):
     get_jacobian_list(iobj)
         Get the list of jacobians for all cutouts
         for this object.
+    get_jacobian_array(iobj)
+        Get the jacobians for all cutouts as an (ncutout, 2, 2) array.
+    get_jacobian_inverse_array(iobj)
+        Get the inverse jacobians for all cutouts as an (ncutout, 2, 2)
+        array.
+    get_all_jacobians()
+        Get jacobians and inverses for all objects and cutouts.
     get_number(iobj)
         Get the segmentation map number.
+    index_of_id(ids, allow_missing=False)
+        Get the object indices for the input ids.
+    index_of_number(numbers, allow_missing=False)
+        Get the object indices for the input segmentation map numbers.
+    query_cone(ra, dec, radius)
+        Get the indices of objects within a radius of a position.
+    query_box(ra_min, ra_max, dec_min, dec_max)
+        Get the indices of objects within a range of ra and dec.
     get_cutout_rowcol(iobj, icutout)
         Get cutout_row, cutout_col for the specified object
         and epoch.
@@ -176,19 +299,159 @@ class MEDS(object):
     >>> info = m.get_image_info()
     >>> meta = m.get_meta()
     """
-    def __init__(self, filename):
+    def __init__(self, filename, mmap=False, cache_bytes=None,
+                 columns=None, lazy=False, derived=True, threadsafe=False,
+                 index_sidecar=False, pread=True,
+                 tile_cache_bytes=64*1024*1024):
         self._filename = filename
+        self._index_sidecar = index_sidecar
+
+        # protects state filled on demand
+        self._lock = threading.Lock()
 
-        self._fits = fitsio.FITS(filename)
+        if threadsafe:
+            self._local = threading.local()
+        else:
+            self._local = None
+        self._thread_fits = []
+        self._executor = None
+
+        self._main_fits = fitsio.FITS(filename)
+
+        if columns is not None:
+            columns = list(columns)
+            if 'ncutout' not in columns:
+                columns.append('ncutout')
+
+        if lazy:
+            self._cat = _LazyCatalog(self._main_fits["object_data"], columns)
+            self._image_info = None
+            self._meta = None
+        else:
+            self._cat = self._main_fits["object_data"].read(columns=columns)
+            self._image_info = self._main_fits["image_info"][:]
+            self._meta = self._main_fits["metadata"][:]
+
+        self._load_hdu_info()
+
+        # positional reads of the raw file, safe to share between threads
+        self._raw_file = None
+        if pread and _have_pread and any(
+            info['raw'] for info in self._hdu_info.values()
+        ):
+            self._raw_file = open(filename, 'rb', buffering=0)
+
+        self._mmaps = {}
+        if mmap:
+            self._load_mmaps()
+
+        # filled on demand by get_all_jacobians
+        self._jacobians = None
+        self._jacobian_inverses = None
+        self._pixel_grids = {}
+
+        # filled on demand by _get_lookup
+        self._lookups = {}
+
+        # precomputed maps, see meds.derived
+        if derived:
+            self._derived_types = [
+                type for type in ['uberseg', 'cweight']
+                if '%s_cutouts' % type in self._main_fits
+            ]
+        else:
+            self._derived_types = []
+
+        if cache_bytes:
+            self._cache = LRUCache(cache_bytes)
+        else:
+            self._cache = None
 
-        self._cat = self._fits["object_data"][:]
-        self._image_info = self._fits["image_info"][:]
-        self._meta = self._fits["metadata"][:]
+        if tile_cache_bytes and any(
+            info['compressed'] for info in self._hdu_info.values()
+        ):
+            self._tile_cache = LRUCache(tile_cache_bytes)
+        else:
+            self._tile_cache = None
 
     def close(self):
-        self._fits.close()
+        self._mmaps = {}
+        if self._tile_cache is not None:
+            self._tile_cache.clear()
+        if self._raw_file is not None:
+            self._raw_file.close()
+            self._raw_file = None
+        if self._cache is not None:
+            self._cache.clear()
+
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+            for finalizer in self._thread_fits:
+                finalizer()
+            self._thread_fits = []
+        self._main_fits.close()
+
+    @property
+    def _fits(self):
+        """
+        the fitsio handle; in threadsafe mode each thread gets its own,
+        which is closed when the thread exits or by close()
+        """
+        if self._local is None:
+            return self._main_fits
+
+        holder = getattr(self._local, 'holder', None)
+        if holder is None:
+            holder = _ThreadFITS(fitsio.FITS(self._filename))
+            self._local.holder = holder
+
+            # the thread local holder is released when the thread exits
+            finalizer = weakref.finalize(holder, holder.fits.close)
+            with self._lock:
+                self._thread_fits = [
+                    f for f in self._thread_fits if f.alive
+                ]
+                self._thread_fits.append(finalizer)
+
+        return holder.fits
+
+    def get_cache_stats(self):
+        """Get statistics for the cutout cache.
+
+        Returns
+        -------
+        stats : dict or None
+            A dict with the number of hits, misses, evictions, entries and
+            bytes held, or None if caching is not enabled.
+        """
+        if self._cache is None:
+            return None
+        return self._cache.get_stats()
+
+    def clear_cache(self):
+        """Remove all entries from the cutout cache and reset the counters.
+        """
+        if self._cache is not None:
+            self._cache.clear()
+
+    def get_tile_cache_stats(self):
+        """Get statistics for the cache of decompressed tiles.
 
-    def get_cutout(self, iobj, icutout, type='image'):
+        Returns
+        -------
+        stats : dict or None
+            A dict with the number of hits, misses, evictions, entries and
+            bytes held, or None if there are no compressed extensions or
+            tile caching is not enabled.
+        """
+        if self._tile_cache is None:
+            return None
+        return self._tile_cache.get_stats()
+
+    def get_cutout(self, iobj, icutout, type='image', copy=False):
         """Get a single cutout for the indicated entry and image type.
 
         Parameters
@@ -199,7 +462,12 @@ class MEDS(object):
             Index of the cutout for this object.
         type: string, optional
             Cutout type. Default is 'image'. Allowed values are 'image',
-            'weight', 'seg', 'bmask', 'ormask', 'noise' or 'psf'.
+            'weight', 'seg', 'bmask', 'ormask', 'noise' or 'psf', and
+            'uberseg' or 'cweight' if the file has derived maps.
+        copy : bool, optional
+            If the file is memory mapped or cached, return a writeable copy in
+            native byte order rather than a read-only array.  Uncached reads
+            through fitsio always return a new array.  Default False.
 
         Returns
         -------
@@ -208,7 +476,7 @@ class MEDS(object):
         """
 
         if type == 'psf':
-            return self.get_psf(iobj, icutout)
+            return self.get_psf(iobj, icutout, copy=copy)
 
         self._check_indices(iobj, icutout=icutout)
 
@@ -218,11 +486,19 @@ class MEDS(object):
 
         extname = self._get_extension_name(type)
 
-        imflat = self._fits[extname][start_row:row_end]
+        if self._cache is not None:
+            mflat = self._get_cached_mosaic_pixels(iobj, type, extname)
+            offset = start_row - self._cat['start_row'][iobj, 0]
+            imflat = mflat[offset:offset + row_end - start_row]
+            if copy:
+                imflat = _native_copy(imflat)
+        else:
+            imflat = self._read_pixels(extname, start_row, row_end, copy=copy)
+
         im = imflat.reshape(box_size, box_size)
         return im
 
-    def get_mosaic(self, iobj, type='image'):
+    def get_mosaic(self, iobj, type='image', copy=False):
         """Get a mosaic of all cutouts associated with this coadd object.
 
         Parameters
@@ -232,6 +508,9 @@ class MEDS(object):
         type: string, optional
             Cutout type. Default is 'image'. Allowed values are 'image',
             'weight', 'seg', 'bmask', 'ormask', 'noise' or 'psf'.
+        copy : bool, optional
+            If the file is memory mapped or cached, return a writeable copy in
+            native byte order rather than a read-only array.  Default False.
 
         Returns
         -------
@@ -244,17 +523,45 @@ class MEDS(object):
         ncutout = self._cat['ncutout'][iobj]
         box_size = self._cat['box_size'][iobj]
 
-        start_row = self._cat['start_row'][iobj, 0]
-        row_end = start_row + box_size*box_size*ncutout
-
         extname = self._get_extension_name(type)
 
-        mflat = self._fits[extname][start_row:row_end]
+        if self._cache is not None:
+            mflat = self._get_cached_mosaic_pixels(iobj, type, extname)
+            if copy:
+                mflat = _native_copy(mflat)
+        else:
+            mflat = self._read_mosaic_pixels(iobj, extname, copy=copy)
+
         mosaic = mflat.reshape(ncutout*box_size, box_size)
 
         return mosaic
 
-    def get_cutout_list(self, iobj, type='image'):
+    def _read_mosaic_pixels(self, iobj, extname, copy=False):
+        """
+        read the flat pixels for all cutouts of an object
+        """
+        ncutout = self._cat['ncutout'][iobj]
+        box_size = self._cat['box_size'][iobj]
+
+        start_row = self._cat['start_row'][iobj, 0]
+        row_end = start_row + box_size*box_size*ncutout
+
+        return self._read_pixels(extname, start_row, row_end, copy=copy)
+
+    def _get_cached_mosaic_pixels(self, iobj, type, extname):
+        """
+        get the flat mosaic pixels from the cache, reading and
+        caching them if needed
+        """
+        key = (type, iobj)
+        mflat = self._cache.get(key)
+        if mflat is None:
+            mflat = self._read_mosaic_pixels(iobj, extname)
+            self._cache.put(key, mflat)
+
+        return mflat
+
+    def get_cutout_list(self, iobj, type='image', copy=False):
         """Get an image list with all cutouts associated with this coadd object.
 
         Note each individual cutout is actually a view into a larger
@@ -267,6 +574,9 @@ class MEDS(object):
         type: string, optional
             Cutout type. Default is 'image'. Allowed values are 'image',
             'weight', 'seg', 'bmask', 'ormask', 'noise' or 'psf'.
+        copy : bool, optional
+            If the file is memory mapped or cached, return writeable copies in
+            native byte order rather than read-only arrays.  Default False.
 
         Returns
         -------
@@ -275,18 +585,104 @@ class MEDS(object):
         """
 
         if type == 'psf':
-            return self.get_psf_list(iobj)
+            return self.get_psf_list(iobj, copy=copy)
 
-        mosaic = self.get_mosaic(iobj, type=type)
+        mosaic = self.get_mosaic(iobj, type=type, copy=copy)
         return split_mosaic(mosaic)
 
+    def get_cutouts(self, iobj, icutout, type='image', return_shapes=False):
+        """Get a stack of cutouts for many objects in a single ordered pass
+        over the extension.
+
+        The requested pixel ranges are sorted by start row and neighboring
+        ranges are merged, so each contiguous run is read only once.
+
+        Parameters
+        ----------
+        iobj : array of ints
+            Indices of the objects.
+        icutout : array of ints
+            Index of the cutout for each object.  A scalar is broadcast
+            against `iobj`.
+        type: string, optional
+            Cutout type. Default is 'image'. Allowed values are 'image',
+            'weight', 'seg', 'bmask', 'ormask', 'noise' or 'psf'.
+        return_shapes : bool, optional
+            If True, also return an array of shape (n, 2) with the row and
+            column dimensions of each cutout.  Default False.
+
+        Returns
+        -------
+        cutouts : np.array
+            An array of shape (n, nrow, ncol).  If the cutouts have different
+            dimensions, each is stored in the upper left corner of the stack
+            entry and the remainder is zero.  For no requested cutouts the
+            shape is (0, 0, 0).
+        shapes : np.array
+            Only returned if `return_shapes` is True.
+        """
+
+        iobj, icutout = numpy.broadcast_arrays(
+            numpy.atleast_1d(iobj).astype('i8'),
+            numpy.atleast_1d(icutout).astype('i8'),
+        )
+        self._check_index_arrays(iobj, icutout)
+
+        if type == 'psf':
+            if not self.has_psf():
+                raise ValueError("this MEDS file has no 'psf' extension")
+            extname = 'psf'
+            start_rows = self._cat['psf_start_row'][iobj, icutout]
+            shapes = self._get_psf_shapes(iobj, icutout)
+        else:
+            extname = self._get_extension_name(type)
+            start_rows = self._cat['start_row'][iobj, icutout]
+            box_size = self._cat['box_size'][iobj]
+            shapes = numpy.column_stack([box_size, box_size])
+
+        if iobj.size == 0:
+            # read one pixel for the dtype
+            data = self._read_pixels(extname, 0, 1)
+            cutouts = numpy.zeros(
+                (0, 0, 0), dtype=data.dtype.newbyteorder('='),
+            )
+            if return_shapes:
+                return cutouts, shapes
+            else:
+                return cutouts
+
+        npix = shapes[:, 0] * shapes[:, 1]
+        nrow, ncol = shapes.max(axis=0)
+
+        cutouts = None
+        for start, end, inds in _get_merged_ranges(start_rows, npix):
+            data = self._read_pixels(extname, start, end)
+
+            if cutouts is None:
+                cutouts = numpy.zeros(
+                    (iobj.size, nrow, ncol),
+                    dtype=data.dtype.newbyteorder('='),
+                )
+
+            for i in inds:
+                i0 = start_rows[i] - start
+                sh = shapes[i]
+                cutouts[i, :sh[0], :sh[1]] = (
+                    data[i0:i0 + npix[i]].reshape(sh)
+                )
+
+        if return_shapes:
+            return cutouts, shapes
+        else:
+            return cutouts
+
     def has_psf(self):
         """
         returns True if psfs are in the file
         """
         return 'psf' in self._fits
 
-    def get_psf(self, iobj, icutout):
+    def get_psf(self, iobj, icutout, copy=False):
         """Get a single psf image for the indicated entry.
 
         Parameters
@@ -295,6 +691,9 @@ class MEDS(object):
             Index of the object.
         icutout : int
             Index of the cutout for this object.
+        copy : bool, optional
+            If the file is memory mapped or cached, return a writeable copy in
+            native byte order rather than a read-only array.  Default False.
 
         Returns
         -------
@@ -307,16 +706,41 @@ class MEDS(object):
 
         self._check_indices(iobj, icutout=icutout)
 
+        if self._cache is not None:
+            im = self._get_cached_psfs(iobj)[icutout]
+            if copy:
+                im = _native_copy(im)
+            return im
+
+        return self._read_psf(iobj, icutout, copy=copy)
+
+    def _read_psf(self, iobj, icutout, copy=False):
         shape = self._get_psf_shape(iobj, icutout)
         npix = shape[0]*shape[1]
 
         start_row = self._cat['psf_start_row'][iobj, icutout]
         row_end = start_row + npix
 
-        imflat = self._fits['psf'][start_row:row_end]
+        imflat = self._read_pixels('psf', start_row, row_end, copy=copy)
         im = imflat.reshape(shape)
         return im
 
+    def _get_cached_psfs(self, iobj):
+        """
+        get a tuple of all psfs for the object from the cache, reading and
+        caching them if needed
+        """
+        key = ('psf', iobj)
+        psfs = self._cache.get(key)
+        if psfs is None:
+            ncut = self._cat['ncutout'][iobj]
+            psfs = tuple(
+                self._read_psf(iobj, icut) for icut in range(ncut)
+            )
+            self._cache.put(key, psfs)
+
+        return psfs
+
     def _get_psf_shape(self, iobj, icutout):
         cat = self._cat
         if 'psf_row_size' in cat.dtype.names:
@@ -340,13 +764,37 @@ class MEDS(object):
 
         return shape
 
-    def get_psf_list(self, iobj):
+    def _get_psf_shapes(self, iobj, icutout):
+        """
+        array version of _get_psf_shape, returns an (n, 2) array
+        """
+        cat = self._cat
+        if 'psf_row_size' in cat.dtype.names:
+            if len(cat['psf_row_size'].shape) > 1:
+                nrow = cat['psf_row_size'][iobj, icutout]
+                ncol = cat['psf_col_size'][iobj, icutout]
+            else:
+                nrow = cat['psf_row_size'][iobj]
+                ncol = cat['psf_col_size'][iobj]
+        else:
+            if len(cat['psf_box_size'].shape) > 1:
+                nrow = cat['psf_box_size'][iobj, icutout]
+            else:
+                nrow = cat['psf_box_size'][iobj]
+            ncol = nrow
+
+        return numpy.column_stack([nrow, ncol]).astype('i8')
+
+    def get_psf_list(self, iobj, copy=False):
         """Get a list of psf images.
 
         Parameters
         ----------
         iobj : int
             Index of the object.
+        copy : bool, optional
+            If the file is memory mapped or cached, return writeable copies in
+            native byte order rather than read-only arrays.  Default False.
 
         Returns
         -------
@@ -354,7 +802,224 @@ class MEDS(object):
             A list of the PSFs as numpy arrays.
         """
         ncut = self['ncutout'][iobj]
-        return [self.get_psf(iobj, icut) for icut in range(ncut)]
+        return [self.get_psf(iobj, icut, copy=copy) for icut in range(ncut)]
+
+    def get_object_bundle(self, iobj, types=None, psf=True,
+                          interp_seg=False, parallel=False):
+        """Get all the cutouts for an object, with the psfs, jacobians and
+        centers, in one call.
+
+        Parameters
+        ----------
+        iobj : int
+            Index of the object.
+        types : list of str, optional
+            The cutout types to read.  Default is all of 'image', 'weight',
+            'seg', 'bmask', 'ormask' and 'noise' present in the file.
+        psf : bool, optional
+            If True, include the psfs, if the file has them.  Default True.
+        interp_seg : bool, optional
+            If True, include the coadd seg map interpolated onto each cutout,
+            see interpolate_coadd_seg_stack.  Default False.
+        parallel : bool, optional
+            If True, read the different extensions at the same time in a
+            pool of threads.  The reader must have been created with
+            threadsafe=True.  Default False.
+
+        Returns
+        -------
+        bundle : dict
+            Writeable arrays keyed by
+
+            - each cutout type: the cutouts, shape (ncutout, box_size,
+              box_size)
+            - 'psf': the psfs, shape (ncutout, nrow, ncol), with smaller
+              psfs stored in the upper left corner and zero padded, and
+              'psf_shapes', shape (ncutout, 2).  Only present if psf is True
+              and the file has psfs.
+            - 'interp_seg': the interpolated seg maps, if requested.
+            - 'jacobian': the jacobians, shape (ncutout, 2, 2).
+            - 'cutout_row', 'cutout_col': the centers in the cutouts,
+              shape (ncutout,).
+        """
+        self._check_indices(iobj)
+
+        if types is None:
+            types = [
+                type for type in _BUNDLE_TYPES
+                if '%s_cutouts' % type in self._fits
+            ]
+
+        if parallel and self._local is None:
+            raise ValueError(
+                "parallel reads need a reader created with threadsafe=True"
+            )
+
+        ncutout = self._cat['ncutout'][iobj]
+
+        reads = {}
+        for type in types:
+            reads[type] = functools.partial(
+                self.get_mosaic, iobj, type=type, copy=True,
+            )
+        if psf and self.has_psf():
+            reads['psf'] = functools.partial(
+                self.get_cutouts, iobj, numpy.arange(ncutout), type='psf',
+                return_shapes=True,
+            )
+        if interp_seg:
+            reads['interp_seg'] = functools.partial(
+                self.interpolate_coadd_seg_stack, iobj,
+            )
+
+        if parallel:
+            executor = self._get_executor()
+            futures = {
+                key: executor.submit(read) for key, read in reads.items()
+            }
+            results = {
+                key: future.result() for key, future in futures.items()
+            }
+        else:
+            results = {key: read() for key, read in reads.items()}
+
+        bundle = {}
+        for type in types:
+            bundle[type] = _mosaic_to_stack(results[type])
+        if 'psf' in results:
+            bundle['psf'], bundle['psf_shapes'] = results['psf']
+        if interp_seg:
+            bundle['interp_seg'] = results['interp_seg']
+
+        bundle['jacobian'] = self.get_jacobian_array(iobj).copy()
+        bundle['cutout_row'] = self._cat['cutout_row'][iobj, :ncutout].copy()
+        bundle['cutout_col'] = self._cat['cutout_col'][iobj, :ncutout].copy()
+
+        return bundle
+
+    def _get_executor(self):
+        """
+        get the pool of threads used for parallel reads, created on
+        first use
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=len(_BUNDLE_TYPES) + 2,
+                )
+            return self._executor
+
+    def iter_objects(self, start=0, end=None, types=('image',), prefetch=2,
+                     slab_pixels=4*1024*1024):
+        """Iterate over objects in file order, reading the cutouts in large
+        contiguous slabs ahead of time in a background thread.
+
+        Objects with no cutouts are skipped.
+
+        Parameters
+        ----------
+        start : int, optional
+            Index of the first object.  Default 0.
+        end : int, optional
+            One past the index of the last object.  Default is the number of
+            objects.
+        types : list of str, optional
+            The cutout types to read.  Default ['image'].
+        prefetch : int, optional
+            Number of slabs to read ahead.  Default 2.
+        slab_pixels : int, optional
+            Target number of pixels in each slab.  Objects larger than this
+            get their own slab.  Default 4*1024*1024.
+
+        Yields
+        ------
+        iobj, mosaics : int, dict
+            The index of the object and a dict of mosaics keyed by type.  The
+            mosaics are views into the slabs, so copy them to keep them
+            beyond the iteration.
+
+        Examples
+        --------
+        >>> for iobj, mosaics in m.iter_objects(types=['image', 'weight']):
+        ...     im = mosaics['image']
+        """
+        if end is None:
+            end = self.size
+        if start < 0 or end > self.size or start > end:
+            raise ValueError(
+                "bad object range [%s,%s) for %s objects" % (
+                    start, end, self.size,
+                )
+            )
+        if prefetch < 1:
+            raise ValueError("prefetch must be >= 1, got %s" % prefetch)
+
+        types = list(types)
+        extnames = [self._get_extension_name(type) for type in types]
+
+        ncutout = self._cat['ncutout'][start:end]
+        iobjs = numpy.arange(start, end)[ncutout > 0]
+        box_size = self._cat['box_size'][iobjs].astype('i8')
+        starts = self._cat['start_row'][iobjs, 0].astype('i8')
+        npix = ncutout[ncutout > 0]*box_size**2
+
+        slabs = _get_slab_ranges(starts, npix, slab_pixels)
+
+        slab_queue = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+
+        thread = threading.Thread(
+            target=self._read_slabs,
+            args=(extnames, slabs, slab_queue, stop),
+        )
+        thread.daemon = True
+        thread.start()
+
+        try:
+            for slab_start, slab_end, slab_inds in slabs:
+                data = slab_queue.get()
+                if isinstance(data, Exception):
+                    raise data
+
+                for ind in slab_inds:
+                    offset = starts[ind] - slab_start
+                    mosaics = {}
+                    for type, slab in zip(types, data):
+                        mosaics[type] = slab[
+                            offset:offset + npix[ind]
+                        ].reshape(-1, box_size[ind])
+
+                    yield iobjs[ind], mosaics
+        finally:
+            # unblock the reader if we stopped early
+            stop.set()
+            while thread.is_alive():
+                try:
+                    slab_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            thread.join()
+
+    def _read_slabs(self, extnames, slabs, slab_queue, stop):
+        """
+        read the slabs for each extension and put them in the queue,
+        using a separate file handle
+        """
+        try:
+            with fitsio.FITS(self._filename) as fits:
+                for slab_start, slab_end, _ in slabs:
+                    if stop.is_set():
+                        break
+
+                    data = [
+                        self._read_pixels(
+                            extname, slab_start, slab_end, fits=fits,
+                        )
+                        for extname in extnames
+                    ]
+                    slab_queue.put(data)
+        except Exception as err:
+            slab_queue.put(err)
 
     def get_cweight_cutout(self, iobj, icutout, restrict_to_seg=False):
         """Composite the weight and seg maps, interpolating seg map from the
@@ -377,11 +1042,51 @@ class MEDS(object):
         weight : np.array
             The weight map as a numpy array.
         """
-        wt = self.get_cutout(iobj, icutout, type='weight')
-        coadd_seg = self.get_cutout(iobj, 0, type='seg')
-        cwt = self._make_composite_image(iobj, icutout, wt, coadd_seg,
-                                         restrict_to_seg=restrict_to_seg)
-        return cwt
+        self._check_indices(iobj, icutout)
+
+        if not restrict_to_seg and 'cweight' in self._derived_types:
+            return self.get_cutout(iobj, icutout, type='cweight', copy=True)
+
+        wt = self.get_cutout(iobj, icutout, type='weight', copy=True)
+        self._make_composite_stack(
+            iobj, [icutout], wt[numpy.newaxis],
+            restrict_to_seg=restrict_to_seg,
+        )
+        return wt
+
+    def get_cweight_stack(self, iobj, restrict_to_seg=False):
+        """Composite the weight and seg maps for all epochs, interpolating
+        seg map from the coadd.
+
+        All epochs are mapped into the coadd frame at once.  The weight is
+        set to zero outside the region as defined in the coadd.
+
+        Parameters
+        ----------
+        iobj : int
+            Index of the object.
+        restrict_to_seg : bool, optional
+            Set weights to zero for any pixel in the image not associated
+            with the central object.
+
+        Returns
+        -------
+        stack : np.array
+            The composite weight maps, shape (ncutout, box_size, box_size),
+            with the dtype of the weight maps.
+        """
+        if not restrict_to_seg and 'cweight' in self._derived_types:
+            mosaic = self.get_mosaic(iobj, type='cweight', copy=True)
+            return _mosaic_to_stack(mosaic)
+
+        wtmosaic = self.get_mosaic(iobj, type='weight', copy=True)
+        stack = _mosaic_to_stack(wtmosaic)
+
+        self._make_composite_stack(
+            iobj, numpy.arange(stack.shape[0]), stack,
+            restrict_to_seg=restrict_to_seg,
+        )
+        return stack
 
     def get_cweight_mosaic(self, iobj, restrict_to_seg=False):
         """Composite the weight and seg maps, interpolating seg map from the
@@ -402,18 +1107,8 @@ class MEDS(object):
         mosaic : np.array
             A mosaic of the composite weight maps.
         """
-        wtmosaic = self.get_mosaic(iobj, type='weight')
-        coadd_seg = self.get_cutout(iobj, 0, type='seg')
-
-        # shares underlying storage
-        wlist = split_mosaic(wtmosaic)
-
-        for icutout, wt in enumerate(wlist):
-            cwt = self._make_composite_image(iobj, icutout, wt, coadd_seg,
-                                             restrict_to_seg=restrict_to_seg)
-            wt[:, :] = cwt[:, :]
-
-        return wtmosaic
+        stack = self.get_cweight_stack(iobj, restrict_to_seg=restrict_to_seg)
+        return _stack_to_mosaic(stack)
 
     def get_cweight_cutout_list(self, iobj, restrict_to_seg=False):
         """Composite the weight and seg maps, interpolating seg map from the
@@ -434,14 +1129,12 @@ class MEDS(object):
         list : list of np.arrays
             A list of the weight maps.
         """
-        wtmosaic = self.get_cweight_mosaic(
-            iobj, restrict_to_seg=restrict_to_seg)
+        stack = self.get_cweight_stack(iobj, restrict_to_seg=restrict_to_seg)
 
         # shares underlying storage
-        wlist = split_mosaic(wtmosaic)
-        return wlist
+        return list(stack)
 
-    def get_uberseg(self, iobj, icutout, fast=True):
+    def get_uberseg(self, iobj, icutout, fast=True, engine='tree'):
         """Get the cweight map and zero out pixels not nearest to central
         object.
 
@@ -455,58 +1148,32 @@ class MEDS(object):
             Index of cutout.
         fast : bool, optional
             Use the fast C code.
+        engine : str, optional
+            How to find the nearest object to each pixel.  'tree' searches
+            a tree of the seg pixels for each pixel; 'edt' uses exact
+            euclidean distance transforms of the whole stamp, requires
+            scipy, and gives identical results.  Default 'tree'.
 
         Returns
         -------
         weight : np.array
             The weight map as a numpy array.
         """
+        self._check_indices(iobj, icutout)
+        _check_uberseg_engine(engine)
 
-        weight = self.get_cweight_cutout(iobj, icutout)
-        seg = self.interpolate_coadd_seg(iobj, icutout)
-
-        # if only have sky and object, then just return
-        if len(numpy.unique(seg)) == 2:
-            return weight
-
-        # First get all indices of all seg map pixels which contain an object
-        # i.e. are not equal to zero
+        if fast and 'uberseg' in self._derived_types:
+            self._check_coadd_jacobian(iobj, [icutout])
+            return self.get_cutout(iobj, icutout, type='uberseg', copy=True)
 
-        obj_inds = numpy.where(seg != 0)
-
-        # the seg map holds the sextractor number, 1 offset
-        object_number = self['number'][iobj]
-
-        if fast and _have_c_ubserseg:
-            # call fast c code with tree
-            Nx, Ny = seg.shape
-            Ninds = len(obj_inds[0])
-            seg = seg.astype(numpy.int32)
-            weight = weight.astype(numpy.float32, copy=False)
-            obj_inds_x = obj_inds[0].astype(numpy.int32, copy=False)
-            obj_inds_y = obj_inds[1].astype(numpy.int32, copy=False)
-            _uberseg.uberseg_tree(
-                seg, weight, Nx, Ny,
-                object_number, obj_inds_x, obj_inds_y, Ninds)
-        else:
-            # Then loop through pixels in seg map, check which obj ind it is
-            # closest to.  If the closest obj ind does not correspond to the
-            # target, set this pixel in the weight map to zero.
-
-            for i, row in enumerate(seg):
-                for j, element in enumerate(row):
-                    obj_dists = (i-obj_inds[0])**2 + (j-obj_inds[1])**2
-                    ind_min = numpy.argmin(obj_dists)
-
-                    segval = seg[obj_inds[0][ind_min], obj_inds[1][ind_min]]
-                    if segval != object_number:
-                        weight[i, j] = 0.
-
-        return weight
+        wt = self.get_cutout(iobj, icutout, type='weight', copy=True)
+        return self._make_uberseg_list(
+            iobj, [icutout], wt[numpy.newaxis], fast=fast, engine=engine,
+        )[0]
 
     get_cweight_cutout_nearest = get_uberseg
 
-    def get_uberseg_list(self, iobj, fast=True):
+    def get_uberseg_list(self, iobj, fast=True, engine='tree', nthreads=1):
         """Get the cweight map and zero out pixels not nearest to central
         object.
 
@@ -518,24 +1185,34 @@ class MEDS(object):
             Index of the object.
         fast : bool, optional
             Use the fast C code.
+        engine : str, optional
+            How to find the nearest object to each pixel, 'tree' or 'edt'.
+            See get_uberseg.  Default 'tree'.
+        nthreads : int, optional
+            Number of threads for the fast C code with the 'tree' engine,
+            which processes all the cutouts in one call and releases the
+            GIL.  Default 1.
 
         Returns
         -------
         list : list of np.arrays
             A list of the weight maps.
         """
+        _check_uberseg_engine(engine)
 
-        useg_list = []
-        for i in range(self['ncutout'][iobj]):
-            uberseg = self.get_uberseg(
-                iobj,
-                i,
-                fast=fast,
-            )
+        if fast and 'uberseg' in self._derived_types:
+            ncutout = self['ncutout'][iobj]
+            self._check_coadd_jacobian(iobj, numpy.arange(ncutout))
+            mosaic = self.get_mosaic(iobj, type='uberseg', copy=True)
+            return list(_mosaic_to_stack(mosaic))
 
-            useg_list.append(uberseg)
+        wtmosaic = self.get_mosaic(iobj, type='weight', copy=True)
+        stack = _mosaic_to_stack(wtmosaic)
 
-        return useg_list
+        return self._make_uberseg_list(
+            iobj, numpy.arange(stack.shape[0]), stack, fast=fast,
+            engine=engine, nthreads=nthreads,
+        )
 
     get_cweight_cutout_nearest_list = get_uberseg_list
 
@@ -557,16 +1234,16 @@ class MEDS(object):
         seg : np.array
             The segmentation map.
         """
-        seg = self.get_cutout(iobj, icutout, type='seg')
+        self._check_indices(iobj, icutout)
+
+        seg = self.get_cutout(iobj, icutout, type='seg', copy=True)
         seg[:, :] = self.get_number(iobj)
 
-        coadd_seg = self.get_cutout(iobj, 0, type='seg')
-        cseg = self._make_composite_image(iobj, icutout, seg, coadd_seg)
-        return cseg
+        self._make_composite_stack(iobj, [icutout], seg[numpy.newaxis])
+        return seg
 
-    def get_cseg_mosaic(self, iobj):
-        """Interpolate the coadd seg onto the planes of the cutouts. Get
-        a big mosaic of all of the epochs.
+    def get_cseg_stack(self, iobj):
+        """Interpolate the coadd seg onto the planes of all cutouts at once.
 
         The seg is set to zero outside the region as defined in the coadd,
         and to the "number" field from sextractor inside the region.
@@ -578,22 +1255,34 @@ class MEDS(object):
 
         Returns
         -------
-        mosaic : np.array
-            A mosaic of the segmentation maps.
+        stack : np.array
+            The segmentation maps, shape (ncutout, box_size, box_size).
         """
-        segmosaic = self.get_mosaic(iobj, type='seg')
+        segmosaic = self.get_mosaic(iobj, type='seg', copy=True)
         segmosaic[:, :] = self.get_number(iobj)
+        stack = _mosaic_to_stack(segmosaic)
 
-        coadd_seg = self.get_cutout(iobj, 0, type='seg')
+        self._make_composite_stack(iobj, numpy.arange(stack.shape[0]), stack)
+        return stack
 
-        # shares underlying storage
-        wlist = split_mosaic(segmosaic)
+    def get_cseg_mosaic(self, iobj):
+        """Interpolate the coadd seg onto the planes of the cutouts. Get
+        a big mosaic of all of the epochs.
+
+        The seg is set to zero outside the region as defined in the coadd,
+        and to the "number" field from sextractor inside the region.
 
-        for icutout, seg in enumerate(wlist):
-            cseg = self._make_composite_image(iobj, icutout, seg, coadd_seg)
-            seg[:, :] = cseg[:, :]
+        Parameters
+        ----------
+        iobj : int
+            Index of the object.
 
-        return segmosaic
+        Returns
+        -------
+        mosaic : np.array
+            A mosaic of the segmentation maps.
+        """
+        return _stack_to_mosaic(self.get_cseg_stack(iobj))
 
     def get_cseg_cutout_list(self, iobj):
         """Interpolate the coadd seg onto the planes of the cutouts.
@@ -612,11 +1301,8 @@ class MEDS(object):
         list : list of np.arrays
             A list of the segmentation maps.
         """
-        segmosaic = self.get_cseg_mosaic(iobj)
-
         # shares underlying storage
-        seglist = split_mosaic(segmosaic)
-        return seglist
+        return list(self.get_cseg_stack(iobj))
 
     def get_cseg_weight(self, iobj, icutout, use_canonical_cen=False):
         """Get the largest circularly masked weight map that does not
@@ -639,7 +1325,7 @@ class MEDS(object):
         Returns
         -------
         weight : np.array
-            The masked weight map.
+            The masked weight map, with the dtype of the weight map.
         """
         seg = self.get_cutout(iobj, icutout, type='seg')
         weight = self.get_cutout(iobj, icutout, type='weight')
@@ -656,29 +1342,46 @@ class MEDS(object):
             row = self['cutout_row'][iobj, icutout]
             col = self['cutout_col'][iobj, icutout]
 
-        rows, cols = numpy.mgrid[
-            0:weight.shape[0],
-            0:weight.shape[1],
-        ]
-
-        rows = rows.astype('f8')
-        cols = cols.astype('f8')
+        rows, cols = self._get_pixel_grid(weight.shape)
 
-        rows -= row
-        cols -= col
-
-        r2 = rows**2 + cols**2
+        r2 = (rows - row)**2 + (cols - col)**2
 
         minr2 = r2[wother].min()
 
         # now set the weight to zero for radii larger than that
         wkeep = numpy.where(r2 < minr2)
-        new_weight = numpy.zeros(weight.shape)
+        new_weight = numpy.zeros(
+            weight.shape,
+            dtype=weight.dtype.newbyteorder('='),
+        )
         if wkeep[0].size > 0:
             new_weight[wkeep] = weight[wkeep]
 
         return new_weight
 
+    def interpolate_coadd_seg_stack(self, iobj):
+        """Interpolate the coadd segmentation map onto the frames of all
+        cutouts at once.
+
+        Parameters
+        ----------
+        iobj : int
+            Index of the object.
+
+        Returns
+        -------
+        stack : np.array
+            The segmentation maps, shape (ncutout, box_size, box_size).
+        """
+        self._check_indices(iobj)
+
+        icutouts = numpy.arange(self['ncutout'][iobj])
+        segs, good = self._interpolate_coadd_seg_stack(iobj, icutouts)
+        if not numpy.all(good):
+            raise numpy.linalg.LinAlgError("coadd jacobian is singular")
+
+        return segs
+
     def interpolate_coadd_seg_mosaic(self, iobj):
         """Get a mosaic of interpolated seg maps.
 
@@ -692,16 +1395,7 @@ class MEDS(object):
         mosaic : np.array
             A mosaic of the segmentation maps.
         """
-        seg_mosaic = self.get_mosaic(iobj, type='seg')
-
-        segs = split_mosaic(seg_mosaic)
-
-        for icutout, seg in enumerate(segs):
-            if icutout == 0:
-                continue
-
-            seg[:, :] = self.interpolate_coadd_seg(iobj, icutout)
-        return seg_mosaic
+        return _stack_to_mosaic(self.interpolate_coadd_seg_stack(iobj))
 
     def interpolate_coadd_seg(self, iobj, icutout):
         """Interpolate the coadd segmentation map onto the SE image frame.
@@ -718,19 +1412,16 @@ class MEDS(object):
         seg : np.array
             Interpolate segmentation map.
         """
+        self._check_indices(iobj, icutout)
 
-        coadd_seg = self.get_cutout(iobj, 0, type='seg')
         if icutout == 0:
-            return coadd_seg
+            return self.get_cutout(iobj, 0, type='seg')
 
-        jmatrix = self.get_jacobian_matrix(iobj, icutout)
-        cen = self.get_cutout_rowcol(iobj, icutout)
+        segs, good = self._interpolate_coadd_seg_stack(iobj, [icutout])
+        if not good[0]:
+            raise numpy.linalg.LinAlgError("coadd jacobian is singular")
 
-        return self._interpolate_coadd_seg_image(
-            iobj,
-            jmatrix,
-            cen=cen,
-        )
+        return segs[0]
 
     def _interpolate_coadd_seg_image(self, iobj, jmatrix, cen=None):
         """Interpolate the coadd segmentation map onto the SE image frame.
@@ -739,48 +1430,29 @@ class MEDS(object):
         ----------
         iobj : int
             Index of the object.
-        jmatrix: matrix
-            The jacobian matrix for the image.
+        jmatrix: array or matrix
+            The 2x2 jacobian matrix for the image.
         """
 
         coadd_seg = self.get_cutout(iobj, 0, type='seg')
 
-        seg = 0*coadd_seg.copy()
-
         if cen is None:
-            cen = (numpy.array(seg.shape)-1.0)/2.0
-
-        rowcen, colcen = cen
+            cen = (numpy.array(coadd_seg.shape)-1.0)/2.0
 
-        coadd_jacob = self.get_jacobian_matrix(iobj, 0)
-        coadd_rowcen, coadd_colcen = self.get_cutout_rowcol(iobj, 0)
-
-        # rows in SE seg mape
-        rows, cols = numpy.mgrid[0:seg.shape[0], 0:seg.shape[1]]
-        rowsrel = rows-rowcen
-        colsrel = cols-colcen
-
-        # this will raise a numpy.linalg.linalg.LinAlgError exception
-        cjinv = coadd_jacob.getI()
-
-        # convert pixel coords in SE cutout to u,v
-        u = rowsrel*jmatrix[0, 0] + colsrel*jmatrix[0, 1]
-        v = rowsrel*jmatrix[1, 0] + colsrel*jmatrix[1, 1]
-
-        # now convert into pixels for coadd
-        crow = coadd_rowcen + u*cjinv[0, 0] + v*cjinv[0, 1]
-        ccol = coadd_colcen + u*cjinv[1, 0] + v*cjinv[1, 1]
+        cjinv = self.get_jacobian_inverse_array(iobj)[0]
+        if not numpy.all(numpy.isfinite(cjinv)):
+            raise numpy.linalg.LinAlgError("coadd jacobian is singular")
 
-        crow = crow.round().astype('i8')
-        ccol = ccol.round().astype('i8')
-
-        # clipping makes the notation easier
-        crow = crow.clip(0, coadd_seg.shape[0]-1)
-        ccol = ccol.clip(0, coadd_seg.shape[1]-1)
-
-        seg[rows, cols] = coadd_seg[crow, ccol]
+        crow, ccol = self._map_to_coadd_pixels(
+            iobj,
+            numpy.asarray(jmatrix)[numpy.newaxis],
+            numpy.array([cen[0]]),
+            numpy.array([cen[1]]),
+            cjinv,
+            coadd_seg.shape,
+        )
 
-        return seg
+        return _as_native(coadd_seg[crow[0], ccol[0]])
 
     def get_source_info(self, iobj, icutout):
         """Get the full source file information for the indicated cutout.
@@ -799,7 +1471,7 @@ class MEDS(object):
         """
         self._check_indices(iobj, icutout=icutout)
         ifile = self._cat['file_id'][iobj, icutout]
-        return self._image_info[ifile]
+        return self.get_image_info()[ifile]
 
     def get_source_path(self, iobj, icutout):
         """Get the source filename associated with the indicated cutout.
@@ -822,17 +1494,25 @@ class MEDS(object):
 
     def get_cat(self):
         """Get the catalog.
+
+        If columns are loaded lazily, all remaining columns are read.
         """
+        if isinstance(self._cat, _LazyCatalog):
+            return self._cat.read()
         return self._cat
 
     def get_image_info(self):
         """Get the image information.
         """
+        if self._image_info is None:
+            self._image_info = self._fits["image_info"][:]
         return self._image_info
 
     def get_meta(self):
         """Get the metadata.
         """
+        if self._meta is None:
+            self._meta = self._fits["metadata"][:]
         return self._meta
 
     def get_jacobian(self, iobj, icutout):
@@ -884,10 +1564,12 @@ class MEDS(object):
 
         Returns
         -------
-        jacobian : np.array
+        jacobian : np.matrix
             A 2x2 matrix of the jacobian
                 dudrow dudcol
                 dvdrow dvdcol
+
+        See `get_jacobian_array` for a plain array of all cutouts.
         """
         jacob = numpy.matrix(numpy.zeros((2, 2)), copy=False)
 
@@ -898,6 +1580,78 @@ class MEDS(object):
 
         return jacob
 
+    def get_jacobian_array(self, iobj):
+        """Get the jacobians for all cutouts of this object as an array.
+
+        Parameters
+        ----------
+        iobj : int
+            Index of the object.
+
+        Returns
+        -------
+        jacobians : np.array
+            An array of shape (ncutout, 2, 2), each entry holding
+                dudrow dudcol
+                dvdrow dvdcol
+        """
+        self._check_indices(iobj)
+        jacobians, _ = self._get_object_jacobians(iobj)
+        return jacobians
+
+    def get_jacobian_inverse_array(self, iobj):
+        """Get the inverse jacobians for all cutouts of this object as an
+        array.
+
+        Parameters
+        ----------
+        iobj : int
+            Index of the object.
+
+        Returns
+        -------
+        inverses : np.array
+            An array of shape (ncutout, 2, 2).  Entries for singular
+            jacobians are NaN.
+        """
+        self._check_indices(iobj)
+        _, inverses = self._get_object_jacobians(iobj)
+        return inverses
+
+    def get_all_jacobians(self):
+        """Get the jacobians for all objects and cutouts.
+
+        The arrays are computed for the whole catalog on the first call
+        and kept, so they should not be modified.
+
+        Returns
+        -------
+        jacobians, inverses : tuple of np.arrays
+            Arrays of shape (nobj, ncutout_max, 2, 2).  Entries for cutouts
+            beyond ncutout, and inverses of singular jacobians, are NaN.
+        """
+        return self._get_jacobian_arrays()
+
+    def _get_jacobian_arrays(self):
+        with self._lock:
+            if self._jacobians is None:
+                self._jacobians, self._jacobian_inverses = (
+                    _make_jacobian_arrays(self._cat)
+                )
+            return self._jacobians, self._jacobian_inverses
+
+    def _get_object_jacobians(self, iobj):
+        """
+        get the jacobians and inverses for the cutouts of one object
+        """
+        ncutout = self._cat['ncutout'][iobj]
+        return _make_jacobians(
+            *[
+                self._cat[name][iobj, :ncutout]
+                for name in ['dudrow', 'dudcol', 'dvdrow', 'dvdcol']
+            ]
+        )
+
     def get_jacobian_list(self, iobj):
         """Get the list of jacobians for all cutouts
         for this object.
@@ -938,6 +1692,323 @@ class MEDS(object):
         else:
             return self._cat['number'][iobj]
 
+    def index_of_id(self, ids, allow_missing=False):
+        """Get the object indices for the input ids.
+
+        The ids are found with a binary search of the sorted id column,
+        which is built on the first call.
+
+        Parameters
+        ----------
+        ids : int or array
+            The ids to find.
+        allow_missing : bool, optional
+            If True, ids not in the file get index -1.  Otherwise a
+            ValueError is raised.  Default False.
+
+        Returns
+        -------
+        index : int or np.array
+            The indices into the catalog.
+        """
+        return self._index_of('id', ids, allow_missing)
+
+    def index_of_number(self, numbers, allow_missing=False):
+        """Get the object indices for the input segmentation map numbers.
+
+        The numbers are found with a binary search of the sorted number
+        column, which is built on the first call.
+
+        Parameters
+        ----------
+        numbers : int or array
+            The numbers to find.
+        allow_missing : bool, optional
+            If True, numbers not in the file get index -1.  Otherwise a
+            ValueError is raised.  Default False.
+
+        Returns
+        -------
+        index : int or np.array
+            The indices into the catalog.
+        """
+        if 'number' not in self._cat.dtype.names:
+            # numbers are iobj+1, see get_number
+            inds = numpy.asarray(numbers, dtype='i8') - 1
+            inds = numpy.where((inds < 0) | (inds >= self.size), -1, inds)
+            return self._check_lookup('number', numbers, inds, allow_missing)
+
+        return self._index_of('number', numbers, allow_missing)
+
+    def _index_of(self, name, values, allow_missing):
+        sorted_values, order = self._get_lookup(name)
+        inds = _search_lookup(sorted_values, order, values)
+        return self._check_lookup(name, values, inds, allow_missing)
+
+    def _check_lookup(self, name, values, inds, allow_missing):
+        """
+        check for duplicated and missing values, and return a scalar for
+        scalar input
+        """
+        values = numpy.asarray(values)
+
+        wdup = numpy.flatnonzero(inds == -2)
+        if wdup.size > 0:
+            raise ValueError(
+                "%d requested %ss are duplicated in the file, "
+                "e.g. %s" % (wdup.size, name, values.ravel()[wdup[0]])
+            )
+
+        if not allow_missing:
+            wmiss = numpy.flatnonzero(inds == -1)
+            if wmiss.size > 0:
+                raise ValueError(
+                    "%d requested %ss not found, e.g. %s" % (
+                        wmiss.size, name, values.ravel()[wmiss[0]],
+                    )
+                )
+
+        if values.ndim == 0:
+            return int(inds)
+        return inds
+
+    def _get_lookup(self, name):
+        """
+        get the sorted values and the sorting order for the column, built
+        once or loaded from the sidecar file
+        """
+        with self._lock:
+            lookup = self._lookups.get(name)
+            if lookup is None:
+                if self._index_sidecar:
+                    lookup = self._load_lookup_sidecar(name)
+
+                if lookup is None:
+                    lookup = _make_lookup(self._cat[name])
+                    if self._index_sidecar:
+                        self._write_lookup_sidecar(name, lookup)
+
+                self._lookups[name] = lookup
+
+            return lookup
+
+    def _get_lookup_sidecar_path(self, name, ext='npz'):
+        return '%s.%s-index.%s' % (self._filename, name, ext)
+
+    def _get_file_signature(self):
+        st = os.stat(self._filename)
+        return numpy.array([st.st_size, st.st_mtime_ns], dtype='i8')
+
+    def _load_lookup_sidecar(self, name):
+        """
+        load the lookup from the sidecar, or None if it is missing, out of
+        date or can't be read
+        """
+        path = self._get_lookup_sidecar_path(name)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with numpy.load(path, allow_pickle=False) as data:
+                signature = data['signature']
+                sorted_values = data['sorted_values']
+                order = data['order']
+        except _SIDECAR_ERRORS as err:
+            print('could not read index sidecar %s: %s' % (path, err))
+            return None
+
+        if not numpy.array_equal(signature, self._get_file_signature()):
+            print('index sidecar is out of date:', path)
+            return None
+
+        if (sorted_values.shape != (self.size,)
+                or order.shape != (self.size,)):
+            print('index sidecar has the wrong shape:', path)
+            return None
+
+        return sorted_values, order
+
+    def _write_lookup_sidecar(self, name, lookup):
+        path = self._get_lookup_sidecar_path(name)
+        tmp_path = path + '.tmp.npz'
+        try:
+            numpy.savez(
+                tmp_path,
+                signature=self._get_file_signature(),
+                sorted_values=lookup[0],
+                order=lookup[1],
+            )
+            os.replace(tmp_path, path)
+        except OSError as err:
+            print('could not write index sidecar %s: %s' % (path, err))
+
+    def query_cone(self, ra, dec, radius):
+        """Get the indices of objects within a radius of a position.
+
+        The search uses a kd-tree of the unit vectors for the object
+        positions, built on the first call.  Without scipy all objects are
+        checked.
+
+        Parameters
+        ----------
+        ra, dec : float
+            The center of the cone in degrees.
+        radius : float
+            The radius of the cone in degrees.
+
+        Returns
+        -------
+        indices : np.array
+            The sorted indices of the objects in the cone.
+        """
+        if radius < 0:
+            raise ValueError("radius must be >= 0, got %s" % radius)
+
+        vec = radec_to_unitvecs_ruv(
+            numpy.array([ra], dtype='f8'), numpy.array([dec], dtype='f8'),
+        )[0][0]
+
+        # chord length for the angular radius; a little slack so points
+        # on the edge are not lost to roundoff, then trimmed below
+        radius = numpy.deg2rad(min(radius, 180.0))
+        chord = 2*numpy.sin(radius/2)
+
+        vecs, tree = self._get_sky_index()
+        if tree is not None:
+            inds = numpy.array(
+                tree.query_ball_point(vec, chord*(1 + 1.0e-10) + 1.0e-15),
+                dtype='i8',
+            )
+        else:
+            inds = numpy.arange(self.size)
+
+        if inds.size > 0:
+            cosdist = numpy.clip(vecs[inds].dot(vec), -1.0, 1.0)
+            inds = inds[numpy.arccos(cosdist) <= radius]
+
+        inds.sort()
+        return inds
+
+    def query_box(self, ra_min, ra_max, dec_min, dec_max):
+        """Get the indices of objects within a range of ra and dec.
+
+        The objects are found among those in the smallest cone about the
+        center of the box that includes the corners, see query_cone.
+
+        Parameters
+        ----------
+        ra_min, ra_max : float
+            The range of ra in degrees.  If ra_min > ra_max the box wraps
+            through ra = 0, e.g. 350 to 10.
+        dec_min, dec_max : float
+            The range of dec in degrees.
+
+        Returns
+        -------
+        indices : np.array
+            The sorted indices of the objects in the box.
+        """
+        if dec_min > dec_max:
+            raise ValueError(
+                "dec_min must be <= dec_max, got %s %s" % (dec_min, dec_max)
+            )
+
+        full_ra = ra_max - ra_min >= 360.0
+
+        ra_min = ra_min % 360.0
+        ra_max = ra_max % 360.0
+        if full_ra:
+            ra_width = 360.0
+        else:
+            ra_width = (ra_max - ra_min) % 360.0
+
+        ra_cen = ra_min + ra_width/2
+        dec_cen = (dec_min + dec_max)/2
+
+        # the most distant points of the box from the center are corners
+        corner_ra = numpy.array([ra_min, ra_min, ra_max, ra_max])
+        corner_dec = numpy.array([dec_min, dec_max, dec_min, dec_max])
+        cen_vec = radec_to_unitvecs_ruv(
+            numpy.array([ra_cen]), numpy.array([dec_cen]),
+        )[0][0]
+        corner_vecs = radec_to_unitvecs_ruv(corner_ra, corner_dec)[0]
+        cosdist = numpy.clip(corner_vecs.dot(cen_vec), -1.0, 1.0)
+        radius = numpy.rad2deg(numpy.arccos(cosdist).max())
+
+        if ra_width > 180.0:
+            radius = 180.0
+
+        inds = self.query_cone(ra_cen, dec_cen, radius)
+
+        ra = self._cat['ra'][inds] % 360.0
+        dec = self._cat['dec'][inds]
+        keep = (
+            ((ra - ra_min) % 360.0 <= ra_width) &
+            (dec >= dec_min) &
+            (dec <= dec_max)
+        )
+        return inds[keep]
+
+    def _get_sky_index(self):
+        """
+        get the unit vectors for the object positions and a kd-tree of
+        them, which is None if scipy is not available
+        """
+        with self._lock:
+            index = self._lookups.get('radec')
+            if index is None:
+                vecs = None
+                if self._index_sidecar:
+                    vecs = self._load_sky_index_sidecar()
+
+                if vecs is None:
+                    vecs = _get_sky_vecs(self._cat['ra'], self._cat['dec'])
+                    if self._index_sidecar:
+                        self._write_sky_index_sidecar(vecs)
+
+                index = vecs, _make_sky_tree(vecs)
+                self._lookups['radec'] = index
+
+            return index
+
+    def _load_sky_index_sidecar(self):
+        """
+        load the unit vectors from the sidecar, or None if it is missing,
+        out of date or can't be read
+        """
+        path = self._get_lookup_sidecar_path('radec')
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with numpy.load(path, allow_pickle=False) as data:
+                signature = data['signature']
+                vecs = data['vecs']
+        except _SIDECAR_ERRORS as err:
+            print('could not read index sidecar %s: %s' % (path, err))
+            return None
+
+        if not numpy.array_equal(signature, self._get_file_signature()):
+            print('index sidecar is out of date:', path)
+            return None
+
+        if vecs.shape != (self.size, 3):
+            print('index sidecar has the wrong shape:', path)
+            return None
+
+        return vecs
+
+    def _write_sky_index_sidecar(self, vecs):
+        path = self._get_lookup_sidecar_path('radec')
+        tmp_path = path + '.tmp.npz'
+        try:
+            numpy.savez(
+                tmp_path, signature=self._get_file_signature(), vecs=vecs,
+            )
+            os.replace(tmp_path, path)
+        except OSError as err:
+            print('could not write index sidecar %s: %s' % (path, err))
+
     def get_cutout_rowcol(self, iobj, icutout):
         """Get cutout_row, cutout_col for the specified object
         and epoch.
@@ -959,79 +2030,315 @@ class MEDS(object):
 
         return row, col
 
-    def _make_composite_image(
-            self, iobj, icutout, im, coadd_seg, restrict_to_seg=False):
+    def _make_composite_stack(
+            self, iobj, icutouts, ims, restrict_to_seg=False, segs=None):
         """
-        Internal routine to composite the coadd seg onto another image,
-        meaning set zero outside the region
+        Internal routine to composite the coadd seg onto a stack of images
+        in place, meaning set zero outside the region
 
         for the coadd this is easy, but for SE cutouts we need to use the
-        jacobian to transform between SE and coadd coordinate systems
+        jacobian to transform between SE and coadd coordinate systems.  All
+        epochs are transformed together, see _interpolate_coadd_seg_stack,
+        which can be sent as segs=(segs, good) to avoid repeating the work
         """
 
-        cim = im.copy()
+        if segs is None:
+            segs, good = self._interpolate_coadd_seg_stack(iobj, icutouts)
+        else:
+            segs, good = segs
 
+        coadd_seg = self.get_cutout(iobj, 0, type='seg')
         coadd_rowcen, coadd_colcen = self.get_cutout_rowcol(iobj, 0)
-        rowcen, colcen = self.get_cutout_rowcol(iobj, icutout)
-
         segid = coadd_seg[int(coadd_rowcen), int(coadd_colcen)]
 
-        if icutout == 0:
-            # this cutout is the coadd
-            logic = (coadd_seg != segid)
-            if not restrict_to_seg:
-                logic = logic & (coadd_seg != 0)
-
-            # w = numpy.where( (coadd_seg != segid) & (coadd_seg != 0) )
-            w = numpy.where(logic)
-            if w[0].size != 0:
-                cim[w] = 0.0
-        else:
-            rows, cols = numpy.mgrid[0:cim.shape[0], 0:cim.shape[1]]
-            rows = rows-rowcen
-            cols = cols-colcen
+        logic = (segs != segid)
+        if not restrict_to_seg:
+            logic &= (segs != 0)
 
-            se_jacob = self.get_jacobian_matrix(iobj, icutout)
-            coadd_jacob = self.get_jacobian_matrix(iobj, 0)
+        if not numpy.all(good):
+            print('coadd jacobian is singular, setting weight to zero')
+            logic[~good] = True
 
-            try:
-                cjinv = coadd_jacob.getI()
-            except numpy.linalg.linalg.LinAlgError:
-                print('coadd jacobian is singular, setting weight to zero')
-                cim[:, :] = 0.0
-                return cim
+        ims[logic] = 0
 
-            # convert pixel coords in SE cutout to u,v
-            u = rows*se_jacob[0, 0] + cols*se_jacob[0, 1]
-            v = rows*se_jacob[1, 0] + cols*se_jacob[1, 1]
+    def _interpolate_coadd_seg_stack(self, iobj, icutouts):
+        """
+        Internal routine to interpolate the coadd seg onto the frames of
+        the requested cutouts
 
-            # now convert into pixels for coadd
-            crow = coadd_rowcen + u*cjinv[0, 0] + v*cjinv[0, 1]
-            ccol = coadd_colcen + u*cjinv[1, 0] + v*cjinv[1, 1]
+        Returns the (ncut, nrow, ncol) stack of segs and a bool array that is
+        False for cutouts that could not be mapped because the coadd jacobian
+        is singular; these are filled with the identity mapping
+        """
+        icutouts = numpy.atleast_1d(icutouts)
 
-            crow = crow.round().astype('i8')
-            ccol = ccol.round().astype('i8')
+        coadd_seg = self.get_cutout(iobj, 0, type='seg')
+        shape = coadd_seg.shape
+        rows, cols = self._get_pixel_grid(shape)
+
+        # the coadd maps onto itself
+        crow = numpy.empty((icutouts.size,) + shape, dtype='i8')
+        ccol = numpy.empty((icutouts.size,) + shape, dtype='i8')
+        crow[:] = rows
+        ccol[:] = cols
+        good = numpy.ones(icutouts.size, dtype=bool)
+
+        wse, = numpy.where(icutouts != 0)
+        if wse.size > 0:
+            cjinv = self.get_jacobian_inverse_array(iobj)[0]
+
+            if not numpy.all(numpy.isfinite(cjinv)):
+                good[wse] = False
+            else:
+                se_icutouts = icutouts[wse]
+                crow[wse], ccol[wse] = self._map_to_coadd_pixels(
+                    iobj,
+                    self.get_jacobian_array(iobj)[se_icutouts],
+                    self['cutout_row'][iobj, se_icutouts],
+                    self['cutout_col'][iobj, se_icutouts],
+                    cjinv,
+                    shape,
+                )
 
-            # clipping makes the notation easier
-            crow = crow.clip(0, coadd_seg.shape[0]-1)
-            ccol = ccol.clip(0, coadd_seg.shape[1]-1)
+        return _as_native(coadd_seg[crow, ccol]), good
 
-            logic = (coadd_seg[crow, ccol] != segid)
-            if not restrict_to_seg:
-                logic = logic & (coadd_seg[crow, ccol] != 0)
+    def _check_coadd_jacobian(self, iobj, icutouts):
+        """
+        Internal routine to raise LinAlgError, as the uberseg code does,
+        if any of the cutouts is not the coadd and the coadd jacobian is
+        singular.  Used for the stored uberseg maps, which are zero for
+        these cutouts
+        """
+        icutouts = numpy.atleast_1d(icutouts)
+        if numpy.any(icutouts != 0):
+            cjinv = self.get_jacobian_inverse_array(iobj)[0]
+            if not numpy.all(numpy.isfinite(cjinv)):
+                raise numpy.linalg.LinAlgError("coadd jacobian is singular")
+
+    def _map_to_coadd_pixels(
+            self, iobj, jacobians, rowcen, colcen, cjinv, shape):
+        """
+        Internal routine to map the pixel grids of a set of cutouts into
+        the coadd frame with a single batched affine transform
+
+        jacobians has shape (n, 2, 2) and rowcen, colcen shape (n,).
+        Returns (n, nrow, ncol) integer arrays of coadd rows and columns,
+        clipped to the coadd cutout
+        """
+        rows, cols = self._get_pixel_grid(shape)
+        coadd_rowcen, coadd_colcen = self.get_cutout_rowcol(iobj, 0)
+
+        rowsrel = rows - numpy.asarray(rowcen)[:, numpy.newaxis, numpy.newaxis]
+        colsrel = cols - numpy.asarray(colcen)[:, numpy.newaxis, numpy.newaxis]
 
-            # wbad = numpy.where( (coadd_seg[crow,ccol] != segid ) &
-            #                     (coadd_seg[crow,ccol] != 0) )
-            wbad = numpy.where(logic)
+        jac = jacobians[:, :, :, numpy.newaxis, numpy.newaxis]
 
-            if wbad[0].size != 0:
-                cim[wbad] = 0
+        # convert pixel coords in SE cutouts to u,v
+        u = rowsrel*jac[:, 0, 0] + colsrel*jac[:, 0, 1]
+        v = rowsrel*jac[:, 1, 0] + colsrel*jac[:, 1, 1]
 
-        return cim
+        # now convert into pixels for coadd
+        crow = coadd_rowcen + u*cjinv[0, 0] + v*cjinv[0, 1]
+        ccol = coadd_colcen + u*cjinv[1, 0] + v*cjinv[1, 1]
+
+        crow = crow.round().astype('i8')
+        ccol = ccol.round().astype('i8')
+
+        # clipping makes the notation easier
+        crow = crow.clip(0, shape[0]-1)
+        ccol = ccol.clip(0, shape[1]-1)
+
+        return crow, ccol
+
+    def _make_uberseg_list(
+            self, iobj, icutouts, weights, fast=True, engine='tree',
+            nthreads=1):
+        """
+        Internal routine to make the uberseg weight maps for a stack of
+        weight maps.  The coadd seg is mapped onto all the epochs once and
+        used both for the composite and the nearest neighbor masking
+        """
+        _check_uberseg_engine(engine)
+
+        segs, good = self._interpolate_coadd_seg_stack(iobj, icutouts)
+        self._make_composite_stack(iobj, icutouts, weights, segs=(segs, good))
+
+        if not numpy.all(good):
+            raise numpy.linalg.LinAlgError("coadd jacobian is singular")
+
+        # the seg map holds the sextractor number, 1 offset
+        object_number = self['number'][iobj]
+
+        if engine == 'tree' and fast and _have_c_ubserseg:
+            return _uberseg_tree_batch(
+                weights, segs, object_number, nthreads=nthreads,
+            )
+
+        return [
+            _uberseg_weight(
+                weight, seg, object_number, fast=fast, engine=engine,
+            )
+            for weight, seg in zip(weights, segs)
+        ]
+
+    def _get_pixel_grid(self, shape):
+        """
+        get the cached, read-only row and column index grids for the
+        given shape
+        """
+        shape = tuple(int(n) for n in shape)
+
+        grid = self._pixel_grids.get(shape)
+        if grid is None:
+            rows, cols = numpy.mgrid[0:shape[0], 0:shape[1]]
+            rows.flags.writeable = False
+            cols.flags.writeable = False
+
+            grid = rows, cols
+            self._pixel_grids[shape] = grid
+
+        return grid
+
+    def _load_hdu_info(self):
+        """
+        find the layout of the cutout and psf extensions once, so reads
+        need no extension lookups
+
+        The info for each extension holds 'raw', True for uncompressed and
+        unscaled images that can be read directly from the file, and for
+        those the on-disk 'dtype', the byte 'offset' of the data and the
+        number of pixels 'npix'.  For tile-compressed images 'compressed'
+        is True and the info holds the 'tile_size' in pixels, 'npix' and
+        the 'itemsize' of the decompressed pixels.
+        """
+        self._hdu_info = {}
+        for hdu in self._main_fits:
+            extname = hdu.get_extname()
+            if not (extname.endswith('_cutouts') or extname == 'psf'):
+                continue
+
+            info = hdu.get_info()
+            hdu_info = {'raw': False, 'compressed': False}
+            self._hdu_info[extname] = hdu_info
+
+            if info['hdutype'] != fitsio.IMAGE_HDU or info['ndims'] == 0:
+                continue
+
+            npix = int(numpy.prod(info['dims']))
+            if npix == 0:
+                continue
+
+            hdr = hdu.read_header()
+
+            if info['is_compressed_image']:
+                # the default tiling for a 1-d image is the whole row
+                hdu_info.update(
+                    compressed=True,
+                    tile_size=int(hdr.get('ZTILE1', npix)),
+                    npix=npix,
+                    itemsize=abs(info['img_type'])//8,
+                )
+                continue
+
+            # scaled data, e.g. unsigned integers, are left to fitsio
+            if hdr.get('BZERO', 0) != 0 or hdr.get('BSCALE', 1) != 1:
+                continue
+
+            hdu_info.update(
+                raw=True,
+                dtype=numpy.dtype(_BITPIX_DTYPES[info['img_type']]),
+                offset=info['data_start'],
+                npix=npix,
+            )
+
+    def _load_mmaps(self):
+        """
+        memory map the uncompressed cutout and psf extensions
+
+        The data offsets are found once at open, so later reads are just
+        slices of the maps
+        """
+        for extname, info in self._hdu_info.items():
+            if not info['raw']:
+                continue
+
+            self._mmaps[extname] = numpy.memmap(
+                self._filename,
+                dtype=info['dtype'],
+                mode='r',
+                offset=info['offset'],
+                shape=(info['npix'], ),
+            )
+
+    def _read_pixels(self, extname, start_row, row_end, copy=False,
+                     fits=None):
+        """
+        read the flat pixel range [start_row, row_end) from the extension,
+        optionally through the given fitsio handle
+        """
+        mm = self._mmaps.get(extname)
+        if mm is not None:
+            data = mm[start_row:row_end].view(numpy.ndarray)
+            if copy:
+                data = _native_copy(data)
+            return data
+
+        if self._raw_file is not None:
+            info = self._hdu_info[extname]
+            if info['raw']:
+                return _pread_pixels(
+                    self._raw_file.fileno(), info, start_row, row_end,
+                )
+
+        if fits is None:
+            if self._use_tile_cache(extname) and row_end > start_row:
+                return self._read_tile_pixels(extname, start_row, row_end)
+            fits = self._fits
+        return fits[extname][start_row:row_end]
+
+    def _use_tile_cache(self, extname):
+        if self._tile_cache is None:
+            return False
+
+        info = self._hdu_info[extname]
+        if not info['compressed']:
+            return False
+
+        tile_bytes = info['tile_size']*info['itemsize']
+        return tile_bytes <= self._tile_cache.max_bytes
+
+    def _read_tile_pixels(self, extname, start_row, row_end):
+        """
+        read the flat pixel range [start_row, row_end) from a compressed
+        extension, decompressing each tile once and keeping it in the tile
+        cache
+        """
+        info = self._hdu_info[extname]
+        tile_size = info['tile_size']
+
+        pieces = []
+        for itile in range(start_row//tile_size, (row_end-1)//tile_size + 1):
+            tile_start = itile*tile_size
+
+            key = (extname, itile)
+            tile = self._tile_cache.get(key)
+            if tile is None:
+                tile_end = min(tile_start + tile_size, info['npix'])
+                tile = self._fits[extname][tile_start:tile_end]
+                self._tile_cache.put(key, tile)
+
+            pieces.append(
+                tile[max(start_row - tile_start, 0):row_end - tile_start]
+            )
+
+        # a new writeable array, as from fitsio
+        if len(pieces) == 1:
+            return pieces[0].copy()
+        return numpy.concatenate(pieces)
 
     def _get_extension_name(self, type):
         ext = "%s_cutouts" % type
-        if ext not in self._fits:
+        if ext not in self._hdu_info:
             raise ValueError("bad cutout type '%s'" % type)
         return ext
 
@@ -1050,6 +2357,19 @@ class MEDS(object):
                                  "object %s should be in bounds "
                                  "[0,%s)" % (icutout, iobj, ncutout))
 
+    def _check_index_arrays(self, iobj, icutout):
+        if numpy.any((iobj < 0) | (iobj >= self._cat.size)):
+            raise ValueError("object indices should be within "
+                             "[0,%s)" % self._cat.size)
+
+        ncutout = self._cat['ncutout'][iobj]
+        wbad, = numpy.where((icutout < 0) | (icutout >= ncutout))
+        if wbad.size > 0:
+            i = wbad[0]
+            raise ValueError("requested cutout index %s for "
+                             "object %s should be in bounds "
+                             "[0,%s)" % (icutout[i], iobj[i], ncutout[i]))
+
     def __repr__(self):
         return repr(self._fits['object_data'])
 
@@ -1067,6 +2387,99 @@ class MEDS(object):
         return self._cat.size
 
 
+class _ThreadFITS(object):
+    """
+    holds the fitsio handle for one thread of a threadsafe reader
+    """
+    def __init__(self, fits):
+        self.fits = fits
+
+
+class _LazyCatalog(object):
+    """
+    Stand-in for the object_data array that reads each column from the
+    file the first time it is accessed
+
+    Parameters
+    ----------
+    hdu : fitsio.TableHDU
+        The object_data extension.
+    columns : list of str, optional
+        Restrict to these columns.
+    """
+    def __init__(self, hdu, columns=None):
+        self._hdu = hdu
+        self._data = {}
+        self._lock = threading.Lock()
+
+        dtype = hdu.get_rec_dtype()[0]
+        if columns is not None:
+            for name in columns:
+                if name not in dtype.names:
+                    raise ValueError("no field of name %s" % name)
+            # keep the order in the file, as fitsio does
+            dtype = numpy.dtype(
+                [(name, dtype.fields[name][0])
+                 for name in dtype.names if name in columns]
+            )
+
+        self.dtype = dtype
+        self.size = hdu.get_nrows()
+
+    def read(self):
+        """
+        get a structured array with all columns
+        """
+        data = numpy.zeros(self.size, dtype=self.dtype)
+        for name in self.dtype.names:
+            data[name] = self[name]
+        return data
+
+    def __getitem__(self, item):
+        if (isinstance(item, list) and len(item) > 0
+                and all(isinstance(i, str) for i in item)):
+            return self.read()[item]
+
+        if not isinstance(item, str):
+            return self._read_rows(item)
+
+        data = self._data.get(item)
+        if data is None:
+            if item not in self.dtype.names:
+                raise ValueError("no field of name %s" % item)
+
+            # the hdu may be shared between threads
+            with self._lock:
+                data = self._data.get(item)
+                if data is None:
+                    data = self._hdu.read_column(item)
+                    self._data[item] = data
+
+        return data
+
+    def _read_rows(self, item):
+        """
+        read only the rows selected by an int, slice or index array
+        """
+        rows = numpy.arange(self.size)[item]
+
+        # fitsio reads the rows in sorted order, once each
+        urows, rev = numpy.unique(rows, return_inverse=True)
+        data = numpy.zeros(urows.size, dtype=self.dtype)
+        if urows.size > 0:
+            with self._lock:
+                rdata = self._hdu.read(
+                    rows=urows, columns=list(self.dtype.names),
+                )
+            for name in self.dtype.names:
+                data[name] = rdata[name]
+
+        return data[rev.reshape(numpy.shape(rows))]
+
+    def __len__(self):
+        return self.size
+
+
 def split_mosaic(mosaic):
     """Split the mosaic into a list of images.
 
@@ -1094,6 +2507,423 @@ def split_mosaic(mosaic):
     return imlist
 
 
+def _make_jacobian_arrays(cat):
+    """Build the jacobian and inverse jacobian arrays for a catalog.
+
+    Parameters
+    ----------
+    cat : np.array
+        The object_data catalog.
+
+    Returns
+    -------
+    jacobians, inverses : tuple of np.arrays
+        Arrays of shape (nobj, ncutout_max, 2, 2).  Entries for cutouts
+        beyond ncutout, and inverses of singular jacobians, are NaN.
+    """
+    nmax = cat['dudrow'].shape[1]
+    unused = numpy.arange(nmax)[None, :] >= cat['ncutout'][:, None]
+
+    return _make_jacobians(
+        cat['dudrow'], cat['dudcol'], cat['dvdrow'], cat['dvdcol'],
+        unused=unused,
+    )
+
+
+def _make_jacobians(dudrow, dudcol, dvdrow, dvdcol, unused=None):
+    """Build jacobian and inverse jacobian arrays from arrays of the
+    entries.
+
+    Parameters
+    ----------
+    dudrow, dudcol, dvdrow, dvdcol : np.arrays
+        The jacobian entries, all with the same shape.
+    unused : np.array, optional
+        Boolean array with the same shape, true for entries to set to NaN.
+
+    Returns
+    -------
+    jacobians, inverses : tuple of np.arrays
+        Arrays with shape that of the entries plus (2, 2).  Inverses of
+        singular jacobians are NaN.
+    """
+    dudrow = numpy.asarray(dudrow)
+
+    jacobians = numpy.zeros(dudrow.shape + (2, 2))
+    jacobians[..., 0, 0] = dudrow
+    jacobians[..., 0, 1] = dudcol
+    jacobians[..., 1, 0] = dvdrow
+    jacobians[..., 1, 1] = dvdcol
+
+    if unused is None:
+        unused = numpy.zeros(dudrow.shape, dtype=bool)
+    else:
+        jacobians[unused] = numpy.nan
+
+    # invert the good ones, substituting the identity for the rest
+    # so a single call can do all of them
+    bad = unused.copy()
+    bad[~unused] = numpy.linalg.det(jacobians[~unused]) == 0
+
+    tmp = jacobians.copy()
+    tmp[bad] = numpy.identity(2)
+    inverses = numpy.linalg.inv(tmp)
+    inverses[bad] = numpy.nan
+
+    return jacobians, inverses
+
+
+def _make_lookup(values):
+    """
+    get the sorted values and the sorting order, for _search_lookup
+    """
+    values = _as_native(numpy.asarray(values))
+    order = numpy.argsort(values, kind='stable')
+    return values[order], order
+
+
+def _search_lookup(sorted_values, order, values):
+    """
+    find the indices of the values in the original array, -1 for values
+    not found and -2 for values that appear more than once
+    """
+    values = numpy.asarray(values)
+    left = numpy.searchsorted(sorted_values, values, side='left')
+    right = numpy.searchsorted(sorted_values, values, side='right')
+    nfound = right - left
+
+    inds = numpy.full(values.shape, -1, dtype='i8')
+    w = nfound == 1
+    inds[w] = order[left[w]]
+    inds[nfound > 1] = -2
+    return inds
+
+
+def _pread_pixels(fd, info, start_row, row_end):
+    """
+    read pixels [start_row, row_end) of a raw image extension straight into
+    a new array, returned in native byte order
+    """
+    dtype = info['dtype']
+    if start_row < 0 or row_end > info['npix'] or row_end < start_row:
+        raise ValueError(
+            "pixel range [%s,%s) out of bounds [0,%s)" % (
+                start_row, row_end, info['npix'],
+            )
+        )
+
+    data = numpy.empty(row_end - start_row, dtype=dtype.newbyteorder('='))
+    _pread_into(
+        fd, data.view('u1'), info['offset'] + start_row*dtype.itemsize,
+    )
+
+    if not dtype.isnative:
+        data.byteswap(inplace=True)
+    return data
+
+
+def _pread_into(fd, buf, offset):
+    """
+    fill the byte array from the file at the offset
+    """
+    nbytes = buf.size
+    nread = 0
+    while nread < nbytes:
+        if hasattr(os, 'preadv'):
+            nr = os.preadv(fd, [buf[nread:]], offset + nread)
+        else:
+            chunk = os.pread(fd, nbytes - nread, offset + nread)
+            nr = len(chunk)
+            buf[nread:nread + nr] = numpy.frombuffer(chunk, dtype='u1')
+
+        if nr == 0:
+            raise IOError("unexpected end of file reading pixels")
+        nread += nr
+
+
+def _get_sky_vecs(ra, dec):
+    """
+    get unit vectors for the positions
+    """
+    vecs = radec_to_unitvecs_ruv(
+        numpy.asarray(ra, dtype='f8'), numpy.asarray(dec, dtype='f8'),
+    )[0]
+    return numpy.ascontiguousarray(vecs)
+
+
+def _make_sky_tree(vecs):
+    """
+    get a kd-tree of the unit vectors, or None if scipy is not available
+    """
+    try:
+        from scipy.spatial import cKDTree
+    except ImportError:
+        print('scipy is not available, sky queries will check all objects')
+        return None
+
+    return cKDTree(vecs)
+
+
+def _uberseg_weight(weight, seg, object_number, fast=True, engine='tree'):
+    """
+    zero out pixels in the weight map that are not nearest to the object
+    with the given number in the seg map
+    """
+
+    # if only have sky and object, then just return
+    if len(numpy.unique(seg)) == 2:
+        return weight
+
+    # First get all indices of all seg map pixels which contain an object
+    # i.e. are not equal to zero
+
+    obj_inds = numpy.where(seg != 0)
+
+    if fast and _have_c_ubserseg:
+        weight = weight.astype(numpy.float32, copy=False)
+
+    if engine == 'edt':
+        _uberseg_edt(weight, seg, object_number, obj_inds, fast=fast)
+    else:
+        _uberseg_search(weight, seg, object_number, obj_inds, fast=fast)
+
+    return weight
+
+
+def _check_uberseg_engine(engine):
+    if engine not in _UBERSEG_ENGINES:
+        raise ValueError(
+            "engine should be one of %s, got '%s'" % (
+                _UBERSEG_ENGINES, engine,
+            )
+        )
+
+
+def _uberseg_tree_batch(weights, segs, object_numbers, nthreads=1):
+    """
+    uberseg for a stack of weight maps using the C code, which processes
+    all the cutouts needing it in one call with a pool of threads
+
+    object_numbers can be a scalar or one per cutout.  Returns a list of
+    weight maps
+    """
+    object_numbers = numpy.broadcast_to(object_numbers, len(segs))
+
+    # if only have sky and object, the weight is returned as is
+    weight_list = list(weights)
+    wdo = [
+        i for i, seg in enumerate(segs)
+        if len(numpy.unique(seg)) != 2
+    ]
+    if len(wdo) == 0:
+        return weight_list
+
+    bweights = numpy.ascontiguousarray(weights[wdo], dtype=numpy.float32)
+    bsegs = numpy.ascontiguousarray(segs[wdo], dtype=numpy.int32)
+    bnumbers = numpy.ascontiguousarray(object_numbers[wdo], dtype=numpy.int32)
+
+    _uberseg.uberseg_tree_batch(bsegs, bweights, bnumbers, nthreads)
+
+    for i, weight in zip(wdo, bweights):
+        weight_list[i] = weight
+
+    return weight_list
+
+
+def _uberseg_search(weight, seg, object_number, obj_inds, fast=True):
+    """
+    search for the nearest seg pixel to each unlabelled pixel, zeroing
+    the weight in place where it is not part of the object
+    """
+    if fast and _have_c_ubserseg:
+        # call fast c code with tree
+        Nx, Ny = seg.shape
+        Ninds = len(obj_inds[0])
+        seg = seg.astype(numpy.int32)
+        obj_inds_x = obj_inds[0].astype(numpy.int32, copy=False)
+        obj_inds_y = obj_inds[1].astype(numpy.int32, copy=False)
+        _uberseg.uberseg_tree(
+            seg, weight, Nx, Ny,
+            object_number, obj_inds_x, obj_inds_y, Ninds)
+    else:
+        # Then loop through pixels in seg map, check which obj ind it is
+        # closest to.  If the closest obj ind does not correspond to the
+        # target, set this pixel in the weight map to zero.
+
+        for i, row in enumerate(seg):
+            for j, element in enumerate(row):
+                segval = _nearest_segval(i, j, seg, obj_inds)
+                if segval != object_number:
+                    weight[i, j] = 0.
+
+
+def _uberseg_edt(weight, seg, object_number, obj_inds, fast=True):
+    """
+    zero the weight in place for unlabelled pixels nearer to another object
+    than to the object, using exact euclidean distance transforms of the
+    whole stamp
+
+    The squared distances are recomputed as integers from the indices of
+    the nearest pixels, so the comparison is exact.  The rare pixels
+    equidistant to the object and another object are sent to the search
+    code, so the result is identical to _uberseg_search
+    """
+    from scipy import ndimage
+
+    if obj_inds[0].size == 0:
+        return
+
+    is_object = (seg == object_number)
+    is_other = (seg != 0) & ~is_object
+
+    # same shortcuts as the search code
+    labelled = is_object | (seg > 0)
+    search = ~labelled
+
+    dist2_object = _nearest_dist2(~is_object, ndimage)
+    dist2_other = _nearest_dist2(~is_other, ndimage)
+
+    weight[labelled & ~is_object] = 0.
+    weight[search & (dist2_other < dist2_object)] = 0.
+
+    tie = search & (dist2_other == dist2_object)
+    if not numpy.any(tie):
+        return
+
+    if fast and _have_c_ubserseg:
+        # only search the tie pixels, by marking the others as part of the
+        # object; the labelled pixels and thus the tree are unchanged
+        tie_seg = seg.copy()
+        tie_seg[search & ~tie] = object_number
+        _uberseg_search(weight, tie_seg, object_number, obj_inds, fast=fast)
+    else:
+        for i, j in zip(*numpy.where(tie)):
+            segval = _nearest_segval(i, j, seg, obj_inds)
+            if segval != object_number:
+                weight[i, j] = 0.
+
+
+def _nearest_dist2(background, ndimage):
+    """
+    get the integer squared distance from each pixel to the nearest pixel
+    where background is False, or the max integer if there are none
+    """
+    if numpy.all(background):
+        return numpy.full(background.shape, numpy.iinfo('i8').max)
+
+    inds = ndimage.distance_transform_edt(
+        background, return_distances=False, return_indices=True,
+    )
+    rows, cols = numpy.indices(background.shape)
+    return (rows - inds[0])**2 + (cols - inds[1])**2
+
+
+def _nearest_segval(i, j, seg, obj_inds):
+    """
+    get the seg value of the first nearest labelled pixel to the pixel i, j
+    """
+    obj_dists = (i-obj_inds[0])**2 + (j-obj_inds[1])**2
+    ind_min = numpy.argmin(obj_dists)
+
+    return seg[obj_inds[0][ind_min], obj_inds[1][ind_min]]
+
+
+def _get_slab_ranges(starts, npix, slab_pixels):
+    """
+    group objects, in order, into slabs spanning at most slab_pixels
+
+    Returns a list of (slab_start, slab_end, indices), where indices are
+    the positions in the starts and npix arrays of the objects in the slab
+    """
+    slabs = []
+
+    nobj = starts.size
+    i = 0
+    while i < nobj:
+        slab_start = starts[i]
+        slab_end = starts[i] + npix[i]
+
+        j = i + 1
+        while j < nobj:
+            new_start = min(slab_start, starts[j])
+            new_end = max(slab_end, starts[j] + npix[j])
+            if new_end - new_start > slab_pixels:
+                break
+
+            slab_start, slab_end = new_start, new_end
+            j += 1
+
+        slabs.append((slab_start, slab_end, numpy.arange(i, j)))
+        i = j
+
+    return slabs
+
+
+def _mosaic_to_stack(mosaic):
+    """
+    view a mosaic of square cutouts as a (ncutout, box_size, box_size) stack
+    """
+    box_size = mosaic.shape[1]
+    return mosaic.reshape(-1, box_size, box_size)
+
+
+def _stack_to_mosaic(stack):
+    """
+    view a (ncutout, box_size, box_size) stack as a mosaic
+    """
+    return stack.reshape(-1, stack.shape[2])
+
+
+def _as_native(data):
+    """
+    return the data in native byte order, copying only if needed
+    """
+    if data.dtype.isnative:
+        return data
+    return _native_copy(data)
+
+
+def _native_copy(data):
+    """
+    get a writeable copy of the array in native byte order
+    """
+    return data.astype(data.dtype.newbyteorder('='))
+
+
+def _get_merged_ranges(start_rows, npix):
+    """Sort pixel ranges by start and merge those that touch or overlap.
+
+    Parameters
+    ----------
+    start_rows : np.array
+        Start of each range.
+    npix : np.array
+        Number of pixels in each range.
+
+    Returns
+    -------
+    ranges : list of tuples
+        Each entry is (start, end, indices) where indices are the positions
+        in the input arrays of the ranges covered by [start, end).
+    """
+    order = numpy.argsort(start_rows, kind='stable')
+    starts = start_rows[order]
+    ends = starts + npix[order]
+
+    # a new group begins wherever a range starts past everything before it
+    max_end = numpy.maximum.accumulate(ends)
+    new_group = numpy.ones(starts.size, dtype=bool)
+    new_group[1:] = starts[1:] > max_end[:-1]
+    group_starts, = numpy.where(new_group)
+    group_ends = numpy.append(group_starts[1:], starts.size)
+
+    ranges = []
+    for gs, ge in zip(group_starts, group_ends):
+        ranges.append((starts[gs], max_end[ge-1], order[gs:ge]))
+
+    return ranges
+
+
 def reject_outliers(imlist, wtlist, nsigma=5.0, A=0.3):
     """Set the weight for outlier pixels to zero.
 
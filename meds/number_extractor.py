@@ -9,6 +9,7 @@ import os
 import fitsio
 import numpy
 from .extractor import get_psf_row_range
+from .meds import MEDS, _make_lookup, _search_lookup
 
 
 def extract_numbers(meds_file, numbers, sub_file):
@@ -23,6 +24,53 @@ def extract_numbers(meds_file, numbers, sub_file):
     MEDSNumberExtractor(meds_file, numbers, sub_file)
 
 
+def extract_cone(meds_file, ra, dec, radius, sub_file):
+    """
+    Extract the objects within a radius of a position and write a new meds
+    file.  The position and radius are in degrees, see MEDS.query_cone.
+    """
+
+    with MEDS(meds_file, lazy=True) as m:
+        inds = m.query_cone(ra, dec, radius)
+        numbers = _get_selected_numbers(
+            m, inds,
+            "within %g degrees of ra %g dec %g" % (radius, ra, dec),
+        )
+
+    MEDSNumberExtractor(meds_file, numbers, sub_file)
+
+
+def extract_box(meds_file, ra_min, ra_max, dec_min, dec_max, sub_file):
+    """
+    Extract the objects within a range of ra and dec and write a new meds
+    file.  The ranges are in degrees, see MEDS.query_box.
+    """
+
+    with MEDS(meds_file, lazy=True) as m:
+        inds = m.query_box(ra_min, ra_max, dec_min, dec_max)
+        numbers = _get_selected_numbers(
+            m, inds,
+            "in ra [%g, %g] dec [%g, %g]" % (ra_min, ra_max, dec_min, dec_max),
+        )
+
+    MEDSNumberExtractor(meds_file, numbers, sub_file)
+
+
+def _get_selected_numbers(m, inds, description):
+    """
+    get the numbers of the selected objects, which the extractor needs
+    """
+    if "number" not in m._cat.dtype.names:
+        raise ValueError(
+            "the file has no number column, needed to extract objects"
+        )
+
+    if inds.size == 0:
+        raise ValueError("no objects found %s" % description)
+
+    return m["number"][inds]
+
+
 class MEDSNumberExtractor(object):
     """
     Class to extract a subset of objects and write a new meds file.
@@ -63,25 +111,17 @@ class MEDSNumberExtractor(object):
                 print("removing sub file:", self.sub_file)
                 os.remove(self.sub_file)
 
-    def _get_inds(self, data):
-        inds = []
-        for number in self.numbers:
-            if (
-                number <= len(data["number"])
-                and number >= 1
-                and number == data["number"][number - 1]
-            ):
-                q = [number - 1]
-            else:
-                (q,) = numpy.where(number == data["number"])
-            assert (
-                len(q) == 1
-            ), "Could not find or found duplicate number: number = %ld, found %ld" % (  # noqa
-                number,
-                len(q),
-            )
-            inds.append(q[0])
-        inds = numpy.array(inds, dtype=int)
+    def _get_inds(self, numbers):
+        sorted_numbers, order = _make_lookup(numbers)
+        inds = _search_lookup(sorted_numbers, order, self.numbers)
+
+        # -1 for numbers not found, -2 for duplicates
+        (w,) = numpy.where(inds < 0)
+        assert (
+            w.size == 0
+        ), "Could not find or found duplicate number: number = %ld" % (
+            self.numbers[w[0]]
+        )
         return inds
 
     def _get_row_ranges(self, data):
@@ -149,7 +189,9 @@ class MEDSNumberExtractor(object):
                 #
                 # subset of object data table
                 #
-                inds = self._get_inds(infits["object_data"][:])
+                inds = self._get_inds(
+                    infits["object_data"].read(columns=["number"])["number"]
+                )
                 obj_data = infits["object_data"][inds]
 
                 ranges = self._get_row_ranges(obj_data)
@@ -0,0 +1,221 @@
+"""
+parallel_map
+    Map a function over the objects in a MEDS file using a pool of
+    processes, each with its own MEDS reader
+"""
+from __future__ import print_function
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .meds import MEDS
+from .partition import read_cost_catalog, get_costs, split_contiguous
+
+# the reader for each worker process, opened by the first chunk it runs
+# rather than by a pool initializer, which needs python 3.7
+_worker_meds = None
+_worker_key = None
+
+
+def parallel_map(
+    func,
+    meds_file,
+    obj_range=None,
+    n_workers=None,
+    chunking='pixels',
+    chunks_per_worker=4,
+    meds_kw=None,
+):
+    """
+    Map a function over objects in a MEDS file in a pool of processes
+
+    Each worker opens its own MEDS reader once, and is sent only the ranges
+    of objects to process, so the cost of serialization is just that of the
+    results.  The objects are split into contiguous chunks with about the
+    same cost, and the results are returned in object order as the chunks
+    complete.
+
+    Parameters
+    ----------
+    func : callable
+        Called as func(m, iobj) for each object, where m is the worker's
+        MEDS reader.  It must be picklable, e.g. a module level function.
+    meds_file : str
+        Path to the MEDS file.
+    obj_range : tuple, optional
+        Process objects in [start, end).  Default is all objects.
+    n_workers : int, optional
+        Number of worker processes.  Default is the number of cpus.  With
+        one worker the objects are processed in this process.
+    chunking : str or callable, optional
+        The cost used to balance the chunks, 'pixels', 'cutouts',
+        'objects' or a function, see plan_chunks.  Default 'pixels'.
+    chunks_per_worker : int, optional
+        Number of chunks per worker, more give better balance when objects
+        take different times at the cost of more overhead.  Default 4.
+    meds_kw : dict, optional
+        Extra keywords for the MEDS readers.
+
+    Returns
+    -------
+    results : iterator
+        The results of func for each object, in order.
+
+    Examples
+    --------
+    >>> def get_flux(m, iobj):
+    ...     return m.get_cutout(iobj, 0).sum()
+    >>> fluxes = list(meds.parallel_map(get_flux, 'file.fits', n_workers=8))
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    if n_workers < 1:
+        raise ValueError("n_workers must be >= 1, got %s" % n_workers)
+    if chunks_per_worker < 1:
+        raise ValueError(
+            "chunks_per_worker must be >= 1, got %s" % chunks_per_worker
+        )
+    if meds_kw is None:
+        meds_kw = {}
+
+    cat = read_cost_catalog(meds_file)
+
+    if obj_range is None:
+        start, end = 0, cat.size
+    else:
+        start, end = obj_range
+        if start < 0 or end > cat.size or start > end:
+            raise ValueError(
+                "bad object range [%s,%s) for %s objects" % (
+                    start, end, cat.size,
+                )
+            )
+
+    costs = get_costs(cat[start:end], chunking)
+    ranges = [
+        (start + s, start + e)
+        for s, e in split_contiguous(costs, n_workers*chunks_per_worker)
+    ]
+
+    if n_workers == 1:
+        return _serial_map(func, meds_file, ranges, meds_kw)
+    else:
+        return _parallel_map(func, meds_file, ranges, meds_kw, n_workers)
+
+
+def _serial_map(func, meds_file, ranges, meds_kw):
+    with MEDS(meds_file, **meds_kw) as m:
+        for start, end in ranges:
+            for iobj in range(start, end):
+                yield func(m, iobj)
+
+
+def _parallel_map(func, meds_file, ranges, meds_kw, n_workers):
+    """
+    run the chunks in a process pool, keeping a limited number in flight
+    so the results do not pile up in memory
+    """
+    max_inflight = 2*n_workers
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+
+        def _submit(start, end):
+            return executor.submit(
+                _run_chunk, func, meds_file, meds_kw, start, end,
+            )
+
+        ranges = iter(ranges)
+        futures = deque()
+        for start, end in ranges:
+            futures.append(_submit(start, end))
+            if len(futures) >= max_inflight:
+                break
+
+        while futures:
+            results = futures.popleft().result()
+
+            for start, end in ranges:
+                futures.append(_submit(start, end))
+                break
+
+            for result in results:
+                yield result
+
+
+def _get_worker_meds(meds_file, meds_kw):
+    global _worker_meds, _worker_key
+
+    key = (meds_file, meds_kw)
+    if _worker_meds is None or _worker_key != key:
+        if _worker_meds is not None:
+            _worker_meds.close()
+        _worker_meds = MEDS(meds_file, **meds_kw)
+        _worker_key = key
+
+    return _worker_meds
+
+
+def _run_chunk(func, meds_file, meds_kw, start, end):
+    m = _get_worker_meds(meds_file, meds_kw)
+    return [func(m, iobj) for iobj in range(start, end)]
+
+
+def _joblib_imap(
+    func, arglist, n_jobs=-1, backend='loky', inner_max_num_threads=None,
+):
+    """
+    Yield func(*args) for each args in arglist, in order, computed with
+    joblib
+
+    The calls are dispatched a few per worker at a time, so only those
+    results are held in memory.  Backends that can return a generator,
+    such as loky and threading, keep the workers busy while the caller
+    handles each result; for others, such as multiprocessing, the calls
+    are run in batches of two per worker through one pool.
+
+    Parameters
+    ----------
+    func : callable
+        The function, which must be picklable for process backends.
+    arglist : sequence of tuples
+        The arguments for each call.
+    n_jobs : int, optional
+        The number of joblib jobs.  Default -1, all cpus.
+    backend : str, optional
+        The joblib backend.  Default 'loky'.
+    inner_max_num_threads : int, optional
+        The limit on threads, e.g. for BLAS, in each worker, for backends
+        that support it.
+    """
+    import joblib
+
+    arglist = list(arglist)
+
+    with joblib.parallel_backend(
+        backend, inner_max_num_threads=inner_max_num_threads,
+    ):
+        try:
+            parallel = joblib.Parallel(
+                n_jobs=n_jobs, max_nbytes=None, return_as='generator',
+                pre_dispatch='2*n_jobs',
+            )
+        except (TypeError, ValueError):
+            # older joblib, or a backend that can't return a generator
+            parallel = None
+
+        if parallel is not None:
+            for result in parallel(
+                joblib.delayed(func)(*args) for args in arglist
+            ):
+                yield result
+            return
+
+        batch_size = 2 * joblib.effective_n_jobs(n_jobs)
+        with joblib.Parallel(n_jobs=n_jobs, max_nbytes=None) as parallel:
+            for start in range(0, len(arglist), batch_size):
+                batch = arglist[start:start + batch_size]
+                outputs = parallel(
+                    joblib.delayed(func)(*args) for args in batch
+                )
+                for result in outputs:
+                    yield result
@@ -0,0 +1,290 @@
+"""
+plan_chunks
+    Split the objects in a MEDS file into chunks with about equal cost,
+    e.g. to split processing of a file into jobs
+
+write_plan, read_plan
+    Write and read a plan as a FITS table
+"""
+from __future__ import print_function
+import heapq
+
+import numpy
+import fitsio
+
+SUPPORTED_COSTS = ['pixels', 'cutouts', 'objects']
+
+# the object_data columns used for the costs
+COST_COLUMNS = ['id', 'number', 'ncutout', 'box_size',
+                'psf_row_size', 'psf_col_size', 'psf_box_size']
+
+
+def plan_chunks(meds_file, n_chunks, cost='pixels', contiguous=True):
+    """
+    Split the objects in a MEDS file into chunks with about equal cost
+
+    Only the object_data table is read.
+
+    Parameters
+    ----------
+    meds_file : str or array
+        Path to the MEDS file, or the object_data table.
+    n_chunks : int
+        The number of chunks.
+    cost : str or callable, optional
+        The cost of processing each object.
+
+            'pixels': the number of pixels in the cutouts and psfs,
+                ncutout*box_size**2 plus the psf_row_size*psf_col_size, or
+                psf_box_size**2, of each cutout if the file has psfs
+            'cutouts': the number of cutouts
+            'objects': one for each object
+
+        or a function that takes the object_data table and returns an
+        array with the cost for each object.  Default 'pixels'.
+    contiguous : bool, optional
+        If True, each chunk is a contiguous range of objects, which can be
+        extracted with extract_range.  If False, objects are assigned
+        greedily from the most expensive to the chunk with the least
+        cost so far, which gives better balance when a few objects are
+        very expensive.  Default True.
+
+    Returns
+    -------
+    chunks : list of arrays
+        n_chunks sorted arrays of object indices, some of which may be
+        empty if there are few objects.
+
+    Examples
+    --------
+    >>> chunks = meds.plan_chunks('file.fits', 100)
+    >>> start, end = meds.partition.get_extract_ranges(chunks)[3]
+    >>> meds.extract_range('file.fits', start, end, 'chunk3.fits')
+    """
+    if n_chunks < 1:
+        raise ValueError("n_chunks must be >= 1, got %s" % n_chunks)
+
+    if isinstance(meds_file, numpy.ndarray):
+        cat = meds_file
+    else:
+        cat = read_cost_catalog(meds_file)
+
+    costs = get_costs(cat, cost)
+
+    if contiguous:
+        chunks = [
+            numpy.arange(start, end)
+            for start, end in split_contiguous(costs, n_chunks)
+        ]
+    else:
+        chunks = _split_greedy(costs, n_chunks)
+
+    while len(chunks) < n_chunks:
+        chunks.append(numpy.zeros(0, dtype='i8'))
+
+    return chunks
+
+
+def get_extract_ranges(chunks):
+    """
+    get the (start, end) of each contiguous chunk for extract_range, for
+    which the end is inclusive, or None for empty chunks
+    """
+    ranges = []
+    for chunk in chunks:
+        if chunk.size == 0:
+            ranges.append(None)
+        else:
+            if chunk[-1] - chunk[0] + 1 != chunk.size:
+                raise ValueError("chunk is not a contiguous range")
+            ranges.append((int(chunk[0]), int(chunk[-1])))
+
+    return ranges
+
+
+def read_cost_catalog(meds_file):
+    """
+    read the object_data columns used for the costs that are in the file
+    """
+    with fitsio.FITS(meds_file) as fits:
+        hdu = fits['object_data']
+        columns = [c for c in COST_COLUMNS if c in hdu.get_colnames()]
+        return hdu.read(columns=columns)
+
+
+def get_costs(cat, cost='pixels'):
+    """
+    get the cost of processing each object, see plan_chunks for the
+    cost types
+    """
+    if callable(cost):
+        costs = numpy.array(cost(cat), dtype='f8', ndmin=1)
+        if costs.shape != (cat.size, ):
+            raise ValueError(
+                "cost function should return %d costs, got shape %s" % (
+                    cat.size, costs.shape,
+                )
+            )
+        return costs
+
+    if cost == 'pixels':
+        ncutout = cat['ncutout'].astype('f8')
+        costs = ncutout*cat['box_size'].astype('f8')**2
+
+        psf_sizes = _get_psf_sizes(cat)
+        if psf_sizes is not None:
+            if psf_sizes.ndim == 1:
+                # the same psf size for all cutouts
+                costs += ncutout*psf_sizes
+            else:
+                # only the first ncutout entries are used
+                icut = numpy.arange(psf_sizes.shape[1])
+                used = icut[numpy.newaxis, :] < ncutout[:, numpy.newaxis]
+                costs += (psf_sizes*used).sum(axis=1)
+
+        return costs
+    elif cost == 'cutouts':
+        return cat['ncutout'].astype('f8')
+    elif cost == 'objects':
+        return numpy.ones(cat.size)
+    else:
+        raise ValueError(
+            "cost should be in %s or a function, got '%s'" % (
+                SUPPORTED_COSTS, cost,
+            )
+        )
+
+
+def _get_psf_sizes(cat):
+    """
+    get the number of pixels in the psfs, or None if there are no psfs
+    """
+    names = cat.dtype.names
+    if 'psf_row_size' in names and 'psf_col_size' in names:
+        return (
+            cat['psf_row_size'].astype('f8')*cat['psf_col_size'].astype('f8')
+        )
+    elif 'psf_box_size' in names:
+        return cat['psf_box_size'].astype('f8')**2
+    else:
+        return None
+
+
+def split_contiguous(costs, n_chunks):
+    """
+    split into at most n_chunks contiguous [start, end) ranges with about
+    equal total cost
+    """
+    nobj = costs.size
+    if nobj == 0:
+        return []
+
+    n_chunks = min(n_chunks, nobj)
+
+    # each chunk ends at the object boundary where the cumulative cost is
+    # closest to the next multiple of the target
+    cumcost = numpy.concatenate([[0.0], costs.cumsum()])
+    targets = cumcost[-1]*numpy.arange(1, n_chunks)/n_chunks
+    ends = numpy.searchsorted(cumcost, targets, side='left')
+    ends = ends.clip(min=1)
+    before = numpy.abs(cumcost[ends-1] - targets)
+    after = numpy.abs(cumcost[ends] - targets)
+    ends[before < after] -= 1
+
+    ends = numpy.unique(numpy.concatenate([ends, [nobj]]))
+    ends = ends[ends > 0]
+
+    starts = numpy.concatenate([[0], ends[:-1]])
+    return [(int(s), int(e)) for s, e in zip(starts, ends) if e > s]
+
+
+def _split_greedy(costs, n_chunks):
+    """
+    assign objects from the most to least expensive to the chunk with
+    the lowest total cost
+    """
+    # ties go to the lowest chunk index, so the plan is reproducible
+    heap = [(0.0, ichunk) for ichunk in range(n_chunks)]
+    assigned = numpy.zeros(costs.size, dtype='i8')
+
+    for iobj in numpy.argsort(-costs, kind='stable'):
+        total, ichunk = heapq.heappop(heap)
+        assigned[iobj] = ichunk
+        heapq.heappush(heap, (total + costs[iobj], ichunk))
+
+    return [
+        numpy.flatnonzero(assigned == ichunk) for ichunk in range(n_chunks)
+    ]
+
+
+def write_plan(filename, chunks, meds_file=None, cost='pixels', clobber=True):
+    """
+    Write a plan from plan_chunks as a FITS table with a row for each
+    object, holding the chunk, the object index and, if the meds_file is
+    sent, the object number and id.
+
+    Parameters
+    ----------
+    filename : str
+        The output file.
+    chunks : list of arrays
+        The chunks from plan_chunks.
+    meds_file : str or array, optional
+        The MEDS file or object_data table used to make the plan.  If sent
+        the number, id and cost of each object are also written.
+    cost : str or callable, optional
+        The cost type, used with the meds_file.  Default 'pixels'.
+    clobber : bool, optional
+        If True, overwrite an existing file.  Default True.
+    """
+    nobj = sum(chunk.size for chunk in chunks)
+
+    dtype = [('chunk', 'i4'), ('index', 'i8')]
+
+    cat = None
+    if meds_file is not None:
+        if isinstance(meds_file, numpy.ndarray):
+            cat = meds_file
+        else:
+            cat = read_cost_catalog(meds_file)
+
+        for name in ['number', 'id']:
+            if name in cat.dtype.names:
+                dtype.append((name, cat[name].dtype.str))
+        dtype.append(('cost', 'f8'))
+
+    plan = numpy.zeros(nobj, dtype=dtype)
+
+    start = 0
+    for ichunk, chunk in enumerate(chunks):
+        end = start + chunk.size
+        plan['chunk'][start:end] = ichunk
+        plan['index'][start:end] = chunk
+        start = end
+
+    header = {'nchunks': len(chunks)}
+    if cat is not None:
+        for name in ['number', 'id']:
+            if name in cat.dtype.names:
+                plan[name] = cat[name][plan['index']]
+        plan['cost'] = get_costs(cat, cost)[plan['index']]
+
+        if not callable(cost):
+            header['cost'] = cost
+
+    fitsio.write(
+        filename, plan, extname='plan', header=header, clobber=clobber,
+    )
+
+
+def read_plan(filename):
+    """
+    Read a plan written by write_plan, returning the list of arrays of
+    object indices for each chunk
+    """
+    plan, header = fitsio.read(filename, ext='plan', header=True)
+
+    return [
+        plan['index'][plan['chunk'] == ichunk]
+        for ichunk in range(header['nchunks'])
+    ]
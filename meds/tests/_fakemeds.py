@@ -35,7 +35,16 @@ def make_fake_meds(
     with_psf=False,
     psf_fwhm=0.9,
     cutout_types=None,
+    nneighbor=0,
+    jacobian_noise=0.0,
 ):
+    """
+    nneighbor: int, optional
+        If > 0, draw seg maps with a disk for the central object plus this
+        many disks for neighbors, rather than a uniform seg map
+    jacobian_noise: float, optional
+        Relative scatter added to the jacobian of each cutout
+    """
 
     if cutout_types is None:
         cutout_types = copy.deepcopy(CUTOUT_TYPES)
@@ -49,6 +58,7 @@ def make_fake_meds(
             rng=rng, nobj=nobj, box_size=box_size,
             ncutout_max=ncutout_max,
             with_psf=with_psf,
+            jacobian_noise=jacobian_noise,
         )
         fits.write(object_data, extname='object_data')
 
@@ -74,6 +84,7 @@ def make_fake_meds(
             flux=flux,
             noise=noise,
             psf_fwhm=psf_fwhm,
+            nneighbor=nneighbor,
         )
 
 
@@ -83,6 +94,7 @@ def write_cutouts(
     flux,
     noise,
     psf_fwhm,
+    nneighbor=0,
 ):
     for cutout_type in cutout_types:
 
@@ -118,8 +130,19 @@ def write_cutouts(
 
                     imdata += rng.normal(scale=1.0e-6, size=imdata.shape)
                 elif cutout_type == 'seg':
-                    imdata = np.zeros((box_size, box_size), dtype=dtype)
-                    imdata[:, :] = object_data['number'][iobj]
+                    if nneighbor > 0:
+                        imdata = make_crowded_seg(
+                            rng=rng,
+                            number=object_data['number'][iobj],
+                            row=object_data['cutout_row'][iobj, icut],
+                            col=object_data['cutout_col'][iobj, icut],
+                            box_size=box_size,
+                            nneighbor=nneighbor,
+                            dtype=dtype,
+                        )
+                    else:
+                        imdata = np.zeros((box_size, box_size), dtype=dtype)
+                        imdata[:, :] = object_data['number'][iobj]
                 else:
                     imdata = np.zeros((box_size, box_size), dtype=dtype)
                     if cutout_type == 'weight':
@@ -128,6 +151,27 @@ def write_cutouts(
                 hdu.write(imdata, start=object_data['start_row'][iobj, icut])
 
 
+def make_crowded_seg(rng, number, row, col, box_size, nneighbor, dtype):
+    """
+    a seg map with a disk for the central object and for each of
+    the neighbors
+    """
+    rows, cols = np.mgrid[0:box_size, 0:box_size]
+
+    seg = np.zeros((box_size, box_size), dtype=dtype)
+    for i in range(nneighbor):
+        nrow, ncol = rng.uniform(low=0, high=box_size, size=2)
+        rad = rng.uniform(low=1, high=box_size/6)
+        w = np.where((rows - nrow)**2 + (cols - ncol)**2 < rad**2)
+        seg[w] = 1000 + i
+
+    rad = box_size/5
+    w = np.where((rows - row)**2 + (cols - col)**2 < rad**2)
+    seg[w] = number
+
+    return seg
+
+
 def make_model_image(row, col, dims, fwhm, flux):
 
     T = fwhm_to_T(fwhm)
@@ -177,6 +221,7 @@ def make_object_data(
     box_size,
     ncutout_max,
     with_psf=False,
+    jacobian_noise=0.0,
 ):
     import meds
 
@@ -228,6 +273,12 @@ def make_object_data(
     data['dvdrow'] = DVDROW
     data['dvdcol'] = DVDCOL
 
+    if jacobian_noise > 0:
+        for name in ['dudrow', 'dudcol', 'dvdrow', 'dvdcol']:
+            data[name] += jacobian_noise * PIXEL_SCALE * rng.normal(
+                size=(nobj, ncutout_max),
+            )
+
     if with_psf:
         data['psf_box_size'] = box_size
         data['psf_cutout_row'] = cen
@@ -266,6 +317,66 @@ def make_metadata():
     return metadata
 
 
+def make_fake_maker_inputs(tdir, rng, nimage=4, nobj=30):
+    """
+    write small fake images with TAN wcs for each of the image, weight,
+    seg, bmask and bkg types, returning the obj_data and image_info
+    for the MEDSMaker.  The first image is a coadd covering all objects,
+    some objects fall off the edges of the other images
+    """
+    import json
+
+    info = meds.util.get_image_info_struct(nimage, 200, wcs_len=2000)
+    for file_id in range(nimage):
+        if file_id == 0:
+            nrow, ncol = 320, 300
+            crval = [10.0, 5.0]
+        else:
+            nrow, ncol = rng.randint(120, 200, size=2)
+            crval = [10.0, 5.0] + rng.uniform(-0.003, 0.003, size=2)
+
+        wcs = {
+            'ctype1': 'RA---TAN',
+            'ctype2': 'DEC--TAN',
+            'crval1': crval[0],
+            'crval2': crval[1],
+            'crpix1': ncol/2.0,
+            'crpix2': nrow/2.0,
+            'cd1_1': -PIXEL_SCALE/3600,
+            'cd1_2': 0.0,
+            'cd2_1': 0.0,
+            'cd2_2': PIXEL_SCALE/3600,
+            'naxis1': int(ncol),
+            'naxis2': int(nrow),
+        }
+        shape = (nrow, ncol)
+        images = {
+            'image': rng.normal(loc=10, size=shape).astype('f4'),
+            'weight': rng.uniform(0.5, 1.5, size=shape).astype('f4'),
+            'seg': rng.randint(0, nobj, size=shape).astype('i4'),
+            'bmask': rng.choice([0, 1, 2, 4], size=shape).astype('i4'),
+            'bkg': np.full(shape, 10.0, dtype='f4'),
+        }
+        for type, im in images.items():
+            path = '%s/%s-%d.fits' % (tdir, type, file_id)
+            fitsio.write(path, im, clobber=True)
+            info['%s_path' % type][file_id] = path
+            info['%s_ext' % type][file_id] = 0
+
+        info['image_id'][file_id] = file_id
+        info['scale'][file_id] = 1.0 + 0.1*file_id
+        info['position_offset'][file_id] = 1.0
+        info['wcs'][file_id] = json.dumps(wcs)
+
+    obj_data = meds.util.get_meds_input_struct(nobj)
+    obj_data['id'] = np.arange(nobj)
+    obj_data['box_size'] = rng.choice([16, 24, 32], size=nobj)
+    obj_data['ra'] = 10.0 + rng.uniform(-0.005, 0.005, size=nobj)
+    obj_data['dec'] = 5.0 + rng.uniform(-0.005, 0.005, size=nobj)
+
+    return obj_data, info
+
+
 def fwhm_to_T(fwhm):
     """
     convert fwhm to T for a gaussian
@@ -0,0 +1,68 @@
+"""
+Microbenchmark of the time to read single cutouts, comparing fitsio reads
+with positional reads of the raw file
+
+    python -m meds.tests.bench_read [--nobj 2000] [--box-size 32]
+"""
+from __future__ import print_function
+import os
+import time
+import tempfile
+from optparse import OptionParser
+
+import numpy as np
+import meds
+from ._fakemeds import make_fake_meds
+
+
+def time_cutouts(fname, nrepeat=3, **kw):
+    """
+    get the mean time in microseconds to read one cutout, best of nrepeat
+    passes over all cutouts
+    """
+    with meds.MEDS(fname, **kw) as m:
+        inds = [
+            (iobj, icut)
+            for iobj in range(m.size)
+            for icut in range(m['ncutout'][iobj])
+        ]
+
+        best = None
+        for _ in range(nrepeat):
+            tm0 = time.perf_counter()
+            for iobj, icut in inds:
+                m.get_cutout(iobj, icut)
+            tm = (time.perf_counter() - tm0)/len(inds)
+            if best is None or tm < best:
+                best = tm
+
+    return best*1.0e6
+
+
+def main():
+    parser = OptionParser(__doc__)
+    parser.add_option("--nobj", type="int", default=2000)
+    parser.add_option("--box-size", type="int", default=32)
+    parser.add_option("--nrepeat", type="int", default=3)
+    options, args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'bench-meds.fits')
+        make_fake_meds(
+            fname, np.random.RandomState(5),
+            nobj=options.nobj, box_size=options.box_size,
+        )
+
+        print()
+        print('box_size: %d' % options.box_size)
+        for name, kw in [
+            ('fitsio', {'pread': False}),
+            ('pread', {'pread': True}),
+            ('mmap', {'mmap': True}),
+        ]:
+            tm = time_cutouts(fname, nrepeat=options.nrepeat, **kw)
+            print('%-8s %8.2f us per cutout' % (name, tm))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,7 @@ import pytest
 import tempfile
 import numpy as np
 import meds
-from ._fakemeds import make_fake_meds
+from ._fakemeds import make_fake_meds, make_fake_maker_inputs
 
 
 @pytest.mark.parametrize('with_psf', [False, True])
@@ -188,3 +188,1569 @@ def test_outlier_rejection():
 
         meds.meds.reject_outliers(imlist, wtlist)
         assert wtlist[0][rowbad, colbad] == 0.0
+
+
+def test_mmap():
+    rng = np.random.RandomState(9123)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(fname=fname, rng=rng)
+
+        m = meds.MEDS(fname)
+        mm = meds.MEDS(fname, mmap=True)
+
+        for iobj in range(m.size):
+            for ctype in ['image', 'weight', 'seg', 'bmask']:
+                mos = m.get_mosaic(iobj, type=ctype)
+                mmos = mm.get_mosaic(iobj, type=ctype)
+                assert not mmos.flags.writeable
+                np.testing.assert_array_equal(mos, mmos)
+
+                for icut in range(m['ncutout'][iobj]):
+                    cut = mm.get_cutout(iobj, icut, type=ctype, copy=True)
+                    assert cut.flags.writeable
+                    assert cut.dtype.isnative
+                    np.testing.assert_array_equal(
+                        cut, m.get_cutout(iobj, icut, type=ctype),
+                    )
+
+            for psf, mpsf in zip(m.get_psf_list(iobj), mm.get_psf_list(iobj)):
+                np.testing.assert_array_equal(psf, mpsf)
+
+            np.testing.assert_array_equal(
+                m.get_cweight_mosaic(iobj), mm.get_cweight_mosaic(iobj),
+            )
+            np.testing.assert_array_equal(
+                m.get_cseg_mosaic(iobj), mm.get_cseg_mosaic(iobj),
+            )
+            for icut in range(m['ncutout'][iobj]):
+                np.testing.assert_array_equal(
+                    m.get_uberseg(iobj, icut), mm.get_uberseg(iobj, icut),
+                )
+
+        mm.close()
+
+
+@pytest.mark.parametrize('mmap', [False, True])
+def test_get_cutouts(mmap):
+    rng = np.random.RandomState(3331)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(fname=fname, rng=rng)
+
+        m = meds.MEDS(fname, mmap=mmap)
+
+        iobj = rng.randint(0, m.size, size=30)
+        icut = (rng.uniform(size=30) * m['ncutout'][iobj]).astype('i4')
+
+        for ctype in ['image', 'seg', 'psf']:
+            cutouts, shapes = m.get_cutouts(
+                iobj, icut, type=ctype, return_shapes=True,
+            )
+            assert cutouts.shape[0] == iobj.size
+            for i in range(iobj.size):
+                cut = m.get_cutout(iobj[i], icut[i], type=ctype)
+                assert tuple(shapes[i]) == cut.shape
+                np.testing.assert_array_equal(cutouts[i], cut)
+
+        # all coadd cutouts
+        iobj = np.arange(m.size)
+        cutouts = m.get_cutouts(iobj, 0)
+        box_size = m['box_size'][0]
+        assert cutouts.shape == (m.size, box_size, box_size)
+
+        # no cutouts requested
+        for ctype in ['image', 'psf']:
+            cutouts, shapes = m.get_cutouts(
+                [], 0, type=ctype, return_shapes=True,
+            )
+            assert cutouts.shape == (0, 0, 0)
+            assert cutouts.dtype == m.get_cutouts([0], 0, type=ctype).dtype
+            assert shapes.shape == (0, 2)
+
+        with pytest.raises(ValueError):
+            m.get_cutouts([0, 1], [0, 1000])
+
+
+@pytest.mark.parametrize('mmap', [False, True])
+def test_cache(mmap):
+    rng = np.random.RandomState(871)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(fname=fname, rng=rng)
+
+        m = meds.MEDS(fname)
+        cm = meds.MEDS(fname, mmap=mmap, cache_bytes=10_000_000)
+        assert m.get_cache_stats() is None
+
+        for iobj in range(m.size):
+            for ctype in ['image', 'weight', 'seg', 'psf']:
+                clist = cm.get_cutout_list(iobj, type=ctype)
+                for c, cut in zip(clist, m.get_cutout_list(iobj, type=ctype)):
+                    assert not c.flags.writeable
+                    np.testing.assert_array_equal(c, cut)
+
+                for icut in range(m['ncutout'][iobj]):
+                    c = cm.get_cutout(iobj, icut, type=ctype, copy=True)
+                    assert c.flags.writeable
+                    np.testing.assert_array_equal(
+                        c, m.get_cutout(iobj, icut, type=ctype),
+                    )
+
+            np.testing.assert_array_equal(
+                cm.get_cweight_mosaic(iobj), m.get_cweight_mosaic(iobj),
+            )
+            np.testing.assert_array_equal(
+                cm.get_uberseg_list(iobj), m.get_uberseg_list(iobj),
+            )
+
+        stats = cm.get_cache_stats()
+        assert stats['misses'] == 4 * m.size
+        assert stats['hits'] > 0
+        assert stats['evictions'] == 0
+        assert stats['nbytes'] <= stats['max_bytes']
+
+        # room for about one mosaic
+        box_size = m['box_size'][0]
+        ncut = m['ncutout'].max()
+        cm = meds.MEDS(fname, mmap=mmap, cache_bytes=box_size**2*ncut*4)
+        for iobj in range(m.size):
+            cm.get_mosaic(iobj)
+            cm.get_mosaic(iobj)
+
+        stats = cm.get_cache_stats()
+        assert stats['nentries'] == 1
+        assert stats['hits'] == m.size
+        assert stats['evictions'] == m.size - 1
+
+        cm.clear_cache()
+        assert cm.get_cache_stats()['nentries'] == 0
+
+
+def test_lazy_and_columns():
+    rng = np.random.RandomState(1234)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(fname=fname, rng=rng)
+
+        m = meds.MEDS(fname)
+        cat = m.get_cat()
+
+        lm = meds.MEDS(fname, lazy=True)
+        assert lm.size == m.size
+        assert lm._cat._data == {}
+
+        im = lm.get_cutout(3, 0)
+        np.testing.assert_array_equal(im, m.get_cutout(3, 0))
+        assert set(lm._cat._data) == set(['ncutout', 'box_size', 'start_row'])
+
+        # rows are read without loading the other columns
+        for item in [2, -1, slice(1, 7, 2), [4, 1, 4], cat['ncutout'] > 1,
+                     np.array([[0, 1], [3, 2]]), []]:
+            rows = lm[item]
+            assert rows.dtype == cat.dtype
+            assert rows.shape == cat[item].shape
+            for name in cat.dtype.names:
+                np.testing.assert_array_equal(rows[name], cat[item][name])
+        assert set(lm._cat._data) == set(['ncutout', 'box_size', 'start_row'])
+
+        lcat = lm.get_cat()
+        assert lcat.dtype == cat.dtype
+        for name in cat.dtype.names:
+            np.testing.assert_array_equal(lcat[name], cat[name])
+
+        info = lm.get_image_info()
+        assert info.size == m.get_image_info().size
+        assert 'medsconf' in lm.get_meta().dtype.names
+
+        columns = ['box_size', 'start_row']
+        for lazy in [False, True]:
+            cm = meds.MEDS(fname, columns=columns, lazy=lazy)
+            assert cm.get_cat().dtype.names == ('box_size', 'ncutout',
+                                                'start_row')
+            for iobj in range(m.size):
+                np.testing.assert_array_equal(
+                    cm.get_mosaic(iobj), m.get_mosaic(iobj),
+                )
+
+            with pytest.raises(ValueError):
+                cm['ra']
+
+        with pytest.raises(ValueError):
+            meds.MEDS(fname, columns=['blah'], lazy=True)
+
+
+def test_jacobian_arrays():
+    rng = np.random.RandomState(5)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(fname=fname, rng=rng)
+
+        # per-object access does not build the arrays for all objects
+        m = meds.MEDS(fname)
+        m.get_jacobian_array(0)
+        m.get_jacobian_inverse_array(0)
+        assert m._jacobians is None
+
+        jacobians, inverses = m.get_all_jacobians()
+        nmax = m['dudrow'].shape[1]
+        assert jacobians.shape == (m.size, nmax, 2, 2)
+        assert inverses.shape == (m.size, nmax, 2, 2)
+
+        for iobj in range(m.size):
+            ncut = m['ncutout'][iobj]
+            jarr = m.get_jacobian_array(iobj)
+            jinv = m.get_jacobian_inverse_array(iobj)
+            assert jarr.shape == (ncut, 2, 2)
+            assert jinv.shape == (ncut, 2, 2)
+            assert np.all(np.isnan(jacobians[iobj, ncut:]))
+            np.testing.assert_array_equal(jarr, jacobians[iobj, :ncut])
+            np.testing.assert_array_equal(jinv, inverses[iobj, :ncut])
+
+            for icut in range(ncut):
+                jm = m.get_jacobian_matrix(iobj, icut)
+                np.testing.assert_array_equal(jarr[icut], jm)
+                np.testing.assert_array_equal(
+                    jinv[icut], np.linalg.inv(np.asarray(jm)),
+                )
+
+    # singular jacobians get NaN inverses
+    cat = np.zeros(2, dtype=[
+        ('ncutout', 'i8'),
+        ('dudrow', 'f8', 2), ('dudcol', 'f8', 2),
+        ('dvdrow', 'f8', 2), ('dvdcol', 'f8', 2),
+    ])
+    cat['ncutout'] = [2, 1]
+    cat['dudrow'] = 0.263
+    cat['dvdcol'] = 0.263
+    cat['dudrow'][0, 1] = 0.0
+    cat['dvdcol'][0, 1] = 0.0
+    jacobians, inverses = meds.meds._make_jacobian_arrays(cat)
+    assert np.all(np.isfinite(inverses[0, 0]))
+    assert np.all(np.isnan(inverses[0, 1]))
+    assert np.all(np.isfinite(inverses[1, 0]))
+    assert np.all(np.isnan(inverses[1, 1]))
+
+
+def test_derived_map_stacks():
+    rng = np.random.RandomState(11)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(
+            fname=fname, rng=rng, nneighbor=4, jacobian_noise=0.1,
+        )
+
+        m = meds.MEDS(fname)
+        for iobj in range(m.size):
+            ncut = m['ncutout'][iobj]
+            box_size = m['box_size'][iobj]
+            shape = (ncut, box_size, box_size)
+            wt = m.get_mosaic(iobj, type='weight')
+
+            cwstack = m.get_cweight_stack(iobj)
+            csstack = m.get_cseg_stack(iobj)
+            isstack = m.interpolate_coadd_seg_stack(iobj)
+            assert cwstack.shape == shape
+            assert cwstack.dtype == wt.dtype
+            assert csstack.shape == shape
+            assert isstack.shape == shape
+
+            np.testing.assert_array_equal(
+                m.get_cweight_mosaic(iobj), cwstack.reshape(wt.shape),
+            )
+            np.testing.assert_array_equal(
+                m.get_cseg_mosaic(iobj), csstack.reshape(wt.shape),
+            )
+            np.testing.assert_array_equal(
+                m.interpolate_coadd_seg_mosaic(iobj),
+                isstack.reshape(wt.shape),
+            )
+
+            coadd_seg = m.get_cutout(iobj, 0, type='seg')
+            crow, ccol = m.get_cutout_rowcol(iobj, 0)
+            cjinv = np.linalg.inv(np.asarray(m.get_jacobian_matrix(iobj, 0)))
+            rows, cols = np.mgrid[0:box_size, 0:box_size]
+            for icut in range(ncut):
+                np.testing.assert_array_equal(
+                    m.get_cweight_cutout(iobj, icut), cwstack[icut],
+                )
+                np.testing.assert_array_equal(
+                    m.get_cseg_cutout(iobj, icut), csstack[icut],
+                )
+                np.testing.assert_array_equal(
+                    m.interpolate_coadd_seg(iobj, icut), isstack[icut],
+                )
+                assert m.get_cseg_weight(iobj, icut).dtype == wt.dtype
+
+                # map the pixels one epoch at a time to check the
+                # batched transform
+                jac = np.asarray(m.get_jacobian_matrix(iobj, icut))
+                rowcen, colcen = m.get_cutout_rowcol(iobj, icut)
+                u = (rows-rowcen)*jac[0, 0] + (cols-colcen)*jac[0, 1]
+                v = (rows-rowcen)*jac[1, 0] + (cols-colcen)*jac[1, 1]
+                srow = (crow + u*cjinv[0, 0] + v*cjinv[0, 1]).round()
+                scol = (ccol + u*cjinv[1, 0] + v*cjinv[1, 1]).round()
+                srow = srow.astype('i8').clip(0, box_size-1)
+                scol = scol.astype('i8').clip(0, box_size-1)
+                np.testing.assert_array_equal(
+                    isstack[icut], coadd_seg[srow, scol],
+                )
+
+
+@pytest.mark.parametrize('fast', [False, True])
+def test_uberseg_edt(fast):
+    pytest.importorskip('scipy')
+
+    rng = np.random.RandomState(21)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(
+            fname=fname, rng=rng, nobj=5, nneighbor=8, jacobian_noise=0.1,
+        )
+
+        m = meds.MEDS(fname)
+        for iobj in range(m.size):
+            tree_list = m.get_uberseg_list(iobj, fast=fast)
+            edt_list = m.get_uberseg_list(iobj, fast=fast, engine='edt')
+            for icut, (tree, edt) in enumerate(zip(tree_list, edt_list)):
+                assert edt.dtype == tree.dtype
+                np.testing.assert_array_equal(edt, tree)
+                np.testing.assert_array_equal(
+                    m.get_uberseg(iobj, icut, fast=fast, engine='edt'), tree,
+                )
+
+        with pytest.raises(ValueError):
+            m.get_uberseg(0, 0, engine='blah')
+
+
+def test_uberseg_threads():
+    if not meds.meds._have_c_ubserseg:
+        pytest.skip('C uberseg not available')
+
+    rng = np.random.RandomState(31)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(
+            fname=fname, rng=rng, nobj=5, nneighbor=8, jacobian_noise=0.1,
+        )
+
+        m = meds.MEDS(fname)
+        for iobj in range(m.size):
+            # one call to the C code per cutout
+            cweights = m.get_cweight_stack(iobj)
+            segs = m.interpolate_coadd_seg_stack(iobj)
+            expected = [
+                meds.meds._uberseg_weight(cweight, seg, m['number'][iobj])
+                for cweight, seg in zip(cweights, segs)
+            ]
+
+            for nthreads in [1, 4]:
+                wlist = m.get_uberseg_list(iobj, nthreads=nthreads)
+                for weight, expected_weight in zip(wlist, expected):
+                    np.testing.assert_array_equal(weight, expected_weight)
+
+    segs = np.zeros((2, 10, 10), dtype='i4')
+    with pytest.raises(TypeError):
+        meds.meds._uberseg.uberseg_tree_batch(
+            segs, np.ones((2, 10, 10)), np.ones(2, dtype='i4'), 1,
+        )
+    with pytest.raises(ValueError):
+        meds.meds._uberseg.uberseg_tree_batch(
+            segs, np.ones((2, 10, 10), dtype='f4'), np.ones(3, dtype='i4'), 1,
+        )
+
+
+@pytest.mark.parametrize(
+    'n_jobs, backend',
+    [(1, 'loky'), (2, 'threading'), (2, 'multiprocessing')],
+)
+def test_derived_maps(n_jobs, backend):
+    import fitsio
+
+    rng = np.random.RandomState(41)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(
+            fname=fname, rng=rng, nobj=6, nneighbor=6, jacobian_noise=0.1,
+        )
+
+        # a singular coadd jacobian for object 1
+        singular = 1
+        with fitsio.FITS(fname, 'rw') as fits:
+            hdu = fits['object_data']
+            for name in ['dudrow', 'dudcol', 'dvdrow', 'dvdcol']:
+                data = hdu[name][:]
+                data[singular, 0] = 0
+                hdu.write_column(name, data)
+
+        with meds.MEDS(fname) as m:
+            assert m._derived_types == []
+            assert m['ncutout'][singular] > 1
+            with pytest.raises(np.linalg.LinAlgError):
+                m.get_uberseg_list(singular)
+            useg0 = m.get_uberseg(singular, 0)
+
+            usegs = [
+                m.get_uberseg_list(i) if i != singular else None
+                for i in range(m.size)
+            ]
+            cweights = [m.get_cweight_mosaic(i) for i in range(m.size)]
+
+        meds.add_derived_maps(
+            fname, n_jobs=n_jobs, backend=backend, chunksize=4,
+        )
+        with pytest.raises(ValueError):
+            meds.add_derived_maps(fname)
+
+        with meds.MEDS(fname) as m:
+            assert m._derived_types == ['uberseg', 'cweight']
+
+            with pytest.raises(np.linalg.LinAlgError):
+                m.get_uberseg_list(singular)
+            with pytest.raises(np.linalg.LinAlgError):
+                m.get_uberseg(singular, 1)
+            np.testing.assert_array_equal(m.get_uberseg(singular, 0), useg0)
+
+            for iobj in range(m.size):
+                np.testing.assert_array_equal(
+                    m.get_cweight_mosaic(iobj), cweights[iobj],
+                )
+                if iobj == singular:
+                    continue
+                for icut, useg in enumerate(m.get_uberseg_list(iobj)):
+                    np.testing.assert_array_equal(useg, usegs[iobj][icut])
+                    np.testing.assert_array_equal(
+                        m.get_uberseg(iobj, icut), usegs[iobj][icut],
+                    )
+
+        with meds.MEDS(fname, derived=False) as m:
+            assert m._derived_types == []
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_threadsafe(lazy):
+    from concurrent.futures import ThreadPoolExecutor
+
+    rng = np.random.RandomState(51)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(fname=fname, rng=rng, nobj=20)
+
+        with meds.MEDS(fname) as m:
+            expected = [
+                (m.get_mosaic(i), m.get_cweight_mosaic(i))
+                for i in range(m.size)
+            ]
+
+        m = meds.MEDS(fname, threadsafe=True, lazy=lazy)
+
+        def _read(iobj):
+            return m.get_mosaic(iobj), m.get_cweight_mosaic(iobj)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(_read, list(range(m.size))*5))
+
+        for i, (mosaic, cweight) in enumerate(results):
+            np.testing.assert_array_equal(mosaic, expected[i % m.size][0])
+            np.testing.assert_array_equal(cweight, expected[i % m.size][1])
+
+        assert len(m._thread_fits) <= 4
+
+        # the handles are closed when their threads exit
+        import gc
+        import threading
+
+        def _get_fits(iobj):
+            m._fits
+            _read(iobj)
+
+        for i in range(10):
+            thread = threading.Thread(target=_get_fits, args=(i,))
+            thread.start()
+            thread.join()
+        gc.collect()
+        assert len(m._thread_fits) == 1
+        assert not any(f.alive for f in m._thread_fits)
+
+        m.close()
+        assert m._thread_fits == []
+
+
+def test_async():
+    import asyncio
+
+    rng = np.random.RandomState(61)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(fname=fname, rng=rng, nobj=5)
+
+        m = meds.MEDS(fname)
+
+        async def _run(am):
+            nread = [0]
+            get_mosaic = am.meds.get_mosaic
+
+            def _counting_get_mosaic(*args, **kw):
+                nread[0] += 1
+                return get_mosaic(*args, **kw)
+
+            am.meds.get_mosaic = _counting_get_mosaic
+
+            # concurrent requests for the cutouts of one object
+            # share a single read
+            ncut = m['ncutout'][0]
+            ims = await asyncio.gather(
+                *[am.get_cutout(0, icut) for icut in range(ncut)]
+            )
+            assert nread[0] == 1
+            for icut, im in enumerate(ims):
+                assert not im.flags.writeable
+                np.testing.assert_array_equal(im, m.get_cutout(0, icut))
+
+            psf = await am.get_cutout(1, 0, type='psf')
+            np.testing.assert_array_equal(psf, m.get_psf(1, 0))
+
+            bundles = await asyncio.gather(
+                *[am.get_object_bundle(iobj) for iobj in range(am.size)]
+            )
+            for iobj, bundle in enumerate(bundles):
+                assert not bundle['psf'].flags.writeable
+                for type in ['image', 'weight', 'seg']:
+                    np.testing.assert_array_equal(
+                        bundle[type].reshape(-1, bundle[type].shape[2]),
+                        m.get_mosaic(iobj, type=type),
+                    )
+
+            with pytest.raises(ValueError):
+                await am.get_cutout(0, ncut)
+
+        async def _main():
+            async with meds.AsyncMEDS(fname, max_workers=4) as am:
+                await _run(am)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(_main())
+        finally:
+            loop.close()
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_object_bundle(parallel):
+    rng = np.random.RandomState(71)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(fname=fname, rng=rng, nobj=5, nneighbor=3)
+
+        m = meds.MEDS(fname, threadsafe=parallel)
+        for iobj in range(m.size):
+            ncut = m['ncutout'][iobj]
+            bundle = m.get_object_bundle(
+                iobj, interp_seg=True, parallel=parallel,
+            )
+            assert set(bundle.keys()) == set([
+                'image', 'weight', 'seg', 'bmask',
+                'psf', 'psf_shapes', 'interp_seg',
+                'jacobian', 'cutout_row', 'cutout_col',
+            ])
+
+            for type in ['image', 'weight', 'seg', 'bmask']:
+                stack = bundle[type]
+                assert stack.flags.writeable
+                for icut in range(ncut):
+                    np.testing.assert_array_equal(
+                        stack[icut], m.get_cutout(iobj, icut, type=type),
+                    )
+
+            for icut in range(ncut):
+                psf = m.get_psf(iobj, icut)
+                nrow, ncol = bundle['psf_shapes'][icut]
+                assert psf.shape == (nrow, ncol)
+                np.testing.assert_array_equal(
+                    bundle['psf'][icut, :nrow, :ncol], psf,
+                )
+                np.testing.assert_array_equal(
+                    bundle['interp_seg'][icut],
+                    m.interpolate_coadd_seg(iobj, icut),
+                )
+                np.testing.assert_array_equal(
+                    bundle['jacobian'][icut],
+                    m.get_jacobian_matrix(iobj, icut),
+                )
+                assert (
+                    (bundle['cutout_row'][icut], bundle['cutout_col'][icut])
+                    == m.get_cutout_rowcol(iobj, icut)
+                )
+
+        bundle = m.get_object_bundle(0, types=['image'], psf=False)
+        assert set(bundle.keys()) == set([
+            'image', 'jacobian', 'cutout_row', 'cutout_col',
+        ])
+        m.close()
+
+        if not parallel:
+            with pytest.raises(ValueError):
+                meds.MEDS(fname).get_object_bundle(0, parallel=True)
+
+
+@pytest.mark.parametrize('mmap', [False, True])
+def test_iter_objects(mmap):
+    rng = np.random.RandomState(81)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(fname=fname, rng=rng, nobj=20)
+
+        m = meds.MEDS(fname, mmap=mmap)
+        types = ['image', 'weight', 'seg']
+
+        for slab_pixels in [1, 5000, 10**8]:
+            iobjs = []
+            for iobj, mosaics in m.iter_objects(
+                start=3, end=17, types=types, slab_pixels=slab_pixels,
+            ):
+                iobjs.append(iobj)
+                for type in types:
+                    np.testing.assert_array_equal(
+                        mosaics[type], m.get_mosaic(iobj, type=type),
+                    )
+            assert iobjs == list(range(3, 17))
+
+        # stopping early cleans up the reader thread
+        for iobj, mosaics in m.iter_objects(slab_pixels=1, prefetch=1):
+            if iobj == 2:
+                break
+
+        with pytest.raises(ValueError):
+            list(m.iter_objects(end=m.size+1))
+
+
+def _get_image_sum(m, iobj):
+    if m['ncutout'][iobj] == 0:
+        return None
+    return iobj, m.get_mosaic(iobj).sum()
+
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_parallel_map(n_workers):
+    rng = np.random.RandomState(83)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(fname=fname, rng=rng, nobj=20)
+
+        with meds.MEDS(fname) as m:
+            expected = [
+                _get_image_sum(m, iobj) for iobj in range(2, 19)
+            ]
+
+        for chunking in ['pixels', 'objects']:
+            results = list(meds.parallel_map(
+                _get_image_sum, fname, obj_range=(2, 19),
+                n_workers=n_workers, chunking=chunking, chunks_per_worker=3,
+            ))
+            assert results == expected
+
+        with pytest.raises(ValueError):
+            meds.parallel_map(_get_image_sum, fname, chunking='blah')
+
+        with pytest.raises(ValueError):
+            meds.parallel_map(_get_image_sum, fname, obj_range=(0, 21))
+
+
+def test_plan_chunks():
+    from ..partition import split_contiguous
+
+    costs = np.array([1, 1, 1, 10, 1, 1, 1, 1, 1, 1, 1])
+    assert split_contiguous(costs, 3) == [(0, 3), (3, 4), (4, 11)]
+    assert split_contiguous(np.ones(5), 100) == [(i, i+1) for i in range(5)]
+    assert split_contiguous(np.zeros(0), 4) == []
+
+    rng = np.random.RandomState(85)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(fname=fname, rng=rng, nobj=40)
+
+        m = meds.MEDS(fname)
+        pixels = m['ncutout']*(m['box_size']**2 + m['psf_box_size']**2)
+
+        for cost in ['pixels', 'cutouts', 'objects', lambda cat: pixels]:
+            for contiguous in [True, False]:
+                chunks = meds.plan_chunks(
+                    fname, 4, cost=cost, contiguous=contiguous,
+                )
+                assert len(chunks) == 4
+                np.testing.assert_array_equal(
+                    np.sort(np.concatenate(chunks)), np.arange(m.size),
+                )
+                if contiguous:
+                    for chunk in chunks:
+                        np.testing.assert_array_equal(
+                            chunk, np.arange(chunk[0], chunk[-1]+1),
+                        )
+
+        # greedy assignment is at least as balanced as the contiguous split
+        chunk_costs = {}
+        for contiguous in [True, False]:
+            chunks = meds.plan_chunks(fname, 4, contiguous=contiguous)
+            chunk_costs[contiguous] = [pixels[c].sum() for c in chunks]
+        assert max(chunk_costs[False]) <= max(chunk_costs[True])
+        assert sum(chunk_costs[False]) == pixels.sum()
+
+        # more chunks than objects gives empty chunks
+        chunks = meds.plan_chunks(fname, m.size + 3)
+        assert len(chunks) == m.size + 3
+        assert sum(c.size == 0 for c in chunks) >= 3
+        np.testing.assert_array_equal(
+            np.concatenate(chunks), np.arange(m.size),
+        )
+
+        plan_file = os.path.join(tdir, 'plan.fits')
+        meds.partition.write_plan(plan_file, chunks, meds_file=fname)
+        for c1, c2 in zip(meds.partition.read_plan(plan_file), chunks):
+            np.testing.assert_array_equal(c1, c2)
+
+        with pytest.raises(ValueError):
+            meds.plan_chunks(fname, 4, cost='blah')
+        with pytest.raises(ValueError):
+            meds.plan_chunks(fname, 4, cost=lambda cat: [1, 2])
+
+
+def test_plan_chunks_script():
+    import subprocess
+    import sys
+    import fitsio
+
+    topdir = os.path.dirname(os.path.dirname(os.path.abspath(meds.__file__)))
+    script = os.path.join(topdir, 'scripts', 'meds-plan-chunks')
+    if not os.path.exists(script):
+        pytest.skip('meds-plan-chunks script not found')
+
+    # run with this meds package
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [topdir] + [p for p in [env.get('PYTHONPATH')] if p]
+    )
+
+    rng = np.random.RandomState(86)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(fname=fname, rng=rng, nobj=40)
+
+        plan_file = os.path.join(tdir, 'plan.fits')
+        output = subprocess.check_output(
+            [sys.executable, script, fname, '4', plan_file],
+            universal_newlines=True,
+            env=env,
+        )
+        ranges = [
+            [int(v) for v in line.split('range:')[1].split()]
+            for line in output.splitlines() if 'range:' in line
+        ]
+        assert len(ranges) == 4
+
+        # the printed ranges run through the extractor cover every object
+        # exactly once
+        ids = []
+        for ichunk, (start, end) in enumerate(ranges):
+            sub_file = os.path.join(tdir, 'chunk%d.fits' % ichunk)
+            meds.extract_range(fname, start, end, sub_file)
+            ids.append(fitsio.read(sub_file, ext='object_data')['id'])
+
+        cat = fitsio.read(fname, ext='object_data')
+        np.testing.assert_array_equal(np.concatenate(ids), cat['id'])
+
+        with pytest.raises(ValueError):
+            meds.partition.get_extract_ranges([np.array([0, 2])])
+
+
+@pytest.mark.parametrize('index_sidecar', [False, True])
+def test_index_of(index_sidecar):
+    rng = np.random.RandomState(87)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(fname=fname, rng=rng, nobj=30)
+
+        for _ in range(2):
+            m = meds.MEDS(fname, index_sidecar=index_sidecar)
+
+            inds = rng.permutation(m.size)[:10]
+            np.testing.assert_array_equal(m.index_of_id(m['id'][inds]), inds)
+            np.testing.assert_array_equal(
+                m.index_of_number(m['number'][inds]), inds,
+            )
+            assert m.index_of_id(m['id'][3]) == 3
+
+            missing = m['id'].max() + 1
+            with pytest.raises(ValueError):
+                m.index_of_id([m['id'][0], missing])
+            np.testing.assert_array_equal(
+                m.index_of_id([m['id'][0], missing], allow_missing=True),
+                [0, -1],
+            )
+            m.close()
+
+        sidecar = fname + '.id-index.npz'
+        assert os.path.exists(sidecar) == index_sidecar
+
+        if index_sidecar:
+            # a corrupt sidecar is rebuilt
+            with open(sidecar, 'wb') as fobj:
+                fobj.write(b'not an npz file')
+
+            with meds.MEDS(fname, index_sidecar=True) as m:
+                inds = rng.permutation(m.size)[:10]
+                np.testing.assert_array_equal(
+                    m.index_of_id(m['id'][inds]), inds,
+                )
+
+            with np.load(sidecar) as data:
+                assert data['order'].size == m.size
+
+        # catalogs without numbers use iobj+1
+        m = meds.MEDS(fname, columns=['id'])
+        np.testing.assert_array_equal(m.index_of_number([1, 5]), [0, 4])
+        assert m.index_of_number(m.size+1, allow_missing=True) == -1
+
+        m.close()
+
+        # the number extractor uses the same lookup
+        from ..number_extractor import MEDSNumberExtractor
+
+        fname = os.path.join(tdir, 'test-meds-nopsf.fits')
+        make_fake_meds(
+            fname=fname, rng=rng, nobj=30,
+            cutout_types=['image', 'weight', 'seg', 'bmask'],
+        )
+        sub_file = os.path.join(tdir, 'sub-meds.fits')
+
+        with meds.MEDS(fname) as m:
+            inds = np.array([7, 2, 11])
+            numbers = m['number'][inds]
+            with MEDSNumberExtractor(fname, numbers, sub_file, cleanup=True):
+                with meds.MEDS(sub_file) as sm:
+                    inds = inds[np.argsort(numbers)]
+                    np.testing.assert_array_equal(sm['id'], m['id'][inds])
+                    for iobj, ind in enumerate(inds):
+                        if m['ncutout'][ind] > 0:
+                            np.testing.assert_array_equal(
+                                sm.get_mosaic(iobj), m.get_mosaic(ind),
+                            )
+            assert not os.path.exists(sub_file)
+
+            with pytest.raises(AssertionError):
+                MEDSNumberExtractor(
+                    fname, [m['number'].max() + 1], sub_file, cleanup=True,
+                )
+
+
+def _get_angdist(ra1, dec1, ra2, dec2):
+    ra1, dec1, ra2, dec2 = [np.deg2rad(x) for x in (ra1, dec1, ra2, dec2)]
+    cosdist = (
+        np.sin(dec1)*np.sin(dec2) + np.cos(dec1)*np.cos(dec2)*np.cos(ra1-ra2)
+    )
+    return np.rad2deg(np.arccos(np.clip(cosdist, -1, 1)))
+
+
+@pytest.mark.parametrize('index_sidecar', [False, True])
+def test_sky_queries(index_sidecar):
+    rng = np.random.RandomState(89)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(fname=fname, rng=rng, nobj=30)
+
+        # the fake positions are all zero, so fill in positions near ra = 0
+        ra = rng.uniform(low=-2, high=2, size=30) % 360
+        dec = rng.uniform(low=-2, high=2, size=30)
+
+        for _ in range(2):
+            m = meds.MEDS(fname, index_sidecar=index_sidecar)
+            m._cat['ra'] = ra
+            m._cat['dec'] = dec
+
+            for ra_cen, dec_cen, radius in [
+                (0.0, 0.0, 1.5), (359.5, 1.0, 1.0), (1.0, -1.0, 0.0),
+                (0.0, 0.0, 10.0),
+            ]:
+                dist = _get_angdist(ra, dec, ra_cen, dec_cen)
+                np.testing.assert_array_equal(
+                    m.query_cone(ra_cen, dec_cen, radius),
+                    np.flatnonzero(dist <= radius),
+                )
+
+            # exact position
+            assert 4 in m.query_cone(ra[4], dec[4], 0.0)
+
+            # wraps through ra = 0
+            inds = m.query_box(359.0, 1.0, -1.0, 1.5)
+            sra = np.where(ra > 180, ra - 360, ra)
+            np.testing.assert_array_equal(
+                inds,
+                np.flatnonzero(
+                    (sra >= -1) & (sra <= 1) & (dec >= -1) & (dec <= 1.5)
+                ),
+            )
+            np.testing.assert_array_equal(
+                m.query_box(0, 360, -90, 90), np.arange(m.size),
+            )
+            assert m.query_box(100, 110, -1, 1).size == 0
+
+            with pytest.raises(ValueError):
+                m.query_cone(0, 0, -1)
+            with pytest.raises(ValueError):
+                m.query_box(0, 1, 1, 0)
+            m.close()
+
+        sidecar = fname + '.radec-index.npz'
+        assert os.path.exists(sidecar) == index_sidecar
+
+        if index_sidecar:
+            # a corrupt sidecar is rebuilt
+            with open(sidecar, 'wb') as fobj:
+                fobj.write(b'not an npz file')
+
+            with meds.MEDS(fname, index_sidecar=True) as m:
+                m._cat['ra'] = ra
+                m._cat['dec'] = dec
+                dist = _get_angdist(ra, dec, 0.0, 0.0)
+                np.testing.assert_array_equal(
+                    m.query_cone(0.0, 0.0, 1.5),
+                    np.flatnonzero(dist <= 1.5),
+                )
+
+            with np.load(sidecar) as data:
+                assert data['vecs'].shape == (30, 3)
+
+
+def test_extract_cone_box():
+    import fitsio
+
+    rng = np.random.RandomState(91)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(
+            fname=fname, rng=rng, nobj=30,
+            cutout_types=['image', 'weight', 'seg', 'bmask'],
+        )
+
+        ra = rng.uniform(low=-2, high=2, size=30) % 360
+        dec = rng.uniform(low=-2, high=2, size=30)
+        with fitsio.FITS(fname, 'rw') as fits:
+            fits['object_data'].write_column('ra', ra)
+            fits['object_data'].write_column('dec', dec)
+
+        m = meds.MEDS(fname)
+
+        sub_file = os.path.join(tdir, 'sub-meds.fits')
+        meds.extract_cone(fname, 0.0, 0.0, 1.5, sub_file)
+        inds = m.query_cone(0.0, 0.0, 1.5)
+        assert inds.size > 0
+        with meds.MEDS(sub_file) as sm:
+            np.testing.assert_array_equal(sm['id'], m['id'][inds])
+            for iobj, ind in enumerate(inds):
+                if m['ncutout'][ind] > 0:
+                    np.testing.assert_array_equal(
+                        sm.get_mosaic(iobj), m.get_mosaic(ind),
+                    )
+
+        meds.extract_box(fname, 359.0, 1.0, -1.0, 1.5, sub_file)
+        inds = m.query_box(359.0, 1.0, -1.0, 1.5)
+        assert inds.size > 0
+        with meds.MEDS(sub_file) as sm:
+            np.testing.assert_array_equal(sm['id'], m['id'][inds])
+        m.close()
+
+        # nothing selected
+        with pytest.raises(ValueError):
+            meds.extract_cone(fname, 100.0, 0.0, 1.0, sub_file)
+        with pytest.raises(ValueError):
+            meds.extract_box(fname, 100.0, 110.0, -1.0, 1.0, sub_file)
+
+
+def test_pread():
+    rng = np.random.RandomState(91)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(fname=fname, rng=rng, nobj=10)
+
+        m = meds.MEDS(fname)
+        mf = meds.MEDS(fname, pread=False)
+        assert m._raw_file is not None
+        assert mf._raw_file is None
+        assert m.has_psf()
+
+        for iobj in range(m.size):
+            if m['ncutout'][iobj] == 0:
+                continue
+
+            for type in ['image', 'weight', 'seg', 'bmask']:
+                mosaic = m.get_mosaic(iobj, type=type)
+                expected = mf.get_mosaic(iobj, type=type)
+                assert mosaic.dtype == expected.dtype
+                assert mosaic.flags.writeable
+                np.testing.assert_array_equal(mosaic, expected)
+
+                np.testing.assert_array_equal(
+                    m.get_cutout(iobj, 0, type=type),
+                    mf.get_cutout(iobj, 0, type=type),
+                )
+
+            for psf, expected in zip(m.get_psf_list(iobj),
+                                     mf.get_psf_list(iobj)):
+                np.testing.assert_array_equal(psf, expected)
+
+        with pytest.raises(ValueError):
+            m.get_cutout(0, 0, type='blah')
+
+        m.close()
+        mf.close()
+
+
+def _write_compressed_copy(fname, cname, tile_size):
+    """
+    copy the MEDS file, tile compressing the cutout and psf extensions
+    """
+    import fitsio
+
+    with fitsio.FITS(fname) as fits, \
+            fitsio.FITS(cname, 'rw', clobber=True) as cfits:
+        for hdu in fits[1:]:
+            extname = hdu.get_extname()
+            data = hdu.read()
+            if extname.endswith('_cutouts') or extname == 'psf':
+                cfits.write(
+                    data, extname=extname, compress='rice',
+                    tile_dims=[tile_size],
+                )
+            else:
+                cfits.write(data, extname=extname)
+
+
+def test_tile_cache():
+    rng = np.random.RandomState(93)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        cname = os.path.join(tdir, 'test-meds.fits.fz')
+        make_fake_meds(fname=fname, rng=rng, nobj=10)
+        _write_compressed_copy(fname, cname, 1000)
+
+        m = meds.MEDS(cname)
+        mf = meds.MEDS(cname, tile_cache_bytes=None)
+        assert mf.get_tile_cache_stats() is None
+        assert m._hdu_info['image_cutouts']['tile_size'] == 1000
+
+        for iobj in range(m.size):
+            if m['ncutout'][iobj] == 0:
+                continue
+
+            for type in ['image', 'seg', 'psf']:
+                for icut in range(m['ncutout'][iobj]):
+                    cutout = m.get_cutout(iobj, icut, type=type)
+                    assert cutout.flags.writeable
+                    np.testing.assert_array_equal(
+                        cutout, mf.get_cutout(iobj, icut, type=type),
+                    )
+
+            np.testing.assert_array_equal(
+                m.get_mosaic(iobj, type='weight'),
+                mf.get_mosaic(iobj, type='weight'),
+            )
+
+        stats = m.get_tile_cache_stats()
+        assert stats['hits'] > 0
+        assert stats['misses'] > 0
+
+        # tiles larger than the cache are read directly
+        ms = meds.MEDS(cname, tile_cache_bytes=100)
+        np.testing.assert_array_equal(ms.get_mosaic(0), mf.get_mosaic(0))
+        assert ms.get_tile_cache_stats()['nentries'] == 0
+
+        for mm in [m, mf, ms]:
+            mm.close()
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_compress_meds(n_jobs):
+    import fitsio
+
+    rng = np.random.RandomState(95)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(fname=fname, rng=rng, nobj=10)
+
+        fpack_pars = {'FZQVALUE': 16, 'FZTILE': '(1000,1)'}
+        cnames = []
+        for i in range(2):
+            cname = os.path.join(tdir, 'test-meds-%d.fits.fz' % i)
+            meds.compress_meds(
+                fname, cname, fpack_pars=fpack_pars, n_jobs=n_jobs,
+                block_tiles=3,
+            )
+            cnames.append(cname)
+
+        # lossy compression is seeded, so the output is reproducible
+        with open(cnames[0], 'rb') as f0, open(cnames[1], 'rb') as f1:
+            assert f0.read() == f1.read()
+
+        # the extensions are split into ranges of tiles for parallel jobs,
+        # which give the same output as one job per extension
+        with fitsio.FITS(fname) as fits:
+            ntiles = fits['image_cutouts'].get_dims()[0] // 1000
+        assert ntiles > 4*3
+
+        sname = os.path.join(tdir, 'test-meds-serial.fits.fz')
+        meds.compress_meds(fname, sname, fpack_pars=fpack_pars)
+        with open(cnames[0], 'rb') as f0, open(sname, 'rb') as fs:
+            assert f0.read() == fs.read()
+
+        # the ranges are compressed as one if the heap offsets would
+        # overflow when joined
+        def _join_compressed_hdus(tmp_files, fout):
+            raise meds.compress._DescriptorOverflow()
+
+        join_compressed_hdus = meds.compress._join_compressed_hdus
+        meds.compress._join_compressed_hdus = _join_compressed_hdus
+        try:
+            oname = os.path.join(tdir, 'test-meds-overflow.fits.fz')
+            meds.compress_meds(
+                fname, oname, fpack_pars=fpack_pars, n_jobs=2,
+                block_tiles=3,
+            )
+        finally:
+            meds.compress._join_compressed_hdus = join_compressed_hdus
+        with open(oname, 'rb') as fo, open(sname, 'rb') as fs:
+            assert fo.read() == fs.read()
+
+        with fitsio.FITS(fname) as fits, fitsio.FITS(cnames[0]) as cfits:
+            assert [h.get_extname() for h in fits] == [
+                h.get_extname() for h in cfits
+            ]
+            assert cfits['image_cutouts'].get_info()['is_compressed_image']
+            np.testing.assert_array_equal(
+                fits['object_data'][:], cfits['object_data'][:],
+            )
+
+        m = meds.MEDS(fname)
+        mc = meds.MEDS(cnames[0])
+        assert mc._hdu_info['seg_cutouts']['tile_size'] == 1000
+        for iobj in range(m.size):
+            if m['ncutout'][iobj] == 0:
+                continue
+
+            # integer types are lossless
+            for type in ['seg', 'bmask']:
+                np.testing.assert_array_equal(
+                    mc.get_mosaic(iobj, type=type),
+                    m.get_mosaic(iobj, type=type),
+                )
+
+            im = m.get_mosaic(iobj)
+            imc = mc.get_mosaic(iobj)
+            assert np.abs(imc - im).max() < 0.1*im.std()
+        mc.close()
+
+        # lossless floats
+        cname = os.path.join(tdir, 'test-meds-lossless.fits.fz')
+        meds.compress_meds(fname, cname, fpack_pars={'FZQVALUE': 0})
+        with meds.MEDS(cname) as mc:
+            for iobj in range(m.size):
+                if m['ncutout'][iobj] > 0:
+                    np.testing.assert_array_equal(
+                        mc.get_mosaic(iobj), m.get_mosaic(iobj),
+                    )
+        m.close()
+
+
+def test_maker_fpack_write():
+    import fitsio
+    from meds.maker import MEDSMaker
+
+    rng = np.random.RandomState(96)
+    with tempfile.TemporaryDirectory() as tdir:
+        obj_data, image_info = make_fake_maker_inputs(tdir, rng)
+
+        config = {
+            'cutout_types': ['image', 'weight', 'seg', 'bmask'],
+            'unusable_bmask': 4,
+        }
+        fname = os.path.join(tdir, 'test-meds.fits')
+        MEDSMaker(obj_data, image_info, config=config).write(fname)
+
+        # lossless, so the cutouts can be compared exactly
+        config['fpack_write'] = True
+        config['fpack_pars'] = {'FZQVALUE': 0, 'FZTILE': '(1000,1)'}
+        cname = os.path.join(tdir, 'test-meds.fits.fz')
+        MEDSMaker(obj_data, image_info, config=config).write(cname)
+        assert not os.path.exists(cname + '.uncompressed')
+
+        with fitsio.FITS(cname) as cfits:
+            assert cfits['image_cutouts'].get_info()['is_compressed_image']
+
+        with meds.MEDS(fname) as m, meds.MEDS(cname) as mc:
+            np.testing.assert_array_equal(mc._cat, m._cat)
+            for iobj in range(m.size):
+                if m['ncutout'][iobj] == 0:
+                    continue
+                for type in config['cutout_types']:
+                    np.testing.assert_array_equal(
+                        mc.get_mosaic(iobj, type=type),
+                        m.get_mosaic(iobj, type=type),
+                    )
+
+        # the uncompressed file is removed if compression fails
+        def _write_compressed(uncompressed_filename, filename):
+            raise IOError('compression failed')
+
+        fname = os.path.join(tdir, 'test-meds-fail.fits.fz')
+        maker = MEDSMaker(obj_data, image_info, config=config)
+        maker._write_compressed = _write_compressed
+        with pytest.raises(IOError):
+            maker.write(fname)
+        assert not os.path.exists(fname + '.uncompressed')
+
+
+def test_maker_fpack_align_tiles():
+    from meds.maker import MEDSMaker
+
+    rng = np.random.RandomState(98)
+    with tempfile.TemporaryDirectory() as tdir:
+        obj_data, image_info = make_fake_maker_inputs(tdir, rng)
+
+        config = {
+            'cutout_types': ['image', 'weight', 'seg', 'bmask'],
+            'unusable_bmask': 4,
+        }
+        fname = os.path.join(tdir, 'test-meds.fits')
+        MEDSMaker(obj_data, image_info, config=config).write(fname)
+
+        tile_size = 2000
+        config['fpack_align_tiles'] = True
+        config['fpack_pars'] = {'FZTILE': '(%d,1)' % tile_size}
+        aname = os.path.join(tdir, 'test-meds-aligned.fits')
+        MEDSMaker(obj_data, image_info, config=config).write(aname)
+
+        with meds.MEDS(fname) as m, meds.MEDS(aname) as ma:
+            nsmall = nlarge = 0
+            for iobj in range(ma.size):
+                ncut = ma['ncutout'][iobj]
+                if ncut == 0:
+                    continue
+
+                start = ma['start_row'][iobj, 0]
+                npix = ncut * ma['box_size'][iobj]**2
+                if npix <= tile_size:
+                    # within one tile
+                    nsmall += 1
+                    assert start // tile_size == (
+                        (start + npix - 1) // tile_size
+                    )
+                else:
+                    # starts a new tile
+                    nlarge += 1
+                    assert start % tile_size == 0
+
+                for type in config['cutout_types']:
+                    np.testing.assert_array_equal(
+                        ma.get_mosaic(iobj, type=type),
+                        m.get_mosaic(iobj, type=type),
+                    )
+
+            assert nsmall > 0 and nlarge > 0
+
+            # the aligned mosaics are padded
+            assert ma._fits['image_cutouts'].get_dims()[0] > (
+                m._fits['image_cutouts'].get_dims()[0]
+            )
+
+
+def test_maker_file_index():
+    import fitsio
+    from meds.maker import MEDSMaker
+
+    rng = np.random.RandomState(97)
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, 'test-meds.fits')
+        make_fake_meds(fname=fname, rng=rng, nobj=20)
+
+        maker = MEDSMaker.__new__(MEDSMaker)
+        maker.obj_data = fitsio.read(fname, ext='object_data')
+        maker.image_info = fitsio.read(fname, ext='image_info')
+        maker._build_file_index()
+
+    data = maker.obj_data
+    assert len(maker._file_index) == maker.image_info.size
+    for file_id, index in enumerate(maker._file_index):
+        expected = [
+            (iobj, icut)
+            for iobj in range(data.size)
+            for icut in range(data['ncutout'][iobj])
+            if data['file_id'][iobj, icut] == file_id
+        ]
+        assert list(zip(index['iobj'], index['icut'])) == expected
+
+        iobj, icut = index['iobj'], index['icut']
+        np.testing.assert_array_equal(
+            index['box_size'], data['box_size'][iobj],
+        )
+        for name in ['start_row', 'orig_start_row', 'orig_start_col']:
+            np.testing.assert_array_equal(index[name], data[name][iobj, icut])
+
+
+def test_maker_single_pass():
+    from meds.maker import MEDSMaker
+
+    rng = np.random.RandomState(99)
+    with tempfile.TemporaryDirectory() as tdir:
+        obj_data, image_info = make_fake_maker_inputs(tdir, rng)
+
+        config = {
+            'cutout_types': ['image', 'weight', 'seg', 'bmask'],
+            'unusable_bmask': 4,
+        }
+        fname = os.path.join(tdir, 'test-meds.fits')
+        MEDSMaker(obj_data, image_info, config=config).write(fname)
+
+        config['single_pass_cutouts'] = True
+        maker = MEDSMaker(obj_data, image_info, config=config)
+
+        nread = {}
+        read_one_image = maker._read_one_image
+
+        def _read_one_image(file_id, cutout_type):
+            key = (file_id, cutout_type)
+            nread[key] = nread.get(key, 0) + 1
+            return read_one_image(file_id, cutout_type)
+
+        maker._read_one_image = _read_one_image
+
+        sname = os.path.join(tdir, 'test-meds-single-pass.fits')
+        maker.write(sname)
+
+        # each plane, including the bkg subtracted from the image and the
+        # bmask used for the weight, is read once per file
+        file_ids = set(file_id for file_id, type in nread)
+        assert len(file_ids) > 1
+        for file_id in file_ids:
+            for type in ['image', 'bkg', 'weight', 'seg', 'bmask']:
+                assert nread[(file_id, type)] == 1
+        assert all(n == 1 for n in nread.values())
+
+        # some cutouts cross the edges of the images
+        with meds.MEDS(fname) as m:
+            icut = np.arange(m['file_id'].shape[1])
+            used = icut[np.newaxis, :] < m['ncutout'][:, np.newaxis]
+            start = np.minimum(m['orig_start_row'], m['orig_start_col'])
+            assert m['ncutout'].max() > 1
+            assert (start[used] < 0).any()
+
+        with open(fname, 'rb') as f, open(sname, 'rb') as fs:
+            assert f.read() == fs.read()
+
+
+def _write_cutouts_reference(maker, cutout_type):
+    """
+    write the cutouts one at a time, as the maker did before they were
+    extracted in batches, for comparing the outputs
+    """
+    from meds.defaults import default_values
+
+    def _get_clipped_boxes(dim, start, bsize):
+        obox = [start, start + bsize]
+        box = [0, bsize]
+        if obox[0] < 0:
+            obox[0] = 0
+            box[0] = 0 - start
+        diff = dim - obox[1]
+        if diff < 0:
+            obox[1] = dim
+            box[1] = box[1] + diff
+        return obox, box
+
+    d = maker.obj_data
+    cutout_hdu = maker._get_cutout_hdu(cutout_type)
+    for file_id in range(maker.image_info.size):
+        im_data = maker._read_image(file_id, cutout_type)
+        if im_data is None:
+            continue
+
+        for iobj in range(d.size):
+            for icut in range(d['ncutout'][iobj]):
+                if d['file_id'][iobj, icut] != file_id:
+                    continue
+
+                bsize = d['box_size'][iobj]
+                orow_box, row_box = _get_clipped_boxes(
+                    im_data.shape[0], d['orig_start_row'][iobj, icut], bsize,
+                )
+                ocol_box, col_box = _get_clipped_boxes(
+                    im_data.shape[1], d['orig_start_col'][iobj, icut], bsize,
+                )
+
+                subim = np.zeros(
+                    (bsize, bsize), dtype=maker['%s_dtype' % cutout_type],
+                )
+                subim += default_values[cutout_type]
+                if (min(orow_box + ocol_box) >= 0
+                        and orow_box[1] > orow_box[0]
+                        and ocol_box[1] > ocol_box[0]):
+                    subim[row_box[0]:row_box[1], col_box[0]:col_box[1]] = (
+                        im_data[orow_box[0]:orow_box[1],
+                                ocol_box[0]:ocol_box[1]]
+                    )
+
+                cutout_hdu.write(
+                    subim, start=d['start_row'][iobj, icut],
+                )
+
+
+@pytest.mark.parametrize(
+    'extra_config',
+    [
+        {},
+        {'single_pass_cutouts': True},
+        {'cutout_buffer_bytes': 20000},
+        {'joblib': {'backend': 'loky', 'max_workers': 2}},
+        {'fpack_align_tiles': True, 'fpack_pars': {'FZTILE': '(2000,1)'}},
+    ],
+)
+def test_maker_reference_cutouts(extra_config):
+    from meds.maker import MEDSMaker
+
+    rng = np.random.RandomState(107)
+    with tempfile.TemporaryDirectory() as tdir:
+        obj_data, image_info = make_fake_maker_inputs(tdir, rng)
+
+        config = {
+            'cutout_types': ['image', 'weight', 'seg', 'bmask'],
+            'unusable_bmask': 4,
+        }
+        config.update(extra_config)
+
+        # the reference is written with the per cutout code path
+        rname = os.path.join(tdir, 'test-meds-reference.fits')
+        maker = MEDSMaker(obj_data, image_info, config=config)
+        maker._use_joblib = False
+        maker['single_pass_cutouts'] = False
+        maker._write_cutouts = (
+            lambda cutout_type: _write_cutouts_reference(maker, cutout_type)
+        )
+        maker.write(rname)
+
+        # cutouts off the edges of the images are filled
+        with meds.MEDS(rname) as m:
+            icut = np.arange(m['file_id'].shape[1])
+            used = icut[np.newaxis, :] < m['ncutout'][:, np.newaxis]
+            start = np.minimum(m['orig_start_row'], m['orig_start_col'])
+            assert (start[used] < 0).any()
+
+        fname = os.path.join(tdir, 'test-meds.fits')
+        MEDSMaker(obj_data, image_info, config=config).write(fname)
+
+        with open(rname, 'rb') as fr, open(fname, 'rb') as f:
+            assert fr.read() == f.read()
+
+
+def test_extract_stamps():
+    from meds.maker import _extract_stamps
+
+    rng = np.random.RandomState(101)
+    image = rng.normal(size=(50, 60)).astype('f8')
+
+    nstamp = 40
+    box_size = rng.choice([4, 6, 8], size=nstamp)
+    orow = rng.randint(-10, 55, size=nstamp)
+    ocol = rng.randint(-10, 65, size=nstamp)
+    # one stamp entirely off the image
+    orow[0] = -20
+
+    stamps, offsets = _extract_stamps(
+        image, orow, ocol, box_size, -1.0, 'f4',
+    )
+    assert stamps.dtype == np.dtype('f4')
+    assert stamps.size == (box_size**2).sum()
+
+    padded = np.full((100, 110), -1.0)
+    padded[20:70, 20:80] = image
+    for i in range(nstamp):
+        bsize = box_size[i]
+        if orow[i] + bsize > 0:
+            expected = padded[
+                orow[i] + 20:orow[i] + 20 + bsize,
+                ocol[i] + 20:ocol[i] + 20 + bsize,
+            ]
+        else:
+            expected = np.full((bsize, bsize), -1.0)
+
+        stamp = stamps[offsets[i]:offsets[i] + bsize**2]
+        np.testing.assert_array_equal(
+            stamp.reshape(bsize, bsize), expected.astype('f4'),
+        )
+
+
+@pytest.mark.parametrize('max_bytes', [0, 1000, 10**9])
+def test_cutout_writer(max_bytes):
+    from meds.maker import _CutoutWriter
+
+    class RecordingHDU(object):
+        def __init__(self, npix):
+            self.data = np.zeros(npix, dtype='f4')
+            self.nwrite = 0
+
+        def write(self, data, start=0):
+            self.data[start:start + data.size] = data
+            self.nwrite += 1
+
+    rng = np.random.RandomState(103)
+
+    # a mosaic of 20 objects with 3 cutouts each, each cutout from a
+    # different file
+    box_size = rng.choice([4, 6], size=20)
+    npix = np.repeat(box_size**2, 3)
+    start_rows = npix.cumsum() - npix
+    expected = rng.normal(size=npix.sum()).astype('f4')
+
+    hdu = RecordingHDU(npix.sum())
+    writer = _CutoutWriter(hdu, max_bytes)
+    for icut in range(3):
+        ind = np.arange(icut, npix.size, 3)
+        offsets = npix[ind].cumsum() - npix[ind]
+        stamps = np.concatenate([
+            expected[s:s + n] for s, n in zip(start_rows[ind], npix[ind])
+        ])
+        writer.add(stamps, offsets, npix[ind], start_rows[ind])
+    writer.flush()
+
+    np.testing.assert_array_equal(hdu.data, expected)
+    if max_bytes == 0:
+        assert hdu.nwrite == npix.size
+    elif max_bytes > expected.nbytes:
+        assert hdu.nwrite == 1
+
+
+@pytest.mark.parametrize(
+    'backend', ['multiprocessing', 'loky', 'threading', 'sequential'],
+)
+def test_maker_joblib(backend):
+    from meds.maker import MEDSMaker
+
+    rng = np.random.RandomState(105)
+    with tempfile.TemporaryDirectory() as tdir:
+        obj_data, image_info = make_fake_maker_inputs(tdir, rng)
+
+        config = {
+            'cutout_types': ['image', 'weight', 'seg', 'bmask'],
+            'unusable_bmask': 4,
+            'cutout_buffer_bytes': 20000,
+        }
+        fname = os.path.join(tdir, 'test-meds.fits')
+        MEDSMaker(obj_data, image_info, config=config).write(fname)
+
+        # the images are about 10 on a background of 10
+        with meds.MEDS(fname) as m:
+            iobj = np.argmax(m['ncutout'])
+            assert abs(m.get_mosaic(iobj).mean()) < 1
+
+        config['joblib'] = {'backend': backend, 'max_workers': 2}
+        jname = os.path.join(tdir, 'test-meds-joblib.fits')
+        MEDSMaker(obj_data, image_info, config=config).write(jname)
+
+        with open(fname, 'rb') as f, open(jname, 'rb') as fj:
+            assert f.read() == fj.read()
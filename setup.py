@@ -15,12 +15,20 @@ scripts = [
     'meds-extract-catalog',
     'meds-view',
     'meds-compare',
+    'meds-add-derived',
+    'meds-plan-chunks',
 ]
 scripts = [os.path.join('./scripts', s) for s in scripts]
 
 sources = ["meds/_uberseg.c"]
 include_dirs = [numpy.get_include()]
-ext = Extension("meds._uberseg", sources, include_dirs=include_dirs)
+ext = Extension(
+    "meds._uberseg",
+    sources,
+    include_dirs=include_dirs,
+    extra_compile_args=['-pthread'],
+    extra_link_args=['-pthread'],
+)
 
 setup(
     name="meds",